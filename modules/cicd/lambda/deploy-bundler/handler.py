@@ -1,23 +1,32 @@
+import collections
+import contextlib
 import fnmatch
+import hashlib
+import io
 import json
 import logging
+import mmap
 import os
+import random
 import re
+import resource
 import shutil
+import struct
 import tempfile
+import threading
+import time
+import uuid
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from urllib.parse import unquote_plus
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
-S3_CLIENT = boto3.client("s3")
-CODEDEPLOY_CLIENT = boto3.client("codedeploy")
-SSM_CLIENT = boto3.client("ssm")
-
 AUTO_DEPLOY = os.getenv("AUTO_DEPLOY", "true").lower() == "true"
 CODEDEPLOY_APP_NAME = os.getenv("CODEDEPLOY_APP_NAME", "")
 CODEDEPLOY_SERVICE_ROLE_ARN = os.getenv("CODEDEPLOY_SERVICE_ROLE_ARN", "")
@@ -28,13 +37,124 @@ DEFAULT_DEPLOYMENT_CONFIG = os.getenv(
 DEFAULT_AUTO_ROLLBACK = os.getenv("DEFAULT_AUTO_ROLLBACK", "true").lower() == "true"
 SSM_KMS_KEY_ID = os.getenv("SSM_KMS_KEY_ID", "")
 
+BUNDLE_MODE_EXTRACT = "extract"
+BUNDLE_MODE_STREAM = "stream"
+BUNDLE_MODES = (BUNDLE_MODE_EXTRACT, BUNDLE_MODE_STREAM)
+DEFAULT_BUNDLE_MODE = os.getenv("DEFAULT_BUNDLE_MODE", BUNDLE_MODE_EXTRACT).lower()
+DEFAULT_DOWNLOAD_WORKERS = int(os.getenv("DEFAULT_DOWNLOAD_WORKERS", "4"))
+DEFAULT_BUNDLE_CACHE = os.getenv("DEFAULT_BUNDLE_CACHE", "true").lower() == "true"
+DEFAULT_INCREMENTAL = os.getenv("DEFAULT_INCREMENTAL", "true").lower() == "true"
+DEFAULT_COALESCE_WINDOW_SECONDS = float(os.getenv("DEFAULT_COALESCE_WINDOW_SECONDS", "0"))
+DEFAULT_DELTA_BUNDLES = os.getenv("DEFAULT_DELTA_BUNDLES", "false").lower() == "true"
+# Deploy the full bundle once the changed files exceed this share of its app/ bytes.
+DELTA_MAX_RATIO = float(os.getenv("DELTA_MAX_RATIO", "0.5"))
+SSM_SEED_WORKERS = int(os.getenv("SSM_SEED_WORKERS", "4"))
+CODEDEPLOY_CACHE_TTL_SECONDS = float(os.getenv("CODEDEPLOY_CACHE_TTL_SECONDS", "300"))
+# Bucket holding queued (pending) deployments for CodeDeploy completion events.
+ARTIFACT_BUCKET = os.getenv("ARTIFACT_BUCKET", "")
+# Opt-in: bundle_all prefixes list their sources from an event-maintained index.
+DEFAULT_SOURCE_INDEX = os.getenv("DEFAULT_SOURCE_INDEX", "false").lower() == "true"
+# bundle_all prefixes re-list their sources once the source index is this old.
+SOURCE_INDEX_RECONCILE_SECONDS = float(os.getenv("SOURCE_INDEX_RECONCILE_SECONDS", "3600"))
+# "local:<dir>" keeps source indexes in local files (tests, benchmarks) instead of S3.
+SOURCE_INDEX_LOCATION = os.getenv("SOURCE_INDEX_LOCATION", "")
+
+DEPLOY_POLICY_SUPERSEDE = "supersede"
+DEPLOY_POLICY_QUEUE_LATEST = "queue-latest"
+DEPLOY_POLICY_SKIP_SAME_REVISION = "skip-same-revision"
+DEPLOY_POLICIES = (
+    DEPLOY_POLICY_SUPERSEDE,
+    DEPLOY_POLICY_QUEUE_LATEST,
+    DEPLOY_POLICY_SKIP_SAME_REVISION,
+)
+DEFAULT_DEPLOY_POLICY = os.getenv(
+    "DEFAULT_DEPLOY_POLICY", DEPLOY_POLICY_SKIP_SAME_REVISION
+).lower()
+
 try:
     PREFIX_CONFIG = json.loads(os.getenv("PREFIX_CONFIG", "{}"))
 except json.JSONDecodeError:
     LOGGER.error("Invalid PREFIX_CONFIG JSON. Defaulting to empty config.")
     PREFIX_CONFIG = {}
 
+# Asynchronous pipeline: {"build": url, "register": url, "deploy": url} of FIFO
+# queues ("local:..." URLs use the in-process stand-in). Empty processes inline.
+PIPELINE_STAGES = ("build", "register", "deploy")
+try:
+    PIPELINE_QUEUE_URLS = json.loads(os.getenv("PIPELINE_QUEUE_URLS", "{}"))
+except json.JSONDecodeError:
+    LOGGER.error("Invalid PIPELINE_QUEUE_URLS JSON. Processing uploads inline.")
+    PIPELINE_QUEUE_URLS = {}
+if PIPELINE_QUEUE_URLS and set(PIPELINE_QUEUE_URLS) != set(PIPELINE_STAGES):
+    LOGGER.error("PIPELINE_QUEUE_URLS needs exactly %s. Processing uploads inline.", PIPELINE_STAGES)
+    PIPELINE_QUEUE_URLS = {}
+
+try:
+    S3_TRANSFER_CONFIG = json.loads(os.getenv("S3_TRANSFER_CONFIG", "{}"))
+except json.JSONDecodeError:
+    LOGGER.error("Invalid S3_TRANSFER_CONFIG JSON. Using default transfer profile.")
+    S3_TRANSFER_CONFIG = {}
+
+MB = 1024 * 1024
+DEFAULT_TRANSFER_PROFILE = {
+    "multipart_threshold_mb": 64,
+    "multipart_chunksize_mb": 16,
+    "max_concurrency": 10,
+    "spool_max_mb": 64,
+}
+
 IGNORE_ENTRIES = {"__MACOSX", ".DS_Store"}
+BUNDLE_CACHE_VERSION = 3
+BUNDLE_CACHE_DIR = ".bundle-cache"
+# Prefix settings that change what a build produces. SSM seeding is included
+# because a cache hit skips it; deploy and performance knobs are not.
+BUNDLE_CACHE_CONFIG_KEYS = ("bundle_all", "allowed_names", "ssm_base_path", "ssm_files", "seed_ssm")
+BUNDLE_DIGEST_METADATA = "bundle-digest"
+BUNDLE_MANIFEST_VERSION = 2
+BUNDLE_MANIFEST_NAME = ".bundle-manifest.json"
+# Every bundle lists its members' CRC32, size and SHA-256, hashed while zipping;
+# deltas and instances compare these.
+BUNDLE_FILES_VERSION = 2
+BUNDLE_FILES_NAME = "bundle-files.json"
+BUNDLE_FILES_SUFFIX = ".files.json"
+BUNDLE_FILES_METADATA = "bundle-files"
+DELTA_DIR = ".bundle-delta"
+NOT_FOUND_CODES = ("NoSuchKey", "404", "NotFound")
+CONDITIONAL_WRITE_CODES = ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+BUILD_MARKER_NAME = ".bundle-started.json"
+BUILD_MARKER_CLAIM_ATTEMPTS = 5
+PIPELINE_DIR = ".pipeline"
+LOCAL_QUEUE_SCHEME = "local:"
+SQS_DEDUP_WINDOW_SECONDS = 300
+PENDING_DEPLOY_DIR = ".bundler/pending-deploy"
+# Current source zips of a bundle_all prefix: {key: [etag, sequencer, modified]},
+# kept up to date from S3 events; removed keys keep a null etag until the next
+# re-list.
+SOURCE_INDEX_NAME = ".source-index.json"
+SOURCE_INDEX_VERSION = 1
+SOURCE_INDEX_UPDATE_ATTEMPTS = 5
+ACTIVE_DEPLOYMENT_STATUSES = ["Created", "Queued", "InProgress", "Baking", "Ready"]
+BATCH_GET_DEPLOYMENTS_LIMIT = 25
+SUPERSEDE_WAIT_SECONDS = 60
+SUPERSEDE_POLL_SECONDS = 5
+COALESCE_SAFETY_SECONDS = 60
+# Re-invocations for a failed coalesced build, like Lambda's async retries.
+COALESCE_RETRY_LIMIT = 2
+BUNDLE_APP_DIR = "app"
+COPY_BUFFER_SIZE = 1024 * 1024
+RAW_COPY_COMPRESS_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+ZIP_FLAG_ENCRYPTED = 0x01
+ZIP_FLAG_COMPRESS_OPTIONS = 0x06
+SSM_GET_PARAMETERS_BATCH = 10
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "TooManyUpdates",
+}
+THROTTLE_MAX_ATTEMPTS = 6
+THROTTLE_BACKOFF_BASE_SECONDS = 0.25
+THROTTLE_BACKOFF_CAP_SECONDS = 8
 DEFAULT_SSM_FILES = [
     "appsettings.json",
     "web.config",
@@ -42,228 +162,2062 @@ DEFAULT_SSM_FILES = [
     "SystemSettingsSqlDbAccess.xml",
 ]
 
+CLIENT_RETRY_MODE = os.getenv("CLIENT_RETRY_MODE", "adaptive")
+CLIENT_MAX_ATTEMPTS = int(os.getenv("CLIENT_MAX_ATTEMPTS", "8"))
+# Per-service cap on in-flight calls; also the size of the connection pool.
+# S3 has to cover download workers x transfer concurrency.
+DEFAULT_CLIENT_LIMITS = {"s3": 64, "codedeploy": 4, "ssm": 8}
+try:
+    CLIENT_LIMITS = {**DEFAULT_CLIENT_LIMITS, **json.loads(os.getenv("CLIENT_LIMITS", "{}"))}
+except json.JSONDecodeError:
+    LOGGER.error("Invalid CLIENT_LIMITS JSON. Using default client limits.")
+    CLIENT_LIMITS = dict(DEFAULT_CLIENT_LIMITS)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Ajyal/DeployBundler")
+METRICS_FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "deploy-bundler")
+SPAN_METRICS = (
+    ("Duration", "duration_ms", "Milliseconds"),
+    ("Bytes", "bytes", "Bytes"),
+    ("Files", "files", "Count"),
+    ("PeakTmpBytes", "peak_tmp_bytes", "Bytes"),
+    ("PeakRssBytes", "peak_rss_bytes", "Bytes"),
+)
+# Downloads sample /tmp usage for PeakTmpBytes every this many bytes
+TMP_SAMPLE_BYTES = 8 * MB
+
+# boto3 and its clients are imported/built on first use, so events that are
+# skipped (non-zip, output objects) never pay for them.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+_CLIENT_STATS = {}
+_CLIENT_STATS_LOCK = threading.Lock()
+# Per-stage spans for the current invocation, keyed by stage name.
+_SPANS = {}
+_SPANS_LOCK = threading.Lock()
+
+
+def _client(service):
+    """Memoized client for service, shared by warm invocations."""
+    client = _CLIENTS.get(service)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(service)
+            if client is None:
+                client = _CLIENTS[service] = _make_client(service)
+    return client
+
+
+def _make_client(service):
+    """Client with adaptive retries, a sized pool, a call cap and retry stats."""
+    import boto3  # pylint: disable=import-outside-toplevel
+    from botocore.config import Config  # pylint: disable=import-outside-toplevel
+
+    limit = int(CLIENT_LIMITS.get(service, 10))
+    client = boto3.client(
+        service,
+        config=Config(
+            retries={"mode": CLIENT_RETRY_MODE, "total_max_attempts": CLIENT_MAX_ATTEMPTS},
+            max_pool_connections=limit,
+        ),
+    )
+    slots = threading.BoundedSemaphore(limit)
+
+    def acquire(context, **_kwargs):
+        slots.acquire()
+        context["client_slot"] = True
+
+    def release(context, parsed=None, **_kwargs):
+        if context.pop("client_slot", False):
+            slots.release()
+        _record_client_call(service, parsed)
+
+    client.meta.events.register_first("before-call.*.*", acquire)
+    client.meta.events.register("after-call.*.*", release)
+    client.meta.events.register("after-call-error.*.*", release)
+    return client
+
+
+def _record_client_call(service, parsed):
+    metadata = (parsed or {}).get("ResponseMetadata", {})
+    code = (parsed or {}).get("Error", {}).get("Code")
+    with _CLIENT_STATS_LOCK:
+        stats = _CLIENT_STATS.setdefault(
+            service, {"calls": 0, "retries": 0, "throttled": 0, "errors": 0}
+        )
+        stats["calls"] += 1
+        stats["retries"] += metadata.get("RetryAttempts", 0)
+        if code in THROTTLING_ERROR_CODES:
+            stats["throttled"] += 1
+        elif parsed is None or code:
+            stats["errors"] += 1
+
+
+def _pop_client_stats():
+    with _CLIENT_STATS_LOCK:
+        stats = dict(_CLIENT_STATS)
+        _CLIENT_STATS.clear()
+    return stats
+
+
+@contextlib.contextmanager
+def _span(stage):
+    """Time a stage; callers add "bytes" and "files" to the yielded dict.
+
+    Spans of the same stage (one per download worker, say) are summed, so
+    durations are busy time rather than wall-clock time. /tmp usage is
+    sampled at the end; stages that fill and drain /tmp also sample as they
+    go with _sample_tmp_usage.
+    """
+    span = {"bytes": 0, "files": 0, "peak_tmp_bytes": 0}
+    started = time.perf_counter()
+    try:
+        yield span
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        tmp_bytes = max(span["peak_tmp_bytes"], _tmp_usage_bytes())
+        rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        with _SPANS_LOCK:
+            stats = _SPANS.setdefault(
+                stage,
+                {
+                    "count": 0,
+                    "duration_ms": 0.0,
+                    "bytes": 0,
+                    "files": 0,
+                    "peak_tmp_bytes": 0,
+                    "peak_rss_bytes": 0,
+                },
+            )
+            stats["count"] += 1
+            stats["duration_ms"] += duration_ms
+            stats["bytes"] += span["bytes"]
+            stats["files"] += span["files"]
+            stats["peak_tmp_bytes"] = max(stats["peak_tmp_bytes"], tmp_bytes)
+            stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], rss_bytes)
+
+
+def _sample_tmp_usage(span):
+    span["peak_tmp_bytes"] = max(span["peak_tmp_bytes"], _tmp_usage_bytes())
+
+
+def _tmp_sampler(span):
+    """Transfer callback sampling /tmp usage every TMP_SAMPLE_BYTES received."""
+    received = [0]
+
+    def callback(amount):
+        received[0] += amount
+        if received[0] >= TMP_SAMPLE_BYTES:
+            received[0] = 0
+            _sample_tmp_usage(span)
+
+    return callback
+
+
+def _tmp_usage_bytes():
+    # /tmp is its own volume in Lambda, so its used bytes are ours.
+    try:
+        return shutil.disk_usage(tempfile.gettempdir()).used
+    except OSError:
+        return 0
+
+
+def _pop_spans():
+    with _SPANS_LOCK:
+        spans = dict(_SPANS)
+        _SPANS.clear()
+    for stats in spans.values():
+        stats["duration_ms"] = round(stats["duration_ms"], 1)
+    return spans
+
+
+def _emit_span_metrics(spans):
+    """Write one Embedded Metric Format document per stage to stdout.
+
+    EMF lines must be bare JSON, so they bypass the logging formatter.
+    """
+    if not METRICS_ENABLED:
+        return
+    timestamp = int(time.time() * 1000)
+    for stage, stats in spans.items():
+        document = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["FunctionName", "Stage"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, _field, unit in SPAN_METRICS
+                        ],
+                    }
+                ],
+            },
+            "FunctionName": METRICS_FUNCTION_NAME,
+            "Stage": stage,
+            "Count": stats["count"],
+        }
+        for name, field, _unit in SPAN_METRICS:
+            document[name] = stats[field]
+        print(json.dumps(document, separators=(",", ":")), flush=True)
+
+
+def _metrics_summary(spans, started):
+    return {
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "peak_tmp_bytes": max((stats["peak_tmp_bytes"] for stats in spans.values()), default=0),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "stages": spans,
+    }
+
+
+def _build_prefix_trie(prefix_config):
+    """Character trie over the configured prefixes; a node's None entry is a match."""
+    root = {}
+    for prefix, config in prefix_config.items():
+        if not prefix:
+            continue
+        node = root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = (prefix, config)
+    return root
+
+
+def _compile_allowed_names(allowed_names):
+    """One regex for a list of fnmatch-style globs (case-sensitive, full match)."""
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in allowed_names))
+
+
+# Routing tables are built once per container from PREFIX_CONFIG.
+PREFIX_TRIE = _build_prefix_trie(PREFIX_CONFIG)
+OUTPUT_PREFIXES = tuple(
+    sorted({cfg["output_prefix"] for cfg in PREFIX_CONFIG.values() if cfg.get("output_prefix")})
+)
+_ALLOWED_NAME_PATTERNS = {
+    tuple(cfg["allowed_names"]): _compile_allowed_names(cfg["allowed_names"])
+    for cfg in PREFIX_CONFIG.values()
+    if cfg.get("allowed_names")
+}
+
+
+def handler(event, context):
+    started = time.perf_counter()
+    _pop_spans()
+    if event.get("source") == "aws.codedeploy":
+        results = [_handle_deployment_event(event)]
+        LOGGER.info("AWS client calls: %s", json.dumps(_pop_client_stats(), sort_keys=True))
+        spans = _pop_spans()
+        _emit_span_metrics(spans)
+        return {"results": results, "metrics": _metrics_summary(spans, started)}
+
+    if event.get("Records") and event["Records"][0].get("eventSource") == "aws:sqs":
+        results, failures = _handle_stage_messages(event["Records"])
+        results.extend(_drain_local_queue())
+        LOGGER.info("AWS client calls: %s", json.dumps(_pop_client_stats(), sort_keys=True))
+        spans = _pop_spans()
+        _emit_span_metrics(spans)
+        return {
+            "batchItemFailures": failures,
+            "results": results,
+            "metrics": _metrics_summary(spans, started),
+        }
 
-def handler(event, _context):
     results = []
-    records = event.get("Records", [])
+    records = []
 
-    for record in records:
+    for record in event.get("Records", []):
         bucket = record.get("s3", {}).get("bucket", {}).get("name")
         key = record.get("s3", {}).get("object", {}).get("key")
         if not bucket or not key:
             LOGGER.warning("Skipping record with missing bucket/key: %s", record)
             continue
 
-        key = unquote_plus(key)
+        records.append(
+            {
+                "bucket": bucket,
+                "key": unquote_plus(key),
+                "etag": record.get("s3", {}).get("object", {}).get("eTag"),
+                "sequencer": record.get("s3", {}).get("object", {}).get("sequencer", ""),
+                "removed": record.get("eventName", "").startswith("ObjectRemoved"),
+                "event_time": _parse_event_time(record.get("eventTime")),
+                "index": len(records),
+                "event": record,
+            }
+        )
+        results.append(None)
+
+    index_errors = _update_source_indexes(records)
+    uploads = []
+    for record in records:
+        if record["index"] in index_errors:
+            status, detail = "error", index_errors[record["index"]]
+        elif record["removed"]:
+            status, detail = "ok", "skipped: removed"
+        else:
+            uploads.append(record)
+            continue
+        results[record["index"]] = {"key": record["key"], "status": status, "detail": detail}
+
+    for group in _coalesce_records(uploads):
+        latest = group[-1]
+        key = latest["key"]
+        for superseded in group[:-1]:
+            LOGGER.info("Coalescing %s into %s", superseded["key"], key)
+            results[superseded["index"]] = {
+                "key": superseded["key"],
+                "status": "ok",
+                "detail": f"skipped: superseded by {key}",
+            }
+
         try:
-            result = _process_object(bucket, key)
-            results.append({"key": key, "status": "ok", "detail": result})
+            covered_by = _wait_for_coalesce_window(latest, context)
+            if covered_by:
+                result = f"skipped: covered by bundle started at {covered_by}"
+            elif PIPELINE_QUEUE_URLS:
+                result = _enqueue_object(latest)
+            else:
+                result = _process_object(latest["bucket"], key, latest["etag"])
+            results[latest["index"]] = {"key": key, "status": "ok", "detail": result}
         except Exception as exc:  # pylint: disable=broad-exception-caught
             LOGGER.exception("Failed to process %s", key)
-            results.append({"key": key, "status": "error", "detail": str(exc)})
+            results[latest["index"]] = {"key": key, "status": "error", "detail": str(exc)}
+            if latest.get("build_marker"):
+                _expire_build_marker(latest)
+                _retry_claim(latest, event.get("coalesce_retry", 0), context)
+
+    response = {"results": results}
+    if _LOCAL_QUEUE.messages:
+        response["pipeline"] = _drain_local_queue()
+
+    LOGGER.info("AWS client calls: %s", json.dumps(_pop_client_stats(), sort_keys=True))
+    spans = _pop_spans()
+    _emit_span_metrics(spans)
+    response["metrics"] = _metrics_summary(spans, started)
+    return response
+
+
+def _parse_event_time(value):
+    if not value:
+        return time.time()
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _coalesce_records(records):
+    """Group records that would produce the same bundle, oldest first.
+
+    All uploads under a bundle_all prefix rebuild the same bundle, and repeated
+    events for one key rebuild the same per-service bundle, so only the latest
+    record in each group needs to be processed.
+    """
+    groups = {}
+    for record in records:
+        key = record["key"]
+        prefix, config = _match_prefix(key)
+        if not config or not key.lower().endswith(".zip") or _is_output_key(key):
+            group_key = ("record", record["index"])
+        elif config.get("bundle_all", False):
+            group_key = ("prefix", record["bucket"], prefix)
+        else:
+            group_key = ("key", record["bucket"], key)
+        groups.setdefault(group_key, []).append(record)
+
+    ordered = []
+    for group in groups.values():
+        group.sort(key=lambda item: (item["event_time"], item["index"]))
+        ordered.append(group)
+    ordered.sort(key=lambda group: group[-1]["index"])
+    return ordered
+
+
+def _wait_for_coalesce_window(record, context):
+    """Debounce bursts across invocations for bundle_all prefixes.
+
+    Waits until the record is coalesce_window_seconds old, then checks the
+    prefix's build marker. A build that started after this upload (and after
+    its source index update) already listed it, so the record is covered;
+    otherwise the marker is claimed with a conditional write and the caller
+    builds. Claims that lose a race re-check the winner's marker. A claimed
+    record is stamped with build_marker so a failed build can expire it.
+    Returns the covering build's start time, or "".
+    """
+    key = record["key"]
+    _prefix, config = _match_prefix(key)
+    if not config or not config.get("bundle_all", False) or _is_output_key(key):
+        return ""
+    window = float(config.get("coalesce_window_seconds", DEFAULT_COALESCE_WINDOW_SECONDS))
+    output_prefix = config.get("output_prefix")
+    if window <= 0 or not output_prefix or not key.lower().endswith(".zip"):
+        return ""
+
+    delay = record["event_time"] + window - time.time()
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        budget = context.get_remaining_time_in_millis() / 1000.0 - COALESCE_SAFETY_SECONDS
+        delay = min(delay, budget)
+    if delay > 0:
+        LOGGER.info("Waiting %.1fs for more uploads under %s", delay, output_prefix)
+        time.sleep(delay)
+
+    bucket = record["bucket"]
+    marker_key = f"{output_prefix}{BUILD_MARKER_NAME}"
+    # A retried invocation must not count its own earlier claim as coverage.
+    claim = f"{key}@{record['event_time']}"
+    for _attempt in range(BUILD_MARKER_CLAIM_ATTEMPTS):
+        try:
+            response = _client("s3").get_object(Bucket=bucket, Key=marker_key)
+            marker = json.loads(response["Body"].read())
+            etag = response.get("ETag")
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] not in NOT_FOUND_CODES:
+                raise
+            marker, etag = {}, None
+
+        started_at = float(marker.get("started_at", 0))
+        if marker.get("claim") != claim and started_at >= max(
+            record["event_time"], record.get("indexed_at", 0)
+        ):
+            LOGGER.info("Upload %s is covered by a build started at %s", key, started_at)
+            return datetime.fromtimestamp(started_at, timezone.utc).isoformat()
+
+        body = {"started_at": time.time(), "key": key, "claim": claim}
+        new_etag = _put_if_unchanged(bucket, marker_key, body, etag)
+        if new_etag is not None:
+            record["build_marker"] = (bucket, marker_key, new_etag)
+            return ""
+    raise RuntimeError(f"Build marker {marker_key} kept changing; could not claim it")
+
+
+def _expire_build_marker(record):
+    """Reset a failed build's marker so the uploads it covered get rebuilt."""
+    bucket, marker_key, etag = record["build_marker"]
+    try:
+        expired = _put_if_unchanged(bucket, marker_key, {"started_at": 0}, etag)
+    except (ClientError, ParamValidationError):
+        LOGGER.exception("Failed to expire build marker %s", marker_key)
+        return
+    if expired is None:
+        LOGGER.info("Build marker %s was claimed again; leaving it", marker_key)
+
+
+def _retry_claim(record, attempt, context):
+    """Re-run a failed coalesced build in a new invocation.
+
+    Other invocations skipped their uploads in favour of this build, so it has
+    to be retried, but failing the whole invocation would also rerun the
+    records that succeeded. Only this record is re-sent, up to
+    COALESCE_RETRY_LIMIT times.
+    """
+    key = record["key"]
+    if attempt >= COALESCE_RETRY_LIMIT or not hasattr(context, "invoked_function_arn"):
+        LOGGER.error("Not retrying coalesced build for %s; the next upload will rebuild it", key)
+        return
+    LOGGER.info("Retrying coalesced build for %s in a new invocation (attempt %d)", key, attempt + 1)
+    try:
+        _client("lambda").invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps({"Records": [record["event"]], "coalesce_retry": attempt + 1}),
+        )
+    except ClientError:
+        LOGGER.exception("Failed to re-invoke for %s; the next upload will rebuild it", key)
 
-    return {"results": results}
 
+def _put_if_unchanged(bucket, key, document, etag):
+    """Put a small JSON object only if key still has etag (None: does not exist).
 
-def _process_object(bucket, key):
+    Returns the new ETag, or None when the object changed in the meantime.
+    Where put_object predates conditional writes, the write is unconditional.
+    """
+    put_args = {
+        "Bucket": bucket,
+        "Key": key,
+        "Body": json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        response = _client("s3").put_object(**put_args, **condition)
+    except ParamValidationError:
+        LOGGER.warning("put_object does not support conditional writes; writing %s as-is", key)
+        response = _client("s3").put_object(**put_args)
+    except ClientError as exc:
+        code = exc.response["Error"]["Code"]
+        if code in CONDITIONAL_WRITE_CODES or code in NOT_FOUND_CODES:
+            return None
+        raise
+    return response.get("ETag", "")
+
+
+def _is_output_key(key):
+    return key.startswith(OUTPUT_PREFIXES)
+
+
+def _process_object(bucket, key, etag=None):
+    build = _build_object(bucket, key, etag)
+    if isinstance(build, str):
+        return build
+    with _span("codedeploy"):
+        target = _register_revision(build, register=AUTO_DEPLOY)
+        _trigger_deployment(build, target)
+    return build["output_key"]
+
+
+def _route_object(key):
+    """(skip reason, prefix, config) for an uploaded key; the reason is "" when routed."""
     if not key.lower().endswith(".zip"):
         LOGGER.info("Skipping non-zip object: %s", key)
-        return "skipped: non-zip"
+        return "skipped: non-zip", "", None
 
-    for cfg in PREFIX_CONFIG.values():
-        output_prefix = cfg.get("output_prefix", "")
-        if output_prefix and key.startswith(output_prefix):
-            LOGGER.info("Skipping already-processed object: %s", key)
-            return "skipped: output"
+    if _is_output_key(key):
+        LOGGER.info("Skipping already-processed object: %s", key)
+        return "skipped: output", "", None
 
     prefix, config = _match_prefix(key)
     if not config:
         LOGGER.info("No prefix match for object: %s", key)
-        return "skipped: no prefix"
-
-    template_name = config.get("template")
-    output_prefix = config.get("output_prefix")
-    deployment_group = config.get("deployment_group", "")
-    allowed_names = config.get("allowed_names", [])
-    bundle_all = config.get("bundle_all", False)
-    app_name_prefix = config.get("app_name_prefix", "")
-    asg_name = config.get("asg_name", "")
-    target_group_name = config.get("target_group_name", "")
-    deployment_config_name = config.get("deployment_config_name") or DEFAULT_DEPLOYMENT_CONFIG
-    auto_rollback = config.get("auto_rollback", DEFAULT_AUTO_ROLLBACK)
-    ssm_base_path = config.get("ssm_base_path", "")
-    ssm_files = config.get("ssm_files", [])
-    seed_ssm = config.get("seed_ssm", True)
+        return "skipped: no prefix", "", None
 
-    if not template_name or not output_prefix:
+    if not config.get("template") or not config.get("output_prefix"):
         raise ValueError("Missing template or output_prefix in PREFIX_CONFIG")
 
+    allowed_names = config.get("allowed_names", [])
     base_name = os.path.splitext(os.path.basename(key))[0]
     if allowed_names and not _matches_allowed(base_name, allowed_names):
         LOGGER.info("Skipping %s not in allowed_names patterns", base_name)
-        return "skipped: not allowed"
+        return "skipped: not allowed", prefix, config
+
+    return "", prefix, config
+
+
+def _output_key(key, config):
+    base_name = os.path.splitext(os.path.basename(key))[0]
+    return f"{config['output_prefix']}{base_name}-deploy.zip"
+
+
+def _build_object(bucket, key, etag=None):
+    """Build (or reuse) the bundle for key; returns a skip reason or the build.
+
+    The build is {"bucket", "key", "output_key", "service_names",
+    "bundle_etag", "files_id"}; the later stages re-derive everything else
+    from PREFIX_CONFIG.
+    """
+    skipped, prefix, config = _route_object(key)
+    if skipped:
+        return skipped
+
+    template_name = config.get("template")
+    output_prefix = config.get("output_prefix")
+    bundle_all = config.get("bundle_all", False)
+    base_name = os.path.splitext(os.path.basename(key))[0]
 
-    source_keys = [key]
+    source_keys = {key: _normalize_etag(etag)}
     if bundle_all:
-        source_keys = _list_source_keys(bucket, prefix, output_prefix, allowed_names)
+        with _span("list") as span:
+            source_keys = _source_keys(bucket, prefix, config)
+            span["files"] = len(source_keys)
         if not source_keys:
             LOGGER.info("No source zips found under %s", prefix)
             return "skipped: no sources"
 
+    bundle_mode = (config.get("bundle_mode") or DEFAULT_BUNDLE_MODE).lower()
+    if bundle_mode not in BUNDLE_MODES:
+        raise ValueError(f"Unsupported bundle_mode in PREFIX_CONFIG: {bundle_mode}")
+    download_workers = int(config.get("download_workers") or DEFAULT_DOWNLOAD_WORKERS)
+    transfer_profile = _transfer_profile(config)
+    transfer_config = _transfer_config(transfer_profile)
+
+    output_key = _output_key(key, config)
+
+    cache_key = ""
+    cached = None
+    if config.get("bundle_cache", DEFAULT_BUNDLE_CACHE):
+        with _span("cache"):
+            cache_key = _bundle_cache_key(bucket, source_keys, template_name, config)
+            cached = _load_cached_bundle(bucket, output_prefix, cache_key)
+
+    if cached:
+        LOGGER.info(
+            "Reusing cached bundle s3://%s/%s for %s", bucket, cached["bundle_key"], key
+        )
+        if cached["bundle_key"] != output_key:
+            with _span("cache_copy"):
+                _copy_cached_bundle(
+                    bucket,
+                    cached["bundle_key"],
+                    output_key,
+                    cache_key,
+                    transfer_config,
+                    files_id=cached.get("files_id", ""),
+                )
+        service_names = cached.get("services", [])
+    else:
+        service_names, files_id = _build_bundle(
+            bucket=bucket,
+            base_name=base_name,
+            source_keys=source_keys,
+            config=config,
+            bundle_mode=bundle_mode,
+            download_workers=download_workers,
+            transfer_profile=transfer_profile,
+            transfer_config=transfer_config,
+            output_key=output_key,
+            cache_key=cache_key,
+        )
+        if cache_key:
+            _store_cached_bundle(
+                bucket, output_prefix, cache_key, output_key, service_names, files_id
+            )
+
+    # Deployments pin this exact object, so a rebuild is a new revision.
+    head = _client("s3").head_object(Bucket=bucket, Key=output_key)
+    return {
+        "bucket": bucket,
+        "key": key,
+        "output_key": output_key,
+        "service_names": service_names,
+        "bundle_etag": _normalize_etag(head.get("ETag")),
+        "files_id": head.get("Metadata", {}).get(BUNDLE_FILES_METADATA, ""),
+    }
+
+
+def _register_revision(build, register=False):
+    """Ensure the CodeDeploy app/group for a build; returns the deployment target.
+
+    The target is {"application", "deployment_group"}, or None when there is
+    nothing to deploy to. With register, the bundle is also registered as an
+    application revision.
+    """
+    _prefix, config = _match_prefix(build["key"])
+    service_names = build["service_names"]
+    base_name = os.path.splitext(os.path.basename(build["key"]))[0]
+    primary_service_name = service_names[0] if len(service_names) == 1 else base_name
+    codedeploy_app_name = _build_codedeploy_app_name(
+        config.get("app_name_prefix", ""), _sanitize_codedeploy_name(primary_service_name)
+    )
+    deployment_group_name = (
+        _build_deployment_group_name(codedeploy_app_name)
+        if codedeploy_app_name
+        else ""
+    )
+
+    if codedeploy_app_name and deployment_group_name:
+        _ensure_codedeploy_app(codedeploy_app_name)
+        group_ready = _ensure_deployment_group(
+            app_name=codedeploy_app_name,
+            deployment_group_name=deployment_group_name,
+            service_role_arn=CODEDEPLOY_SERVICE_ROLE_ARN,
+            asg_name=config.get("asg_name", ""),
+            target_group_name=config.get("target_group_name", ""),
+            deployment_config_name=config.get("deployment_config_name") or DEFAULT_DEPLOYMENT_CONFIG,
+            auto_rollback=config.get("auto_rollback", DEFAULT_AUTO_ROLLBACK),
+        )
+        if not group_ready:
+            if AUTO_DEPLOY:
+                LOGGER.warning(
+                    "Auto-deploy enabled but deployment group is not ready for %s",
+                    codedeploy_app_name,
+                )
+            return None
+        target = {"application": codedeploy_app_name, "deployment_group": deployment_group_name}
+    elif CODEDEPLOY_APP_NAME and config.get("deployment_group"):
+        target = {"application": CODEDEPLOY_APP_NAME, "deployment_group": config["deployment_group"]}
+    else:
+        if AUTO_DEPLOY:
+            LOGGER.warning(
+                "Auto-deploy enabled but missing CodeDeploy app/deployment group configuration"
+            )
+        return None
+
+    if register:
+        _register_application_revision(build, target)
+    return target
+
+
+def _register_application_revision(build, target):
+    LOGGER.info("Registering revision s3://%s/%s", build["bucket"], build["output_key"])
+    _client("codedeploy").register_application_revision(
+        applicationName=target["application"],
+        revision=_bundle_revision(build),
+        description=f"Bundle for {build['key']}",
+    )
+
+
+def _bundle_revision(build):
+    return _s3_revision(build["bucket"], build["output_key"], build.get("bundle_etag"))
+
+
+def _s3_revision(bucket, key, etag=""):
+    location = {"bucket": bucket, "key": key, "bundleType": "zip"}
+    if _normalize_etag(etag):
+        location["eTag"] = _normalize_etag(etag)
+    return {"revisionType": "S3", "s3Location": location}
+
+
+def _trigger_deployment(build, target):
+    """Deploy build to target under the prefix's deploy_policy.
+
+    A revision that is already deploying is never deployed again, and
+    skip-same-revision also skips the group's last successful one. When
+    other deployments are active, supersede stops them first, queue-latest
+    parks the build until the group is idle (newer builds replace it), and
+    skip-same-revision creates the deployment anyway. With delta_bundles the
+    revision is a delta against the group's last deployment. Returns the
+    deployment id, or a skip/queue detail.
+    """
+    if not AUTO_DEPLOY or not target:
+        return ""
+    _prefix, config = _match_prefix(build["key"])
+    policy = ((config or {}).get("deploy_policy") or DEFAULT_DEPLOY_POLICY).lower()
+    if policy not in DEPLOY_POLICIES:
+        raise ValueError(f"Unsupported deploy_policy in PREFIX_CONFIG: {policy}")
+
+    revision = _deploy_revision(build, target, config or {})
+    active = _active_deployments(target)
+    for deployment in active:
+        if _same_revision(deployment.get("revision"), revision):
+            LOGGER.info(
+                "Revision already deploying to %s as %s",
+                target["deployment_group"],
+                deployment["deploymentId"],
+            )
+            return f"skipped: already deploying as {deployment['deploymentId']}"
+    # Only this policy pays for the extra get_deployment_group call
+    if (
+        not active
+        and policy == DEPLOY_POLICY_SKIP_SAME_REVISION
+        and _is_current_revision(target, revision)
+    ):
+        LOGGER.info("Revision already deployed to %s", target["deployment_group"])
+        return "skipped: already deployed"
+
+    if active and policy == DEPLOY_POLICY_QUEUE_LATEST and not ARTIFACT_BUCKET:
+        LOGGER.warning("queue-latest needs ARTIFACT_BUCKET; deploying %s now", build["output_key"])
+    elif active and policy == DEPLOY_POLICY_QUEUE_LATEST:
+        _store_pending_deployment(build, target)
+        # The active deployment may have finished before the marker was written.
+        active = _active_deployments(target)
+        if active:
+            LOGGER.info(
+                "Queued %s behind %s", build["output_key"], active[0]["deploymentId"]
+            )
+            return f"queued: behind {active[0]['deploymentId']}"
+        _delete_pending_deployment(ARTIFACT_BUCKET, target)
+
+    wait_seconds = 0
+    if active and policy == DEPLOY_POLICY_SUPERSEDE:
+        for deployment in active:
+            LOGGER.info("Stopping superseded deployment %s", deployment["deploymentId"])
+            try:
+                _client("codedeploy").stop_deployment(
+                    deploymentId=deployment["deploymentId"], autoRollbackEnabled=False
+                )
+            except ClientError as exc:
+                # It may have completed in the meantime.
+                if exc.response["Error"]["Code"] != "DeploymentAlreadyCompletedException":
+                    raise
+        wait_seconds = SUPERSEDE_WAIT_SECONDS
+
+    deployment_id = _create_deployment(build, target, revision, wait_seconds)
+    if build.get("files_id"):
+        _store_delta_base(build, target, revision, config or {})
+    return deployment_id
+
+
+def _create_deployment(build, target, revision, wait_seconds=0):
+    # Stopped deployments take a moment to release the group.
+    deadline = time.monotonic() + wait_seconds
+    LOGGER.info("Triggering CodeDeploy deployment for %s", target["deployment_group"])
+    while True:
+        try:
+            response = _client("codedeploy").create_deployment(
+                applicationName=target["application"],
+                deploymentGroupName=target["deployment_group"],
+                revision=revision,
+                description=f"Auto deployment for {build['key']}",
+            )
+            return response.get("deploymentId", "")
+        except ClientError as exc:
+            if (
+                exc.response["Error"]["Code"] != "DeploymentLimitExceededException"
+                or time.monotonic() >= deadline
+            ):
+                raise
+        time.sleep(SUPERSEDE_POLL_SECONDS)
+
+
+def _active_deployments(target):
+    """Unfinished deployments of the target group, oldest first."""
+    deployment_ids = []
+    paginator = _client("codedeploy").get_paginator("list_deployments")
+    for page in paginator.paginate(
+        applicationName=target["application"],
+        deploymentGroupName=target["deployment_group"],
+        includeOnlyStatuses=ACTIVE_DEPLOYMENT_STATUSES,
+    ):
+        deployment_ids.extend(page.get("deployments", []))
+
+    deployments = []
+    for start in range(0, len(deployment_ids), BATCH_GET_DEPLOYMENTS_LIMIT):
+        response = _client("codedeploy").batch_get_deployments(
+            deploymentIds=deployment_ids[start : start + BATCH_GET_DEPLOYMENTS_LIMIT]
+        )
+        deployments.extend(response.get("deploymentsInfo", []))
+    return sorted(deployments, key=lambda deployment: str(deployment.get("createTime", "")))
+
+
+def _same_revision(revision, other):
+    # Only ETag-pinned revisions can be proven identical.
+    location = (revision or {}).get("s3Location") or {}
+    other_location = (other or {}).get("s3Location") or {}
+    etag = _normalize_etag(location.get("eTag"))
+    return bool(etag) and (
+        location.get("bucket"),
+        location.get("key"),
+        etag,
+    ) == (
+        other_location.get("bucket"),
+        other_location.get("key"),
+        _normalize_etag(other_location.get("eTag")),
+    )
+
+
+def _is_current_revision(target, revision):
+    response = _client("codedeploy").get_deployment_group(
+        applicationName=target["application"], deploymentGroupName=target["deployment_group"]
+    )
+    group_info = response.get("deploymentGroupInfo", {})
+    last_attempt = group_info.get("lastAttemptedDeployment") or {}
+    return (
+        last_attempt.get("status") == "Succeeded"
+        and _same_revision(group_info.get("targetRevision"), revision)
+    )
+
+
+def _target_digest(target):
+    return hashlib.sha1(
+        f"{target['application']}/{target['deployment_group']}".encode("utf-8")
+    ).hexdigest()
+
+
+def _deploy_revision(build, target, config):
+    """The revision to deploy build with: a delta against the group's last
+    deployed bundle when delta_bundles is on, otherwise the full bundle."""
+    files_id = build.get("files_id")
+    if not files_id or not config.get("delta_bundles", DEFAULT_DELTA_BUNDLES):
+        return _bundle_revision(build)
+
+    base = _load_delta_base(build["bucket"], config["output_prefix"], target)
+    if not base:
+        LOGGER.info("No deployed base for %s; using full bundle", target["deployment_group"])
+        return _bundle_revision(build)
+    if base["files_id"] == files_id:
+        # Same files as the group's last deployment: reuse its (immutable) delta
+        # so the same-revision checks see it as already deployed.
+        location = base["revision"].get("s3Location", {})
+        if location.get("key") != build["output_key"]:
+            return base["revision"]
+        return _bundle_revision(build)
+
+    with _span("delta") as span:
+        revision = _build_delta_bundle(build, config, base["files_id"], span)
+    return revision or _bundle_revision(build)
+
+
+def _build_delta_bundle(build, config, base_files_id, span):
+    """Upload a bundle holding only the members changed since base_files_id.
+
+    Its BUNDLE_FILES_NAME describes the full bundle, plus the base id, the
+    app/ paths to delete and an immutable copy of the full bundle for
+    instances that do not have the base. Returns the delta's revision, or
+    None when the full bundle should be deployed instead.
+    """
+    bucket = build["bucket"]
+    output_prefix = config["output_prefix"]
+    files_id = build["files_id"]
+    delta_key = f"{output_prefix}{DELTA_DIR}/{base_files_id}-{files_id}.zip"
+    head = _head_if_exists(bucket, delta_key)
+    if head:
+        return _s3_revision(bucket, delta_key, head.get("ETag"))
+
+    base_files = _load_bundle_files(bucket, output_prefix, base_files_id)
+    bundle_files = _load_bundle_files(bucket, output_prefix, files_id)
+    if not base_files or not bundle_files:
+        LOGGER.info("File listing missing for %s; using full bundle", base_files_id)
+        return None
+
+    app_prefix = f"{BUNDLE_APP_DIR}/"
+    files = bundle_files["files"]
+    base = base_files["files"]
+    changed = {
+        name
+        for name in files
+        if name.startswith(app_prefix) and not _same_member(base.get(name), files[name])
+    }
+    deleted = sorted(name for name in base if name.startswith(app_prefix) and name not in files)
+    changed_bytes = sum(files[name][1] for name in changed)
+    app_bytes = sum(entry[1] for name, entry in files.items() if name.startswith(app_prefix))
+    if changed_bytes > app_bytes * DELTA_MAX_RATIO:
+        LOGGER.info(
+            "Delta for %s is %d of %d bytes; using full bundle",
+            build["output_key"],
+            changed_bytes,
+            app_bytes,
+        )
+        return None
+
+    profile = _transfer_profile(config)
+    transfer_config = _transfer_config(profile)
+    full_key = f"{output_prefix}{DELTA_DIR}/full/{files_id}.zip"
+    if not _head_if_exists(bucket, full_key):
+        extra_args = _bundle_extra_args(files_id=files_id)
+        extra_args.update(CopySourceIfMatch=build["bundle_etag"], MetadataDirective="REPLACE")
+        _client("s3").copy(
+            {"Bucket": bucket, "Key": build["output_key"]},
+            bucket,
+            full_key,
+            ExtraArgs=extra_args,
+            Config=transfer_config,
+        )
+
+    delta_files = dict(
+        bundle_files,
+        type="delta",
+        base=base_files_id,
+        delete=deleted,
+        full_bundle={"bucket": bucket, "key": full_key},
+    )
     workdir = tempfile.mkdtemp(prefix="codedeploy-bundler-")
     try:
-        extracted_root = os.path.join(workdir, "extracted")
-        bundle_dir = os.path.join(workdir, "bundle")
-        app_dir = os.path.join(bundle_dir, "app")
+        with contextlib.ExitStack() as stack:
+            spool_max_size = int(float(profile["spool_max_mb"]) * MB)
+            full_zip = stack.enter_context(
+                tempfile.SpooledTemporaryFile(max_size=spool_max_size, dir=workdir)
+            )
+            delta_zip = stack.enter_context(
+                tempfile.SpooledTemporaryFile(max_size=spool_max_size, dir=workdir)
+            )
+            _client("s3").download_fileobj(bucket, full_key, full_zip, Config=transfer_config)
+            full_zip.seek(0)
+            archive = stack.enter_context(zipfile.ZipFile(full_zip, "r"))
+            with zipfile.ZipFile(delta_zip, "w", zipfile.ZIP_DEFLATED) as output:
+                for info in archive.infolist():
+                    if info.filename == BUNDLE_FILES_NAME:
+                        continue
+                    if info.filename.startswith(app_prefix) and info.filename not in changed:
+                        continue
+                    _copy_member(archive, info, output, info.filename, files[info.filename][2])
+                output.writestr(
+                    BUNDLE_FILES_NAME,
+                    json.dumps(delta_files, sort_keys=True, separators=(",", ":")),
+                )
+            span["bytes"] = delta_zip.tell()
+            span["files"] = len(changed)
+            delta_zip.seek(0)
+            _client("s3").upload_fileobj(
+                delta_zip,
+                bucket,
+                delta_key,
+                ExtraArgs=_bundle_extra_args(files_id=files_id),
+                Config=transfer_config,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
 
-        os.makedirs(extracted_root, exist_ok=True)
-        os.makedirs(app_dir, exist_ok=True)
+    LOGGER.info(
+        "Delta bundle s3://%s/%s: %d changed, %d deleted, %d of %d bytes",
+        bucket,
+        delta_key,
+        len(changed),
+        len(deleted),
+        changed_bytes,
+        app_bytes,
+    )
+    head = _client("s3").head_object(Bucket=bucket, Key=delta_key)
+    return _s3_revision(bucket, delta_key, head.get("ETag"))
 
-        for idx, source_key in enumerate(sorted(source_keys)):
-            source_zip = os.path.join(workdir, f"source-{idx}.zip")
-            extracted_dir = os.path.join(extracted_root, f"source-{idx}")
-            os.makedirs(extracted_dir, exist_ok=True)
 
-            LOGGER.info("Downloading s3://%s/%s", bucket, source_key)
-            S3_CLIENT.download_file(bucket, source_key, source_zip)
+def _delta_base_key(output_prefix, target):
+    return f"{output_prefix}{DELTA_DIR}/groups/{_target_digest(target)}.json"
 
-            with zipfile.ZipFile(source_zip, "r") as archive:
-                archive.extractall(extracted_dir)
 
-            source_root = _normalize_source_root(extracted_dir)
-            _copy_contents(source_root, app_dir)
+def _load_delta_base(bucket, output_prefix, target):
+    try:
+        response = _client("s3").get_object(
+            Bucket=bucket, Key=_delta_base_key(output_prefix, target)
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def _store_delta_base(build, target, revision, config):
+    # Instances check the base id themselves, so a failed deployment only
+    # costs the next delta a fallback to the full bundle.
+    put_args = {
+        "Bucket": build["bucket"],
+        "Key": _delta_base_key(config["output_prefix"], target),
+        "Body": json.dumps({"files_id": build["files_id"], "revision": revision}).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    _client("s3").put_object(**put_args)
 
-        _copy_template(template_name, bundle_dir)
 
-        service_dirs = _discover_service_dirs(app_dir)
-        if not service_dirs:
-            service_dirs = [{"name": base_name, "path": app_dir}]
+def _head_if_exists(bucket, key):
+    try:
+        return _client("s3").head_object(Bucket=bucket, Key=key)
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
 
-        if seed_ssm and ssm_base_path:
-            files_to_seed = ssm_files if ssm_files else DEFAULT_SSM_FILES
-            _seed_ssm_parameters(service_dirs, ssm_base_path, files_to_seed)
 
-        primary_service_name = service_dirs[0]["name"] if len(service_dirs) == 1 else base_name
-        codedeploy_service_name = _sanitize_codedeploy_name(primary_service_name)
-        codedeploy_app_name = _build_codedeploy_app_name(
-            app_name_prefix, codedeploy_service_name
-        )
-        deployment_group_name = (
-            _build_deployment_group_name(codedeploy_app_name)
-            if codedeploy_app_name
-            else ""
+def _pending_deployment_key(target):
+    return f"{PENDING_DEPLOY_DIR}/{_target_digest(target)}.json"
+
+
+def _store_pending_deployment(build, target):
+    # Deployment events carry no bucket, so the marker lives in ARTIFACT_BUCKET.
+    put_args = {
+        "Bucket": ARTIFACT_BUCKET,
+        "Key": _pending_deployment_key(target),
+        "Body": json.dumps({"build": build, "target": target}).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    _client("s3").put_object(**put_args)
+
+
+def _load_pending_deployment(bucket, target):
+    try:
+        response = _client("s3").get_object(Bucket=bucket, Key=_pending_deployment_key(target))
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def _delete_pending_deployment(bucket, target):
+    _client("s3").delete_object(Bucket=bucket, Key=_pending_deployment_key(target))
+
+
+def _handle_deployment_event(event):
+    """Deploy the build queued for a group once its deployment has finished."""
+    detail = event.get("detail", {})
+    target = {
+        "application": detail.get("application", ""),
+        "deployment_group": detail.get("deploymentGroup", ""),
+    }
+    result = {"key": detail.get("deploymentId"), "status": "ok"}
+    if not ARTIFACT_BUCKET or not target["application"] or not target["deployment_group"]:
+        LOGGER.warning("Ignoring CodeDeploy event without bucket/app/group: %s", detail)
+        return dict(result, detail="skipped: no pending location")
+
+    try:
+        pending = _load_pending_deployment(ARTIFACT_BUCKET, target)
+        if not pending:
+            return dict(result, detail="skipped: nothing queued")
+
+        build = pending["build"]
+        _delete_pending_deployment(ARTIFACT_BUCKET, target)
+        head = _client("s3").head_object(Bucket=build["bucket"], Key=build["output_key"])
+        if _normalize_etag(head.get("ETag")) != build["bundle_etag"]:
+            LOGGER.info("Queued bundle %s was rebuilt; not deploying", build["output_key"])
+            return dict(result, key=build["key"], detail="skipped: superseded")
+
+        LOGGER.info("Deploying queued bundle %s to %s", build["output_key"], target["deployment_group"])
+        with _span("codedeploy"):
+            deployed = _trigger_deployment(build, target)
+        return dict(result, key=build["key"], detail=deployed)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        LOGGER.exception("Failed to deploy queued bundle for %s", target["deployment_group"])
+        return dict(result, status="error", detail=str(exc))
+
+
+def _enqueue_object(record):
+    """Queue the build stage for an upload instead of building inline."""
+    bucket, key = record["bucket"], record["key"]
+    skipped, _prefix, config = _route_object(key)
+    if skipped:
+        return skipped
+
+    etag = _normalize_etag(record["etag"])
+    if not etag:
+        etag = _normalize_etag(_client("s3").head_object(Bucket=bucket, Key=key).get("ETag"))
+    message = {
+        "bucket": bucket,
+        "key": key,
+        "etag": etag,
+        "output_prefix": config["output_prefix"],
+        "idempotency_key": _idempotency_key(bucket, key, etag),
+    }
+    # Builds of a bundle_all prefix all produce the same bundle, so they queue up
+    # behind each other; other uploads build in parallel.
+    group = config["output_prefix"] if config.get("bundle_all") else _output_key(key, config)
+    _enqueue("build", message, group)
+    return f"queued: {message['idempotency_key']}"
+
+
+def _idempotency_key(bucket, key, etag):
+    # One key per uploaded object version, shared by all of its stages.
+    return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode("utf-8")).hexdigest()[:32]
+
+
+def _enqueue(stage, message, group):
+    queue_url = PIPELINE_QUEUE_URLS[stage]
+    _queue_client(queue_url).send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps(dict(message, stage=stage), sort_keys=True),
+        MessageGroupId=hashlib.sha1(group.encode("utf-8")).hexdigest(),
+        MessageDeduplicationId=f"{message['idempotency_key']}-{stage}",
+    )
+
+
+def _queue_client(queue_url):
+    return _LOCAL_QUEUE if queue_url.startswith(LOCAL_QUEUE_SCHEME) else _client("sqs")
+
+
+def _handle_stage_messages(records):
+    """Run pipeline messages; returns (results, batchItemFailures entries).
+
+    After the first failure the rest of the batch is failed as well, so FIFO
+    groups are retried in order.
+    """
+    results = []
+    failures = []
+    for record in records:
+        message_id = record.get("messageId")
+        if failures:
+            failures.append({"itemIdentifier": message_id})
+            continue
+        message = {}
+        try:
+            message = json.loads(record["body"])
+            detail = _STAGE_HANDLERS[message["stage"]](message)
+            status = "ok"
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Pipeline message %s failed", message_id)
+            detail = str(exc)
+            status = "error"
+            failures.append({"itemIdentifier": message_id})
+        results.append(
+            {
+                "key": message.get("key"),
+                "stage": message.get("stage"),
+                "status": status,
+                "detail": detail,
+            }
         )
+    return results, failures
+
+
+def _run_build_stage(message):
+    bucket, key = message["bucket"], message["key"]
+    build = _load_stage_record(bucket, message, "build")
+    if build:
+        LOGGER.info("Bundle for %s already built; forwarding", key)
+    else:
+        build = _build_object(bucket, key, message["etag"])
+        if isinstance(build, str):
+            return build
+        _store_stage_record(bucket, message, "build", build)
+    _enqueue("register", dict(message, build=build), build["output_key"])
+    return build["output_key"]
+
+
+def _run_register_stage(message):
+    build = message["build"]
+    with _span("codedeploy"):
+        target = _register_revision(build, register=True)
+    if not target:
+        return "skipped: no deployment target"
+    if not AUTO_DEPLOY:
+        return f"registered: {target['application']}"
+    _enqueue(
+        "deploy",
+        dict(message, target=target),
+        f"{target['application']}/{target['deployment_group']}",
+    )
+    return f"registered: {target['application']}"
+
+
+def _run_deploy_stage(message):
+    build = message["build"]
+    bucket = build["bucket"]
+    record = _load_stage_record(bucket, message, "deploy")
+    if record:
+        return f"skipped: already handled ({record['result']})"
+
+    head = _client("s3").head_object(Bucket=bucket, Key=build["output_key"])
+    if _normalize_etag(head.get("ETag")) != build["bundle_etag"]:
+        LOGGER.info("Bundle %s was rebuilt since it was queued; not deploying", build["output_key"])
+        return "skipped: superseded"
+
+    with _span("codedeploy"):
+        deployed = _trigger_deployment(build, message["target"])
+    _store_stage_record(bucket, message, "deploy", dict(message["target"], result=deployed))
+    return deployed
+
+
+_STAGE_HANDLERS = {
+    "build": _run_build_stage,
+    "register": _run_register_stage,
+    "deploy": _run_deploy_stage,
+}
+
+
+def _stage_record_key(message, stage):
+    return f"{message['output_prefix']}{PIPELINE_DIR}/{message['idempotency_key']}/{stage}.json"
 
-        output_key = f"{output_prefix}{base_name}-deploy.zip"
-        output_zip = os.path.join(workdir, "bundle.zip")
-        _zip_directory(bundle_dir, output_zip)
 
-        extra_args = None
-        if KMS_KEY_ARN:
-            extra_args = {
-                "ServerSideEncryption": "aws:kms",
-                "SSEKMSKeyId": KMS_KEY_ARN,
+def _load_stage_record(bucket, message, stage):
+    try:
+        response = _client("s3").get_object(Bucket=bucket, Key=_stage_record_key(message, stage))
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def _store_stage_record(bucket, message, stage, record):
+    put_args = {
+        "Bucket": bucket,
+        "Key": _stage_record_key(message, stage),
+        "Body": json.dumps(record).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    _client("s3").put_object(**put_args)
+
+
+class _LocalQueue:
+    """In-process stand-in for the pipeline's FIFO queues (tests, benchmarks).
+
+    Keeps SQS's deduplication window; messages are drained by the invocation
+    that queued them.
+    """
+
+    def __init__(self):
+        self.messages = collections.deque()
+        self._sent = {}
+
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId, MessageDeduplicationId):  # pylint: disable=invalid-name
+        now = time.monotonic()
+        if self._sent.get(MessageDeduplicationId, 0) > now:
+            return {}
+        self._sent[MessageDeduplicationId] = now + SQS_DEDUP_WINDOW_SECONDS
+        message_id = str(uuid.uuid4())
+        self.messages.append(
+            {
+                "messageId": message_id,
+                "body": MessageBody,
+                "eventSource": "aws:sqs",
+                "eventSourceARN": QueueUrl,
+                "attributes": {"MessageGroupId": MessageGroupId},
             }
+        )
+        return {"MessageId": message_id}
 
-        LOGGER.info("Uploading bundle to s3://%s/%s", bucket, output_key)
-        if extra_args:
-            S3_CLIENT.upload_file(output_zip, bucket, output_key, ExtraArgs=extra_args)
-        else:
-            S3_CLIENT.upload_file(output_zip, bucket, output_key)
-
-        if codedeploy_app_name and deployment_group_name:
-            _ensure_codedeploy_app(codedeploy_app_name)
-            group_ready = _ensure_deployment_group(
-                app_name=codedeploy_app_name,
-                deployment_group_name=deployment_group_name,
-                service_role_arn=CODEDEPLOY_SERVICE_ROLE_ARN,
-                asg_name=asg_name,
-                target_group_name=target_group_name,
-                deployment_config_name=deployment_config_name,
-                auto_rollback=auto_rollback,
-            )
 
-            if AUTO_DEPLOY and group_ready:
-                LOGGER.info(
-                    "Triggering CodeDeploy deployment for %s", deployment_group_name
+def _drain_local_queue():
+    results = []
+    while _LOCAL_QUEUE.messages:
+        stage_results, _failures = _handle_stage_messages([_LOCAL_QUEUE.messages.popleft()])
+        results.extend(stage_results)
+    return results
+
+
+_LOCAL_QUEUE = _LocalQueue()
+
+
+def _build_bundle(
+    bucket,
+    base_name,
+    source_keys,
+    config,
+    bundle_mode,
+    download_workers,
+    transfer_profile,
+    transfer_config,
+    output_key,
+    cache_key,
+):
+    template_name = config.get("template")
+    output_prefix = config.get("output_prefix")
+    ssm_base_path = config.get("ssm_base_path", "")
+    ssm_files = config.get("ssm_files", [])
+    seed_ssm = config.get("seed_ssm", True)
+    incremental = (
+        bundle_mode == BUNDLE_MODE_STREAM
+        and config.get("bundle_all", False)
+        and config.get("incremental", DEFAULT_INCREMENTAL)
+    )
+
+    workdir = tempfile.mkdtemp(prefix="codedeploy-bundler-")
+    try:
+        with contextlib.ExitStack() as stack:
+            # Small bundles never touch /tmp; larger ones roll over to disk.
+            output_zip = stack.enter_context(
+                tempfile.SpooledTemporaryFile(
+                    max_size=int(float(transfer_profile["spool_max_mb"]) * MB), dir=workdir
                 )
-                CODEDEPLOY_CLIENT.create_deployment(
-                    applicationName=codedeploy_app_name,
-                    deploymentGroupName=deployment_group_name,
-                    revision={
-                        "revisionType": "S3",
-                        "s3Location": {
-                            "bucket": bucket,
-                            "key": output_key,
-                            "bundleType": "zip",
-                        },
-                    },
-                    description=f"Auto deployment for {key}",
+            )
+            if bundle_mode == BUNDLE_MODE_STREAM:
+                manifest = _load_bundle_manifest(bucket, output_prefix) if incremental else None
+                entries, contributions = _open_stream_sources(
+                    bucket,
+                    source_keys,
+                    workdir,
+                    download_workers,
+                    stack,
+                    manifest,
+                    transfer_config,
                 )
-            elif AUTO_DEPLOY:
-                LOGGER.warning(
-                    "Auto-deploy enabled but deployment group is not ready for %s",
-                    codedeploy_app_name,
+                tree = _ArchiveTree(entries)
+                with _span("template") as span:
+                    template_files = _template_files(template_name)
+                    span["files"] = len(template_files)
+                app_dir = BUNDLE_APP_DIR
+            else:
+                bundle_dir = os.path.join(workdir, "bundle")
+                app_dir = os.path.join(bundle_dir, BUNDLE_APP_DIR)
+                _extract_sources(
+                    bucket, source_keys, workdir, app_dir, download_workers, transfer_config
                 )
-        elif AUTO_DEPLOY and CODEDEPLOY_APP_NAME and deployment_group:
-            LOGGER.info("Triggering CodeDeploy deployment for %s", deployment_group)
-            CODEDEPLOY_CLIENT.create_deployment(
-                applicationName=CODEDEPLOY_APP_NAME,
-                deploymentGroupName=deployment_group,
-                revision={
-                    "revisionType": "S3",
-                    "s3Location": {
-                        "bucket": bucket,
-                        "key": output_key,
-                        "bundleType": "zip",
-                    },
-                },
-                description=f"Auto deployment for {key}",
-            )
-        elif AUTO_DEPLOY:
-            LOGGER.warning(
-                "Auto-deploy enabled but missing CodeDeploy app/deployment group configuration"
+                with _span("template"):
+                    _copy_template(template_name, bundle_dir)
+                tree = LOCAL_TREE
+
+            service_dirs = _discover_service_dirs(app_dir, tree)
+            if not service_dirs:
+                service_dirs = [{"name": base_name, "path": app_dir}]
+
+            if seed_ssm and ssm_base_path:
+                files_to_seed = ssm_files if ssm_files else DEFAULT_SSM_FILES
+                with _span("ssm_seed") as span:
+                    span["files"] = _seed_ssm_parameters(
+                        service_dirs, ssm_base_path, files_to_seed, tree
+                    )
+
+            with _span("zip") as span:
+                if bundle_mode == BUNDLE_MODE_STREAM:
+                    span["files"], bundle_files = _write_streaming_bundle(
+                        tree, template_files, output_zip
+                    )
+                else:
+                    span["files"], bundle_files = _zip_directory(bundle_dir, output_zip)
+                bundle_size = span["bytes"] = output_zip.tell()
+
+            output_zip.seek(0)
+            LOGGER.info("Uploading bundle to s3://%s/%s", bucket, output_key)
+            with _span("upload") as span:
+                _client("s3").upload_fileobj(
+                    output_zip,
+                    bucket,
+                    output_key,
+                    ExtraArgs=_bundle_extra_args(cache_key, bundle_files["id"]),
+                    Config=transfer_config,
+                )
+                span["bytes"] = bundle_size
+                span["files"] = 1
+
+        if incremental:
+            _store_bundle_manifest(bucket, output_prefix, output_key, source_keys, contributions)
+        with _span("manifest") as span:
+            span["bytes"] = _store_bundle_files(
+                bucket,
+                output_prefix,
+                output_key,
+                bundle_files,
+                config.get("delta_bundles", DEFAULT_DELTA_BUNDLES),
             )
+            span["files"] = len(bundle_files["files"])
 
-        return output_key
+        return [service["name"] for service in service_dirs], bundle_files["id"]
     finally:
         shutil.rmtree(workdir, ignore_errors=True)
 
 
+def _open_stream_sources(
+    bucket, source_keys, workdir, workers, stack, manifest=None, transfer_config=None
+):
+    """Open the archives needed for a stream bundle and merge their members.
+
+    With a manifest from the previous bundle_all build, only new or changed
+    sources are downloaded; members owned by unchanged sources are taken from
+    the previous bundle instead. Returns the merged app/ entries and, per
+    source, the app-relative paths it contributes (for the next manifest).
+    Directory entries end in "/" and map to (None, None).
+    """
+    ordered_keys = sorted(source_keys)
+    previous = {}
+    if manifest:
+        previous = {item["key"]: item for item in manifest.get("sources", [])}
+
+    fetch_keys = [
+        source_key
+        for source_key in ordered_keys
+        if source_key not in previous or previous[source_key].get("etag") != source_keys[source_key]
+    ]
+    if len(fetch_keys) == len(ordered_keys):
+        previous = {}
+
+    archives = {}
+
+    def open_archives(keys):
+        source_zips = _fetch_sources(
+            bucket, keys, workdir, workers, transfer_config=transfer_config
+        )
+        for source_key, source_zip in zip(sorted(keys), source_zips):
+            archives[source_key] = stack.enter_context(zipfile.ZipFile(source_zip, "r"))
+
+    bundle_archive = None
+    bundle_members = {}
+    if previous:
+        bundle_key = manifest["bundle_key"]
+        LOGGER.info(
+            "Incremental rebuild: fetching %d of %d sources", len(fetch_keys), len(ordered_keys)
+        )
+        open_archives(fetch_keys + [bundle_key])
+        bundle_archive = archives.pop(bundle_key)
+        bundle_members = {info.filename: info for info in bundle_archive.infolist()}
+    else:
+        open_archives(fetch_keys)
+
+    fetched = {source_key: _archive_entries(archives[source_key]) for source_key in fetch_keys}
+
+    def contributed(source_key):
+        if source_key in fetched:
+            return list(fetched[source_key])
+        return previous[source_key]["entries"]
+
+    previous_owner = {}
+    for source_key in sorted(previous):
+        for path in previous[source_key]["entries"]:
+            previous_owner[path] = source_key
+
+    owner = {}
+    for source_key in ordered_keys:
+        for path in contributed(source_key):
+            owner[path] = source_key
+
+    # An unchanged source whose member was shadowed in the previous bundle, but
+    # wins now, has to be fetched after all.
+    refetch = sorted(
+        {
+            source_key
+            for path, source_key in owner.items()
+            if source_key not in fetched
+            and not path.endswith("/")
+            and (
+                previous_owner.get(path) != source_key
+                or f"{BUNDLE_APP_DIR}/{path}" not in bundle_members
+            )
+        }
+    )
+    if refetch:
+        LOGGER.info("Incremental rebuild: fetching %d shadowed sources", len(refetch))
+        open_archives(refetch)
+        for source_key in refetch:
+            fetched[source_key] = _archive_entries(archives[source_key])
+
+    entries = {}
+    for source_key in ordered_keys:
+        for path in contributed(source_key):
+            if owner[path] != source_key:
+                continue
+            arcname = f"{BUNDLE_APP_DIR}/{path}"
+            if path.endswith("/"):
+                # Directories only shape the tree; bundles hold no member for them.
+                entries[arcname] = (None, None)
+            elif source_key in fetched:
+                entries[arcname] = (archives[source_key], fetched[source_key][path])
+            else:
+                entries[arcname] = (bundle_archive, bundle_members[arcname])
+
+    return entries, {source_key: contributed(source_key) for source_key in ordered_keys}
+
+
+def _bundle_manifest_key(output_prefix):
+    return f"{output_prefix}{BUNDLE_MANIFEST_NAME}"
+
+
+def _load_bundle_manifest(bucket, output_prefix):
+    manifest_key = _bundle_manifest_key(output_prefix)
+    try:
+        response = _client("s3").get_object(Bucket=bucket, Key=manifest_key)
+        manifest = json.loads(response["Body"].read())
+        head = _client("s3").head_object(Bucket=bucket, Key=manifest["bundle_key"])
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+
+    if manifest.get("version") != BUNDLE_MANIFEST_VERSION or _normalize_etag(
+        head.get("ETag")
+    ) != manifest.get("bundle_etag"):
+        LOGGER.info("Ignoring stale bundle manifest: %s", manifest_key)
+        return None
+    return manifest
+
+
+def _store_bundle_manifest(bucket, output_prefix, output_key, source_keys, contributions):
+    head = _client("s3").head_object(Bucket=bucket, Key=output_key)
+    manifest = {
+        "version": BUNDLE_MANIFEST_VERSION,
+        "bundle_key": output_key,
+        "bundle_etag": _normalize_etag(head.get("ETag")),
+        "sources": [
+            {"key": source_key, "etag": source_keys[source_key], "entries": contributions[source_key]}
+            for source_key in sorted(source_keys)
+        ],
+    }
+    put_args = {
+        "Bucket": bucket,
+        "Key": _bundle_manifest_key(output_prefix),
+        "Body": json.dumps(manifest, separators=(",", ":")).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    _client("s3").put_object(**put_args)
+
+
+def _bundle_files_key(output_prefix, files_id):
+    return f"{output_prefix}{DELTA_DIR}/files/{files_id}.json"
+
+
+def _bundle_files_sibling_key(bundle_key):
+    return f"{os.path.splitext(bundle_key)[0]}{BUNDLE_FILES_SUFFIX}"
+
+
+def _store_bundle_files(bucket, output_prefix, output_key, bundle_files, by_id=False):
+    """Store the listing next to the bundle, and by id when deltas will read it.
+
+    Returns its size.
+    """
+    body = json.dumps(bundle_files, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    keys = [_bundle_files_sibling_key(output_key)]
+    if by_id:
+        keys.append(_bundle_files_key(output_prefix, bundle_files["id"]))
+    for key in keys:
+        put_args = {
+            "Bucket": bucket,
+            "Key": key,
+            "Body": body,
+            "ContentType": "application/json",
+        }
+        put_args.update(_bundle_extra_args() or {})
+        _client("s3").put_object(**put_args)
+    return len(body)
+
+
+def _same_member(entry, other):
+    """Compare listing entries by CRC32 and size, and by SHA-256 when both have one."""
+    if not entry or entry[:2] != other[:2]:
+        return False
+    return not (entry[2] and other[2]) or entry[2] == other[2]
+
+
+def _load_bundle_files(bucket, output_prefix, files_id):
+    try:
+        response = _client("s3").get_object(
+            Bucket=bucket, Key=_bundle_files_key(output_prefix, files_id)
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+    bundle_files = json.loads(response["Body"].read())
+    if bundle_files.get("version") != BUNDLE_FILES_VERSION:
+        return None
+    return bundle_files
+
+
+def _bundle_extra_args(cache_key="", files_id=""):
+    extra_args = {}
+    if KMS_KEY_ARN:
+        extra_args["ServerSideEncryption"] = "aws:kms"
+        extra_args["SSEKMSKeyId"] = KMS_KEY_ARN
+    metadata = {}
+    if cache_key:
+        metadata[BUNDLE_DIGEST_METADATA] = cache_key
+    if files_id:
+        metadata[BUNDLE_FILES_METADATA] = files_id
+    if metadata:
+        extra_args["Metadata"] = metadata
+    return extra_args or None
+
+
+def _normalize_etag(etag):
+    return (etag or "").strip('"')
+
+
+def _template_digest(template_name):
+    digest = _TEMPLATE_DIGESTS.get(template_name)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for file_path, arcname in sorted(_template_files(template_name), key=lambda item: item[1]):
+            with open(file_path, "rb") as handle:
+                content = handle.read()
+            hasher.update(f"{arcname}\0{len(content)}\0".encode("utf-8"))
+            hasher.update(content)
+        digest = hasher.hexdigest()
+        _TEMPLATE_DIGESTS[template_name] = digest
+    return digest
+
+
+def _bundle_cache_key(bucket, source_keys, template_name, config):
+    sources = []
+    for source_key in sorted(source_keys):
+        etag = source_keys[source_key]
+        if not etag:
+            head = _client("s3").head_object(Bucket=bucket, Key=source_key)
+            etag = head.get("VersionId") or _normalize_etag(head.get("ETag"))
+        sources.append([source_key, etag])
+
+    payload = json.dumps(
+        {
+            "version": BUNDLE_CACHE_VERSION,
+            "sources": sources,
+            "template": _template_digest(template_name),
+            "config": {name: config.get(name) for name in BUNDLE_CACHE_CONFIG_KEYS},
+            "bundle_mode": (config.get("bundle_mode") or DEFAULT_BUNDLE_MODE).lower(),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _bundle_cache_pointer_key(output_prefix, cache_key):
+    return f"{output_prefix}{BUNDLE_CACHE_DIR}/{cache_key}.json"
+
+
+def _load_cached_bundle(bucket, output_prefix, cache_key):
+    pointer_key = _bundle_cache_pointer_key(output_prefix, cache_key)
+    try:
+        response = _client("s3").get_object(Bucket=bucket, Key=pointer_key)
+        pointer = json.loads(response["Body"].read())
+        head = _client("s3").head_object(Bucket=bucket, Key=pointer["bundle_key"])
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+            return None
+        raise
+
+    # The bundle may have been overwritten by a build from different sources.
+    if head.get("Metadata", {}).get(BUNDLE_DIGEST_METADATA) != cache_key:
+        LOGGER.info("Stale bundle cache entry: %s", pointer_key)
+        return None
+    return pointer
+
+
+def _store_cached_bundle(bucket, output_prefix, cache_key, output_key, service_names, files_id):
+    pointer_key = _bundle_cache_pointer_key(output_prefix, cache_key)
+    body = json.dumps({"bundle_key": output_key, "services": service_names, "files_id": files_id})
+    put_args = {
+        "Bucket": bucket,
+        "Key": pointer_key,
+        "Body": body.encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    put_args.update(_bundle_extra_args() or {})
+    _client("s3").put_object(**put_args)
+
+
+def _copy_cached_bundle(
+    bucket, source_key, output_key, cache_key, transfer_config=None, files_id=""
+):
+    LOGGER.info("Copying cached bundle to s3://%s/%s", bucket, output_key)
+    extra_args = _bundle_extra_args(cache_key, files_id)
+    extra_args["MetadataDirective"] = "REPLACE"
+    _client("s3").copy(
+        {"Bucket": bucket, "Key": source_key},
+        bucket,
+        output_key,
+        ExtraArgs=extra_args,
+        Config=transfer_config,
+    )
+    _client("s3").copy_object(
+        Bucket=bucket,
+        Key=_bundle_files_sibling_key(output_key),
+        CopySource={"Bucket": bucket, "Key": _bundle_files_sibling_key(source_key)},
+        **(_bundle_extra_args() or {}),
+    )
+
+
+def _transfer_profile(config):
+    """Merge the transfer profile: defaults, then S3_TRANSFER_CONFIG, then the prefix's."""
+    profile = dict(DEFAULT_TRANSFER_PROFILE)
+    profile.update(S3_TRANSFER_CONFIG)
+    profile.update(config.get("transfer") or {})
+    return profile
+
+
+def _transfer_config(profile):
+    # TransferConfig objects are cached so warm invocations reuse them.
+    cache_key = (
+        float(profile["multipart_threshold_mb"]),
+        float(profile["multipart_chunksize_mb"]),
+        int(profile["max_concurrency"]),
+    )
+    transfer_config = _TRANSFER_CONFIGS.get(cache_key)
+    if transfer_config is None:
+        from boto3.s3.transfer import TransferConfig  # pylint: disable=import-outside-toplevel
+
+        transfer_config = TransferConfig(
+            multipart_threshold=int(cache_key[0] * MB),
+            multipart_chunksize=int(cache_key[1] * MB),
+            max_concurrency=cache_key[2],
+        )
+        _TRANSFER_CONFIGS[cache_key] = transfer_config
+    return transfer_config
+
+
 def _match_prefix(key):
-    matched_prefix = ""
-    matched_config = None
+    # Longest configured prefix of key, found in one walk down the trie.
+    matched = ("", None)
+    node = PREFIX_TRIE
+    for char in key:
+        node = node.get(char)
+        if node is None:
+            break
+        matched = node.get(None, matched)
+    return matched
 
-    for prefix, config in PREFIX_CONFIG.items():
-        if key.startswith(prefix) and len(prefix) > len(matched_prefix):
-            matched_prefix = prefix
-            matched_config = config
 
-    return matched_prefix, matched_config
+def _allowed_names_pattern(allowed_names):
+    names = tuple(allowed_names)
+    pattern = _ALLOWED_NAME_PATTERNS.get(names)
+    if pattern is None:
+        pattern = _ALLOWED_NAME_PATTERNS[names] = _compile_allowed_names(names)
+    return pattern
 
 
 def _matches_allowed(base_name, allowed_names):
-    for pattern in allowed_names:
-        if fnmatch.fnmatchcase(base_name, pattern):
-            return True
-    return False
+    return _allowed_names_pattern(allowed_names).match(base_name) is not None
 
 
-def _list_source_keys(bucket, prefix, output_prefix, allowed_names):
-    keys = []
-    paginator = S3_CLIENT.get_paginator("list_objects_v2")
+def _is_source_key(key, config):
+    if not key.lower().endswith(".zip"):
+        return False
+    output_prefix = config.get("output_prefix")
+    if output_prefix and key.startswith(output_prefix):
+        return False
+    allowed_names = config.get("allowed_names", [])
+    base_name = os.path.splitext(os.path.basename(key))[0]
+    return not allowed_names or _matches_allowed(base_name, allowed_names)
+
+
+def _list_source_entries(bucket, prefix, config):
+    """Source index entries for every source zip currently under prefix."""
+    entries = {}
+    paginator = _client("s3").get_paginator("list_objects_v2")
     for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
         for item in page.get("Contents", []):
             key = item.get("Key")
-            if not key or not key.lower().endswith(".zip"):
-                continue
-            if output_prefix and key.startswith(output_prefix):
+            if not key or not _is_source_key(key, config):
                 continue
-            base_name = os.path.splitext(os.path.basename(key))[0]
-            if allowed_names and not _matches_allowed(base_name, allowed_names):
+            modified = item.get("LastModified")
+            entries[key] = [
+                _normalize_etag(item.get("ETag")),
+                "",
+                modified.timestamp() if modified else 0.0,
+            ]
+    return entries
+
+
+def _source_keys(bucket, prefix, config):
+    """Current source zips under a bundle_all prefix, as {key: etag}.
+
+    Served from the prefix's source index while it is fresh; a missing, stale
+    or foreign index is rebuilt from a full listing. The listing is only
+    stored if no event touched the index meanwhile, and failing to store it
+    does not fail the build.
+    """
+    if not config.get("source_index", DEFAULT_SOURCE_INDEX):
+        entries = _list_source_entries(bucket, prefix, config)
+        return {key: entry[0] for key, entry in entries.items()}
+
+    index_key = _source_index_key(config["output_prefix"])
+    index, token = _read_source_index(bucket, index_key)
+    scope = _source_index_scope(prefix, config)
+    if (
+        index
+        and index.get("scope") == scope
+        and time.time() - index["reconciled_at"] < SOURCE_INDEX_RECONCILE_SECONDS
+    ):
+        return {key: entry[0] for key, entry in index["keys"].items() if entry[0]}
+
+    LOGGER.info("Reconciling source index %s", index_key)
+    previous = index["keys"] if index and index.get("scope") == scope else {}
+    reconciled_at = time.time()
+    entries = _list_source_entries(bucket, prefix, config)
+    for key, entry in entries.items():
+        # Sequencers stay comparable as long as the object has not changed.
+        if previous.get(key, [None])[0] == entry[0]:
+            entry[1] = previous[key][1]
+    document = {
+        "version": SOURCE_INDEX_VERSION,
+        "scope": scope,
+        "reconciled_at": reconciled_at,
+        "keys": entries,
+    }
+    try:
+        if not _write_source_index(bucket, index_key, document, token):
+            LOGGER.info("Source index %s changed while listing; not storing it", index_key)
+    except (ClientError, ParamValidationError) as exc:
+        # ParamValidationError: a botocore without conditional writes
+        LOGGER.warning("Could not store source index %s: %s", index_key, exc)
+    return {key: entry[0] for key, entry in entries.items()}
+
+
+def _update_source_indexes(records):
+    """Apply uploads and removals to the source indexes of bundle_all prefixes.
+
+    Applied records are stamped with indexed_at. An index that cannot be
+    updated is dropped, so the next build re-lists; returns {record index:
+    error} for records whose index could not be dropped either.
+    """
+    groups = {}
+    for record in records:
+        prefix, config = _match_prefix(record["key"])
+        if (
+            not config
+            or not config.get("bundle_all", False)
+            or not config.get("output_prefix")
+            or not config.get("source_index", DEFAULT_SOURCE_INDEX)
+            or not _is_source_key(record["key"], config)
+        ):
+            continue
+        groups.setdefault((record["bucket"], prefix), []).append(record)
+
+    errors = {}
+    for (bucket, prefix), group in groups.items():
+        _prefix, config = _match_prefix(group[0]["key"])
+        index_key = _source_index_key(config["output_prefix"])
+        try:
+            _apply_source_events(bucket, prefix, config, group)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Failed to update source index %s; dropping it", index_key)
+            try:
+                _delete_source_index(bucket, index_key)
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Failed to drop source index %s", index_key)
+                errors.update({record["index"]: f"source index: {exc}" for record in group})
                 continue
-            keys.append(key)
-    return keys
+        indexed_at = time.time()
+        for record in group:
+            record["indexed_at"] = indexed_at
+    return errors
+
+
+def _apply_source_events(bucket, prefix, config, records):
+    """Read-modify-write the prefix's source index, retrying on concurrent writes.
+
+    Without an index (or with a foreign one) a stale index holding just these
+    events is written: it still needs a full listing, but a listing that
+    started before these events can no longer be stored over it.
+    """
+    changes = []
+    for record in records:
+        etag = None if record["removed"] else _normalize_etag(record["etag"])
+        if not record["removed"] and not etag:
+            head = _head_if_exists(bucket, record["key"])
+            etag = _normalize_etag(head.get("ETag")) if head else None
+        changes.append((record["key"], [etag, record["sequencer"], record["event_time"]]))
+
+    index_key = _source_index_key(config["output_prefix"])
+    scope = _source_index_scope(prefix, config)
+    for _attempt in range(SOURCE_INDEX_UPDATE_ATTEMPTS):
+        index, token = _read_source_index(bucket, index_key)
+        if not index or index.get("scope") != scope:
+            index = {
+                "version": SOURCE_INDEX_VERSION,
+                "scope": scope,
+                "reconciled_at": 0,
+                "keys": {},
+            }
+        keys = index["keys"]
+        for key, entry in changes:
+            if key not in keys or _is_newer_source_entry(entry, keys[key]):
+                keys[key] = entry
+        if _write_source_index(bucket, index_key, index, token):
+            return
+    raise RuntimeError(
+        f"Source index {index_key} kept changing over {SOURCE_INDEX_UPDATE_ATTEMPTS} attempts"
+    )
+
+
+def _is_newer_source_entry(entry, current):
+    # S3 sequencers order the events of one key; listed entries only have times.
+    if entry[1] and current[1]:
+        return int(entry[1], 16) >= int(current[1], 16)
+    return entry[2] >= current[2]
+
+
+def _source_index_key(output_prefix):
+    return f"{output_prefix}{SOURCE_INDEX_NAME}"
+
+
+def _source_index_scope(prefix, config):
+    # An index only holds keys that passed these filters.
+    return {
+        "prefix": prefix,
+        "output_prefix": config.get("output_prefix", ""),
+        "allowed_names": sorted(config.get("allowed_names", [])),
+    }
+
+
+def _read_source_index(bucket, index_key):
+    """(document, token) of a source index; the token guards the next write."""
+    if SOURCE_INDEX_LOCATION.startswith(LOCAL_QUEUE_SCHEME):
+        path = _local_source_index_path(bucket, index_key)
+        with _SOURCE_INDEX_LOCK:
+            try:
+                with open(path, "rb") as handle:
+                    body = handle.read()
+            except FileNotFoundError:
+                return None, None
+        token = hashlib.sha1(body).hexdigest()
+    else:
+        try:
+            response = _client("s3").get_object(Bucket=bucket, Key=index_key)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in NOT_FOUND_CODES:
+                return None, None
+            raise
+        body = response["Body"].read()
+        token = response.get("ETag")
+
+    try:
+        document = json.loads(body)
+    except ValueError:
+        LOGGER.warning("Ignoring unreadable source index %s", index_key)
+        return None, token
+    if not isinstance(document, dict) or document.get("version") != SOURCE_INDEX_VERSION:
+        return None, token
+    return document, token
+
+
+def _write_source_index(bucket, index_key, document, token):
+    """Store document unless the index changed since token was read; returns success."""
+    body = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    if SOURCE_INDEX_LOCATION.startswith(LOCAL_QUEUE_SCHEME):
+        path = _local_source_index_path(bucket, index_key)
+        with _SOURCE_INDEX_LOCK:
+            try:
+                with open(path, "rb") as handle:
+                    current = hashlib.sha1(handle.read()).hexdigest()
+            except FileNotFoundError:
+                current = None
+            if current != token:
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "wb") as handle:
+                handle.write(body)
+            os.replace(f"{path}.tmp", path)
+        return True
+
+    put_args = {
+        "Bucket": bucket,
+        "Key": index_key,
+        "Body": body,
+        "ContentType": "application/json",
+    }
+    if token:
+        put_args["IfMatch"] = token
+    else:
+        put_args["IfNoneMatch"] = "*"
+    put_args.update(_bundle_extra_args() or {})
+    try:
+        _client("s3").put_object(**put_args)
+    except ClientError as exc:
+        code = exc.response["Error"]["Code"]
+        if code in CONDITIONAL_WRITE_CODES or code in NOT_FOUND_CODES:
+            return False
+        raise
+    return True
+
+
+def _delete_source_index(bucket, index_key):
+    if SOURCE_INDEX_LOCATION.startswith(LOCAL_QUEUE_SCHEME):
+        with _SOURCE_INDEX_LOCK:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(_local_source_index_path(bucket, index_key))
+        return
+    _client("s3").delete_object(Bucket=bucket, Key=index_key)
+
+
+def _local_source_index_path(bucket, index_key):
+    return os.path.join(SOURCE_INDEX_LOCATION[len(LOCAL_QUEUE_SCHEME) :], bucket, index_key)
+
+
+def _fetch_sources(bucket, source_keys, workdir, workers, unpack=None, transfer_config=None):
+    """Download (and optionally unpack) sources concurrently.
+
+    Results come back in sorted(source_keys) order regardless of completion
+    order, so callers merging them keep the last-writer-wins behaviour.
+    """
+    ordered_keys = sorted(source_keys)
+
+    def fetch(idx, source_key):
+        key_digest = hashlib.sha1(source_key.encode("utf-8")).hexdigest()[:16]
+        source_zip = os.path.join(workdir, f"source-{key_digest}.zip")
+        LOGGER.info("Downloading s3://%s/%s", bucket, source_key)
+        with _span("download") as span:
+            _client("s3").download_file(
+                bucket, source_key, source_zip, Config=transfer_config, Callback=_tmp_sampler(span)
+            )
+            span["bytes"] = os.path.getsize(source_zip)
+            span["files"] = 1
+        return unpack(idx, source_zip) if unpack else source_zip
+
+    workers = max(1, min(workers, len(ordered_keys)))
+    if workers == 1:
+        return [fetch(idx, source_key) for idx, source_key in enumerate(ordered_keys)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(fetch, idx, source_key)
+            for idx, source_key in enumerate(ordered_keys)
+        ]
+        return [future.result() for future in futures]
+
+
+def _extract_sources(bucket, source_keys, workdir, app_dir, workers=1, transfer_config=None):
+    extracted_root = os.path.join(workdir, "extracted")
+    os.makedirs(extracted_root, exist_ok=True)
+    os.makedirs(app_dir, exist_ok=True)
+
+    def unpack(idx, source_zip):
+        extracted_dir = os.path.join(extracted_root, f"source-{idx}")
+        os.makedirs(extracted_dir, exist_ok=True)
+        with _span("extract") as span, zipfile.ZipFile(source_zip, "r") as archive:
+            # Member by member, so /tmp is sampled while the source zip and
+            # its extracted copy are both on disk
+            for info in archive.infolist():
+                archive.extract(info, extracted_dir)
+                span["bytes"] += info.file_size
+                span["files"] += 1
+                _sample_tmp_usage(span)
+        os.remove(source_zip)
+        return extracted_dir
+
+    extracted_dirs = _fetch_sources(
+        bucket, source_keys, workdir, workers, unpack, transfer_config
+    )
+    with _span("copy"):
+        for extracted_dir in extracted_dirs:
+            source_root = _normalize_source_root(extracted_dir)
+            _copy_contents(source_root, app_dir)
 
 
 def _normalize_source_root(extracted_dir):
@@ -297,6 +2251,103 @@ def _copy_contents(src, dest):
             shutil.copy2(source_path, dest_path)
 
 
+def _member_parts(filename):
+    # Same path sanitising as ZipFile.extract, so both modes agree on layout.
+    arcname = os.path.splitdrive(filename)[1]
+    return [part for part in arcname.split("/") if part not in ("", ".", "..")]
+
+
+def _archive_entries(archive):
+    """Map app-relative paths to the members that extract + copy would produce.
+
+    Directory members keep their trailing "/", since extracting them creates
+    the directory even when it is empty.
+    """
+    members = []
+    for info in archive.infolist():
+        parts = _member_parts(info.filename)
+        if parts:
+            members.append((parts, info))
+
+    top_level = {
+        parts[0]
+        for parts, _info in members
+        if parts[0] not in IGNORE_ENTRIES and not parts[0].startswith(".")
+    }
+
+    # Mirrors _normalize_source_root: a single top-level directory becomes the root.
+    root = None
+    if len(top_level) == 1:
+        candidate = next(iter(top_level))
+        if any(
+            parts[0] == candidate and (len(parts) > 1 or info.is_dir())
+            for parts, info in members
+        ):
+            root = candidate
+
+    entries = {}
+    for parts, info in members:
+        if root is not None:
+            if parts[0] != root:
+                continue
+            parts = parts[1:]
+        if not parts or parts[0] in IGNORE_ENTRIES or parts[0].startswith("."):
+            continue
+        entries["/".join(parts) + ("/" if info.is_dir() else "")] = info
+    return entries
+
+
+class _LocalTree:
+    """Filesystem access used by service discovery and SSM seeding."""
+
+    listdir = staticmethod(os.listdir)
+    isdir = staticmethod(os.path.isdir)
+    isfile = staticmethod(os.path.isfile)
+
+    @staticmethod
+    def read_bytes(path):
+        with open(path, "rb") as handle:
+            return handle.read()
+
+
+class _ArchiveTree:
+    """Same interface as _LocalTree, backed by members of the source archives."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._children = {}
+        for path in entries:
+            if path.endswith("/"):
+                self._children.setdefault(path[:-1], {})
+            parts = path.rstrip("/").split("/")
+            for depth in range(1, len(parts)):
+                parent = "/".join(parts[:depth])
+                self._children.setdefault(parent, {})[parts[depth]] = None
+
+    def listdir(self, path):
+        return list(self._children.get(path, {}))
+
+    def isdir(self, path):
+        return path in self._children
+
+    def isfile(self, path):
+        return path in self.entries and not path.endswith("/")
+
+    def read_bytes(self, path):
+        archive, info = self.entries[path]
+        return archive.read(info)
+
+
+LOCAL_TREE = _LocalTree()
+_TEMPLATE_DIGESTS = {}
+_TRANSFER_CONFIGS = {}
+_SOURCE_INDEX_LOCK = threading.Lock()
+# Warm-container CodeDeploy state: app name -> expiry, and
+# (app, group) -> (expiry, last applied configuration).
+_CODEDEPLOY_APPS = {}
+_DEPLOYMENT_GROUPS = {}
+
+
 def _copy_template(template_name, bundle_dir):
     template_root = os.path.join(os.path.dirname(__file__), "templates", template_name)
     appspec_src = os.path.join(template_root, "appspec.yml")
@@ -311,13 +2362,265 @@ def _copy_template(template_name, bundle_dir):
         shutil.copytree(scripts_src, os.path.join(bundle_dir, "scripts"))
 
 
+def _template_files(template_name):
+    template_root = os.path.join(os.path.dirname(__file__), "templates", template_name)
+    appspec_src = os.path.join(template_root, "appspec.yml")
+
+    if not os.path.isfile(appspec_src):
+        raise FileNotFoundError(f"Template not found: {appspec_src}")
+
+    files = [(appspec_src, "appspec.yml")]
+    for root, _dirs, filenames in os.walk(os.path.join(template_root, "scripts")):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            files.append((file_path, os.path.relpath(file_path, template_root)))
+    return files
+
+
 def _zip_directory(source_dir, output_zip):
+    digests = {}
     with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as archive:
         for root, _dirs, files in os.walk(source_dir):
             for filename in files:
                 file_path = os.path.join(root, filename)
                 archive_name = os.path.relpath(file_path, source_dir)
-                archive.write(file_path, archive_name)
+                digests[archive_name] = _write_file_member(archive, file_path, archive_name)
+        bundle_files = _write_bundle_files(archive, digests)
+    return len(digests), bundle_files
+
+
+def _write_streaming_bundle(tree, template_files, output_zip):
+    digests = {}
+    recorded = {}
+    views = {}
+    with contextlib.ExitStack() as stack, zipfile.ZipFile(
+        output_zip, "w", zipfile.ZIP_DEFLATED
+    ) as output:
+        for arcname, (archive, info) in tree.entries.items():
+            if arcname.endswith("/"):
+                # Like _zip_directory, which only zips files
+                continue
+            if archive not in recorded:
+                # Each source archive is read once and mapped once per build
+                recorded[archive] = _recorded_digests(archive)
+                views[archive] = _archive_view(stack, archive)
+            entry = recorded[archive].get(info.filename)
+            known = entry[2] if entry and entry[:2] == [info.CRC, info.file_size] else None
+            digests[arcname] = _copy_member(archive, info, output, arcname, known, views[archive])
+        for file_path, arcname in template_files:
+            digests[arcname] = _write_file_member(output, file_path, arcname)
+        bundle_files = _write_bundle_files(output, digests)
+    return len(digests), bundle_files
+
+
+def _write_bundle_files(output, digests):
+    """Add BUNDLE_FILES_NAME to output, listing [CRC32, size, SHA-256] per member.
+
+    digests maps member names to the SHA-256 hex digests of their content,
+    computed while writing them. The id hashes the whole listing, so two
+    bundles with the same id install the same files. Returns the document.
+    """
+    files = {
+        info.filename: [info.CRC, info.file_size, digests[info.filename]]
+        for info in output.infolist()
+        if info.filename != BUNDLE_FILES_NAME
+    }
+    bundle_files = {
+        "version": BUNDLE_FILES_VERSION,
+        "id": hashlib.sha256(
+            json.dumps(files, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        ).hexdigest(),
+        "type": "full",
+        "files": files,
+    }
+    output.writestr(
+        BUNDLE_FILES_NAME,
+        json.dumps(bundle_files, sort_keys=True, separators=(",", ":")),
+    )
+    return bundle_files
+
+
+def _recorded_digests(archive):
+    """Listing entries of a previous bundle (incremental rebuilds), by member name."""
+    if BUNDLE_FILES_NAME not in archive.NameToInfo:
+        return {}
+    try:
+        bundle_files = json.loads(archive.read(BUNDLE_FILES_NAME))
+    except ValueError:
+        return {}
+    if bundle_files.get("version") != BUNDLE_FILES_VERSION:
+        return {}
+    return bundle_files.get("files", {})
+
+
+def _copy_member(archive, info, output, arcname, digest=None, view=None):
+    """Copy a member into output; returns the SHA-256 of its content.
+
+    digest, when known from the listing of the bundle the member comes from,
+    is returned as-is. Otherwise members are hashed on the way through: raw
+    copies inflate the same chunks they copy, recompressed members hash what
+    they compress. view is the archive's mmap from _archive_view.
+    """
+    if info.compress_type in RAW_COPY_COMPRESS_TYPES and not info.flag_bits & ZIP_FLAG_ENCRYPTED:
+        hasher = None if digest else _ContentHasher(info.compress_type)
+        _raw_copy_member(archive, info, output, arcname, view, hasher)
+        return digest or hasher.hexdigest()
+
+    target = zipfile.ZipInfo(arcname, date_time=info.date_time)
+    target.compress_type = zipfile.ZIP_DEFLATED
+    target.file_size = info.file_size
+    digest = hashlib.sha256()
+    with archive.open(info) as source, output.open(target, "w") as dest:
+        while True:
+            chunk = source.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dest.write(chunk)
+    return digest.hexdigest()
+
+
+def _write_file_member(output, file_path, arcname):
+    """ZipFile.write, hashing the same mapped pages that get compressed."""
+    info = zipfile.ZipInfo.from_file(file_path, arcname)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle, output.open(info, "w") as dest:
+        with _mapped_file(handle) as view:
+            for offset in range(0, len(view), COPY_BUFFER_SIZE):
+                with view[offset : offset + COPY_BUFFER_SIZE] as chunk:
+                    digest.update(chunk)
+                    dest.write(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def _mapped_file(handle):
+    """A read-only memoryview over an open file; empty files have nothing to map."""
+    if not os.fstat(handle.fileno()).st_size:
+        yield memoryview(b"")
+        return
+    with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            yield view
+
+
+class _ContentHasher:
+    """SHA-256 of a member's content, fed with its stored or deflated bytes."""
+
+    def __init__(self, compress_type):
+        self._digest = hashlib.sha256()
+        self._inflater = None
+        if compress_type == zipfile.ZIP_DEFLATED:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def update(self, chunk):
+        if self._inflater is None:
+            self._digest.update(chunk)
+            return
+        # Bounded output, so a highly compressed chunk never inflates all at once
+        data = self._inflater.decompress(chunk, COPY_BUFFER_SIZE)
+        while True:
+            self._digest.update(data)
+            if not self._inflater.unconsumed_tail:
+                break
+            data = self._inflater.decompress(self._inflater.unconsumed_tail, COPY_BUFFER_SIZE)
+
+    def hexdigest(self):
+        if self._inflater is not None:
+            self._digest.update(self._inflater.flush())
+        return self._digest.hexdigest()
+
+
+def _raw_copy_member(archive, info, output, arcname, view=None, hasher=None):
+    """Copy a member's compressed bytes as-is; CRC and sizes carry over unchanged.
+
+    The file name lives only in the headers, so re-rooted members are copied raw
+    as well. zipfile has no public API for this, so the bookkeeping below mirrors
+    ZipFile._open_to_write and _ZipWriteFile.close.
+    """
+    target = zipfile.ZipInfo(arcname, date_time=info.date_time)
+    target.compress_type = info.compress_type
+    target.flag_bits = info.flag_bits & ZIP_FLAG_COMPRESS_OPTIONS
+    target.external_attr = 0o600 << 16
+    target.CRC = info.CRC
+    target.compress_size = info.compress_size
+    target.file_size = info.file_size
+
+    with archive._lock, output._lock:  # pylint: disable=protected-access
+        if output._writing:  # pylint: disable=protected-access
+            raise ValueError("Cannot raw-copy while another member is being written")
+
+        source = archive.fp
+        source.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.read(zipfile.sizeFileHeader))
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:  # pylint: disable=protected-access
+            raise zipfile.BadZipFile(f"Bad local header for member {info.filename}")
+        source.seek(
+            header[zipfile._FH_FILENAME_LENGTH]  # pylint: disable=protected-access
+            + header[zipfile._FH_EXTRA_FIELD_LENGTH],  # pylint: disable=protected-access
+            os.SEEK_CUR,
+        )
+
+        if output._seekable:  # pylint: disable=protected-access
+            output.fp.seek(output.start_dir)
+        target.header_offset = output.fp.tell()
+        output._writecheck(target)  # pylint: disable=protected-access
+        output._didModify = True  # pylint: disable=protected-access
+        output.fp.write(target.FileHeader())
+
+        for chunk in _member_data(source, info, view):
+            output.fp.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+        output.filelist.append(target)
+        output.NameToInfo[target.filename] = target
+        output.start_dir = output.fp.tell()
+
+
+def _archive_view(stack, archive):
+    """Map an archive opened from disk for the life of stack; None otherwise."""
+    if not isinstance(archive.fp, io.BufferedReader) or not os.fstat(archive.fp.fileno()).st_size:
+        return None
+    return stack.enter_context(mmap.mmap(archive.fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _release_pages(mapped, start, end):
+    # The kernel maps pages around each fault (fault-around), including some
+    # before start, so the range reaches back one more buffer.
+    if hasattr(mmap, "MADV_DONTNEED"):
+        start = max(0, start - COPY_BUFFER_SIZE)
+        page_start = start - start % mmap.PAGESIZE
+        mapped.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+
+
+def _member_data(source, info, view=None):
+    """Yield a member's compressed bytes from source, positioned at its data.
+
+    With the archive's mmap (view), the chunks are slices of the page cache
+    rather than copies. Pages already copied are dropped from the mapping, so
+    an archive mapped for a whole build does not stay resident.
+    """
+    start = source.tell()
+    end = start + info.compress_size
+    if view is not None:
+        if len(view) < end:
+            raise zipfile.BadZipFile(f"Truncated data for member {info.filename}")
+        with memoryview(view) as mapped:
+            for offset in range(start, end, COPY_BUFFER_SIZE):
+                with mapped[offset : min(offset + COPY_BUFFER_SIZE, end)] as chunk:
+                    yield chunk
+                _release_pages(view, offset, min(offset + COPY_BUFFER_SIZE, end))
+        return
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.read(min(COPY_BUFFER_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for member {info.filename}")
+        yield chunk
+        remaining -= len(chunk)
 
 
 def _sanitize_codedeploy_name(value):
@@ -348,16 +2651,18 @@ def _build_deployment_group_name(app_name):
 def _ensure_codedeploy_app(app_name):
     if not app_name:
         return
-    try:
-        CODEDEPLOY_CLIENT.get_application(applicationName=app_name)
+    if _CODEDEPLOY_APPS.get(app_name, 0) > time.monotonic():
         return
+    try:
+        _client("codedeploy").get_application(applicationName=app_name)
     except ClientError as exc:
         if exc.response["Error"]["Code"] != "ApplicationDoesNotExistException":
             raise
-    LOGGER.info("Creating CodeDeploy application: %s", app_name)
-    CODEDEPLOY_CLIENT.create_application(
-        applicationName=app_name, computePlatform="Server"
-    )
+        LOGGER.info("Creating CodeDeploy application: %s", app_name)
+        _client("codedeploy").create_application(
+            applicationName=app_name, computePlatform="Server"
+        )
+    _CODEDEPLOY_APPS[app_name] = time.monotonic() + CODEDEPLOY_CACHE_TTL_SECONDS
 
 
 def _ensure_deployment_group(
@@ -392,10 +2697,30 @@ def _ensure_deployment_group(
     if target_group_name:
         load_balancer_info = {"targetGroupInfoList": [{"name": target_group_name}]}
 
+    desired_state = {
+        "deploymentConfigName": deployment_config_name,
+        "serviceRoleArn": service_role_arn,
+        "autoScalingGroups": [asg_name],
+        "deploymentStyle": deployment_style,
+        "autoRollbackConfiguration": auto_rollback_config,
+        "loadBalancerInfo": load_balancer_info,
+    }
+    cache_key = (app_name, deployment_group_name)
+    cached = _DEPLOYMENT_GROUPS.get(cache_key)
+    if cached and cached[0] > time.monotonic() and cached[1] == desired_state:
+        return True
+
     try:
-        CODEDEPLOY_CLIENT.get_deployment_group(
+        response = _client("codedeploy").get_deployment_group(
             applicationName=app_name, deploymentGroupName=deployment_group_name
         )
+        if _deployment_group_matches(response.get("deploymentGroupInfo", {}), desired_state):
+            _DEPLOYMENT_GROUPS[cache_key] = (
+                time.monotonic() + CODEDEPLOY_CACHE_TTL_SECONDS,
+                desired_state,
+            )
+            return True
+
         update_args = {
             "applicationName": app_name,
             "currentDeploymentGroupName": deployment_group_name,
@@ -408,7 +2733,12 @@ def _ensure_deployment_group(
         if load_balancer_info:
             update_args["loadBalancerInfo"] = load_balancer_info
 
-        CODEDEPLOY_CLIENT.update_deployment_group(**update_args)
+        LOGGER.info("Updating CodeDeploy deployment group: %s", deployment_group_name)
+        _client("codedeploy").update_deployment_group(**update_args)
+        _DEPLOYMENT_GROUPS[cache_key] = (
+            time.monotonic() + CODEDEPLOY_CACHE_TTL_SECONDS,
+            desired_state,
+        )
         return True
     except ClientError as exc:
         if exc.response["Error"]["Code"] != "DeploymentGroupDoesNotExistException":
@@ -427,31 +2757,77 @@ def _ensure_deployment_group(
     if load_balancer_info:
         create_args["loadBalancerInfo"] = load_balancer_info
 
-    CODEDEPLOY_CLIENT.create_deployment_group(**create_args)
+    _client("codedeploy").create_deployment_group(**create_args)
+    _DEPLOYMENT_GROUPS[cache_key] = (
+        time.monotonic() + CODEDEPLOY_CACHE_TTL_SECONDS,
+        desired_state,
+    )
     return True
 
 
-def _discover_service_dirs(app_dir):
+def _deployment_group_matches(group_info, desired_state):
+    """Compare get_deployment_group output with the configuration we would apply."""
+    if group_info.get("deploymentConfigName") != desired_state["deploymentConfigName"]:
+        return False
+    if group_info.get("serviceRoleArn") != desired_state["serviceRoleArn"]:
+        return False
+
+    asg_names = sorted(group.get("name") for group in group_info.get("autoScalingGroups", []))
+    if asg_names != sorted(desired_state["autoScalingGroups"]):
+        return False
+
+    style = group_info.get("deploymentStyle", {})
+    desired_style = desired_state["deploymentStyle"]
+    if (
+        style.get("deploymentType") != desired_style["deploymentType"]
+        or style.get("deploymentOption") != desired_style["deploymentOption"]
+    ):
+        return False
+
+    rollback = group_info.get("autoRollbackConfiguration", {})
+    desired_rollback = desired_state["autoRollbackConfiguration"]
+    if bool(rollback.get("enabled")) != desired_rollback["enabled"]:
+        return False
+    if desired_rollback["enabled"] and sorted(rollback.get("events", [])) != sorted(
+        desired_rollback["events"]
+    ):
+        return False
+
+    # update_deployment_group only sends loadBalancerInfo when a target group is set.
+    desired_lb = desired_state["loadBalancerInfo"]
+    if desired_lb:
+        target_groups = sorted(
+            group.get("name")
+            for group in group_info.get("loadBalancerInfo", {}).get("targetGroupInfoList", [])
+        )
+        desired_groups = sorted(group["name"] for group in desired_lb["targetGroupInfoList"])
+        if target_groups != desired_groups:
+            return False
+
+    return True
+
+
+def _discover_service_dirs(app_dir, tree=LOCAL_TREE):
     services = []
-    if not app_dir or not os.path.isdir(app_dir):
+    if not app_dir or not tree.isdir(app_dir):
         return services
 
     entries = [
         entry
-        for entry in os.listdir(app_dir)
+        for entry in tree.listdir(app_dir)
         if entry not in IGNORE_ENTRIES and not entry.startswith(".")
     ]
 
     for entry in entries:
         full_path = os.path.join(app_dir, entry)
-        if not os.path.isdir(full_path):
+        if not tree.isdir(full_path):
             continue
         entry_lower = entry.lower()
         if entry == "WebSocketFullFiles":
             subdirs = [
                 sub
-                for sub in os.listdir(full_path)
-                if os.path.isdir(os.path.join(full_path, sub))
+                for sub in tree.listdir(full_path)
+                if tree.isdir(os.path.join(full_path, sub))
             ]
             for sub in subdirs:
                 services.append(
@@ -460,8 +2836,8 @@ def _discover_service_dirs(app_dir):
         elif entry_lower in ("s3 publish", "s3_publish", "s3publish"):
             subdirs = [
                 sub
-                for sub in os.listdir(full_path)
-                if os.path.isdir(os.path.join(full_path, sub))
+                for sub in tree.listdir(full_path)
+                if tree.isdir(os.path.join(full_path, sub))
             ]
             subdirs.sort()
             if subdirs:
@@ -477,8 +2853,9 @@ def _discover_service_dirs(app_dir):
     return services
 
 
-def _seed_ssm_parameters(services, ssm_base_path, files_to_seed):
+def _seed_ssm_parameters(services, ssm_base_path, files_to_seed, tree=LOCAL_TREE):
     base_path = ssm_base_path.rstrip("/")
+    candidates = {}
     for service in services:
         service_name = service.get("name")
         service_path = service.get("path")
@@ -489,27 +2866,76 @@ def _seed_ssm_parameters(services, ssm_base_path, files_to_seed):
             continue
         for filename in files_to_seed:
             file_path = os.path.join(service_path, filename)
-            if not os.path.isfile(file_path):
+            if not tree.isfile(file_path):
                 continue
+            candidates.setdefault(f"{base_path}/{service_name}/{filename}", file_path)
+
+    if not candidates:
+        return 0
+
+    missing = _missing_ssm_parameters(list(candidates))
+    for param_name in candidates:
+        if param_name not in missing:
+            LOGGER.info("SSM parameter already exists: %s", param_name)
+    if not missing:
+        return 0
+
+    parameters = [
+        (param_name, tree.read_bytes(file_path).decode("utf-8", errors="replace"))
+        for param_name, file_path in candidates.items()
+        if param_name in missing
+    ]
+    workers = max(1, min(SSM_SEED_WORKERS, len(parameters)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_put_ssm_parameter, param_name, content)
+            for param_name, content in parameters
+        ]
+        for future in futures:
+            future.result()
+    return len(parameters)
+
+
+def _missing_ssm_parameters(param_names):
+    missing = set()
+    for start in range(0, len(param_names), SSM_GET_PARAMETERS_BATCH):
+        batch = param_names[start : start + SSM_GET_PARAMETERS_BATCH]
+        response = _call_with_backoff(_client("ssm").get_parameters, Names=batch)
+        missing.update(response.get("InvalidParameters", []))
+    return missing
+
+
+def _put_ssm_parameter(param_name, content):
+    put_args = {
+        "Name": param_name,
+        "Type": "SecureString",
+        "Value": content,
+        "Overwrite": False,
+    }
+    if SSM_KMS_KEY_ID:
+        put_args["KeyId"] = SSM_KMS_KEY_ID
 
-            param_name = f"{base_path}/{service_name}/{filename}"
-            with open(file_path, "rb") as handle:
-                content = handle.read().decode("utf-8", errors="replace")
+    try:
+        _call_with_backoff(_client("ssm").put_parameter, **put_args)
+        LOGGER.info("Seeded SSM parameter: %s", param_name)
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] == "ParameterAlreadyExists":
+            LOGGER.info("SSM parameter already exists: %s", param_name)
+        else:
+            raise
 
-            put_args = {
-                "Name": param_name,
-                "Type": "SecureString",
-                "Value": content,
-                "Overwrite": False,
-            }
-            if SSM_KMS_KEY_ID:
-                put_args["KeyId"] = SSM_KMS_KEY_ID
 
-            try:
-                SSM_CLIENT.put_parameter(**put_args)
-                LOGGER.info("Seeded SSM parameter: %s", param_name)
-            except ClientError as exc:
-                if exc.response["Error"]["Code"] == "ParameterAlreadyExists":
-                    LOGGER.info("SSM parameter already exists: %s", param_name)
-                else:
-                    raise
+def _call_with_backoff(operation, **kwargs):
+    # Full-jitter exponential backoff on throttling, on top of botocore's retries.
+    for attempt in range(THROTTLE_MAX_ATTEMPTS):
+        try:
+            return operation(**kwargs)
+        except ClientError as exc:
+            if (
+                exc.response["Error"]["Code"] not in THROTTLING_ERROR_CODES
+                or attempt == THROTTLE_MAX_ATTEMPTS - 1
+            ):
+                raise
+            delay = min(THROTTLE_BACKOFF_CAP_SECONDS, THROTTLE_BACKOFF_BASE_SECONDS * 2**attempt)
+            time.sleep(random.uniform(0, delay))
+    return None
@@ -12,6 +12,8 @@ $aliasMap = @{
     "WebSocketsWebAPI"        = "WebSocketWebAPI"
 }
 
+. (Join-Path $PSScriptRoot "bundle-delta.ps1")
+
 function Get-AppAlias([string]$name) {
     if ($aliasMap.ContainsKey($name)) {
         return $aliasMap[$name]
@@ -122,6 +124,14 @@ function Invoke-Deployment {
     New-Item -ItemType Directory -Path $BackupRoot -Force | Out-Null
     New-Item -ItemType Directory -Path $LogsRoot -Force | Out-Null
 
+    # Delta bundles only carry changed files; rebuild the complete app folder first
+    try {
+        Restore-BundleDelta $BackupRoot
+    } catch {
+        Write-Host "ERROR: Could not rebuild bundle: $($_.Exception.Message)"
+        return 1
+    }
+
     $bundleAppPath = Get-BundleAppPath
     $services = Get-DeploymentServices $bundleAppPath $AppRoot
     $bundleNames = @()
@@ -0,0 +1,160 @@
+# Bundle Delta - Rebuild the complete app folder of a delta bundle before Install
+# Dot-sourced by before-install.ps1. A delta bundle only carries the files that
+# changed since the deployment group's previous bundle; bundle-files.json lists
+# every file of the complete bundle, the files to delete and where the complete
+# bundle is kept in S3. The full tree is rebuilt in the deployment archive from
+# a local copy of the previous bundle (or from S3 on new or out-of-date
+# instances), so Install and after-install always see a complete bundle.
+
+function Get-BundleBaseRoot([string]$backupRoot) {
+    $groupId = $env:DEPLOYMENT_GROUP_ID
+    if (-not $groupId) {
+        $groupId = "default"
+    }
+    return Join-Path (Join-Path $backupRoot "bundle-base") $groupId
+}
+
+function Read-BundleFiles([string]$path) {
+    if (-not (Test-Path $path)) {
+        return $null
+    }
+    try {
+        return Get-Content -Path $path -Raw | ConvertFrom-Json -ErrorAction Stop
+    } catch {
+        Write-Host "Warning: Could not read ${path}: $($_.Exception.Message)"
+        return $null
+    }
+}
+
+function Get-BundleRegion() {
+    try {
+        $token = Invoke-RestMethod -Uri http://169.254.169.254/latest/api/token -Method PUT -Headers @{"X-aws-ec2-metadata-token-ttl-seconds"="21600"} -TimeoutSec 5
+        return Invoke-RestMethod -Uri http://169.254.169.254/latest/meta-data/placement/region -Headers @{"X-aws-ec2-metadata-token"=$token} -TimeoutSec 5
+    } catch {
+        return "eu-west-1"
+    }
+}
+
+# robocopy skips files whose size and timestamp match, which deterministic
+# builds can produce for changed files, so /IS /IT copy everything.
+function Copy-BundleTree([string]$source, [string]$destination, [switch]$Mirror) {
+    New-Item -ItemType Directory -Path $source -Force | Out-Null
+    New-Item -ItemType Directory -Path $destination -Force | Out-Null
+    $mode = if ($Mirror) { "/MIR" } else { "/E" }
+    & robocopy $source $destination $mode /IS /IT /R:2 /W:1 /NFL /NDL /NJH /NJS /NP | Out-Null
+    # robocopy exit codes below 8 mean success
+    if ($LASTEXITCODE -ge 8) {
+        throw "robocopy $source -> $destination failed with exit code $LASTEXITCODE"
+    }
+    $global:LASTEXITCODE = 0
+}
+
+function Test-BundleTree([string]$appPath, $bundleFiles) {
+    $expected = @{}
+    foreach ($entry in $bundleFiles.files.PSObject.Properties) {
+        if ($entry.Name.StartsWith("app/")) {
+            $expected[$entry.Name.Substring(4).Replace("/", "\")] = [int64]$entry.Value[1]
+        }
+    }
+
+    $actual = @(Get-ChildItem -Path $appPath -File -Recurse -Force -ErrorAction SilentlyContinue)
+    if ($actual.Count -ne $expected.Count) {
+        return $false
+    }
+    $rootLength = $appPath.TrimEnd("\").Length + 1
+    foreach ($file in $actual) {
+        $relative = $file.FullName.Substring($rootLength)
+        if (-not $expected.ContainsKey($relative) -or $expected[$relative] -ne $file.Length) {
+            return $false
+        }
+    }
+    return $true
+}
+
+function Expand-FullBundle($bundleFiles, [string]$workRoot) {
+    $location = $bundleFiles.full_bundle
+    $zipPath = Join-Path $workRoot "full-bundle.zip"
+    $expandPath = Join-Path $workRoot "full-bundle"
+    Remove-Item -Path $expandPath -Recurse -Force -ErrorAction SilentlyContinue
+    New-Item -ItemType Directory -Path $workRoot -Force | Out-Null
+
+    $region = Get-BundleRegion
+    Write-Host "Downloading full bundle s3://$($location.bucket)/$($location.key)"
+    aws s3 cp "s3://$($location.bucket)/$($location.key)" $zipPath --region $region --only-show-errors
+    if ($LASTEXITCODE -ne 0) {
+        throw "Could not download full bundle s3://$($location.bucket)/$($location.key)"
+    }
+
+    Add-Type -AssemblyName System.IO.Compression.FileSystem
+    [System.IO.Compression.ZipFile]::ExtractToDirectory($zipPath, $expandPath)
+    Remove-Item -Path $zipPath -Force -ErrorAction SilentlyContinue
+
+    $expandedFiles = Read-BundleFiles (Join-Path $expandPath "bundle-files.json")
+    if (-not $expandedFiles -or $expandedFiles.id -ne $bundleFiles.id) {
+        throw "Full bundle s3://$($location.bucket)/$($location.key) is not bundle $($bundleFiles.id)"
+    }
+    return $expandPath
+}
+
+function Remove-EmptyFolders([string]$root) {
+    Get-ChildItem -Path $root -Directory -Recurse -Force -ErrorAction SilentlyContinue |
+        Sort-Object { $_.FullName.Length } -Descending |
+        Where-Object { -not (Get-ChildItem -LiteralPath $_.FullName -Force -ErrorAction SilentlyContinue) } |
+        Remove-Item -Force -ErrorAction SilentlyContinue
+}
+
+function Restore-BundleDelta([string]$backupRoot) {
+    $bundleRoot = (Resolve-Path (Join-Path $PSScriptRoot "..")).Path
+    $bundleFilesPath = Join-Path $bundleRoot "bundle-files.json"
+    if (-not (Test-Path $bundleFilesPath)) {
+        Write-Host "Bundle has no bundle-files.json - installing as-is"
+        return
+    }
+    $bundleFiles = Read-BundleFiles $bundleFilesPath
+    if (-not $bundleFiles) {
+        throw "Could not read $bundleFilesPath"
+    }
+
+    $appPath = Join-Path $bundleRoot "app"
+    $baseRoot = Get-BundleBaseRoot $backupRoot
+    $baseApp = Join-Path $baseRoot "app"
+    $baseFilesPath = Join-Path $baseRoot "bundle-files.json"
+
+    if ($bundleFiles.type -ne "delta") {
+        Write-Host "Full bundle $($bundleFiles.id) - refreshing local base"
+        Remove-Item -Path $baseFilesPath -Force -ErrorAction SilentlyContinue
+        Copy-BundleTree $appPath $baseApp -Mirror
+        Copy-Item -Path $bundleFilesPath -Destination $baseFilesPath -Force
+        return
+    }
+
+    $baseFiles = Read-BundleFiles $baseFilesPath
+    $rebuilt = $false
+    if ($baseFiles -and $baseFiles.id -eq $bundleFiles.base -and (Test-Path $baseApp)) {
+        Write-Host "Applying delta bundle $($bundleFiles.id) to local base $($baseFiles.id)"
+        # The base is only valid again once the delta has been applied completely.
+        Remove-Item -Path $baseFilesPath -Force
+        Copy-BundleTree $appPath $baseApp
+        foreach ($name in $bundleFiles.delete) {
+            $path = Join-Path $baseApp $name.Substring(4).Replace("/", "\")
+            Remove-Item -LiteralPath $path -Force -ErrorAction SilentlyContinue
+        }
+        Remove-EmptyFolders $baseApp
+        $rebuilt = Test-BundleTree $baseApp $bundleFiles
+        if (-not $rebuilt) {
+            Write-Host "WARNING: Local base does not match bundle $($bundleFiles.id) after applying the delta"
+        }
+    } else {
+        Write-Host "Local base does not match delta base $($bundleFiles.base) - using the full bundle"
+    }
+
+    if (-not $rebuilt) {
+        $fullRoot = Expand-FullBundle $bundleFiles (Join-Path $backupRoot "bundle-download")
+        Copy-BundleTree (Join-Path $fullRoot "app") $baseApp -Mirror
+        Remove-Item -Path $fullRoot -Recurse -Force -ErrorAction SilentlyContinue
+    }
+
+    Write-Host "Rebuilding complete app folder in deployment archive"
+    Copy-BundleTree $baseApp $appPath -Mirror
+    Copy-Item -Path $bundleFilesPath -Destination $baseFilesPath -Force
+}
@@ -6,6 +6,8 @@ $BackupRoot = "C:\Backups\AjyalApp"
 $LogsRoot = "C:\AjyalApp\logs"
 $appcmd = "$env:windir\system32\inetsrv\appcmd.exe"
 
+. (Join-Path $PSScriptRoot "bundle-delta.ps1")
+
 function Invoke-WithDeploymentLock([scriptblock]$script) {
     $mutexName = "Global\AjyalCodeDeployLock"
     $mutex = $null
@@ -40,6 +42,14 @@ function Invoke-Deployment {
     New-Item -ItemType Directory -Path $BackupRoot -Force | Out-Null
     New-Item -ItemType Directory -Path $LogsRoot -Force | Out-Null
 
+    # Delta bundles only carry changed files; rebuild the complete app folder first
+    try {
+        Restore-BundleDelta $BackupRoot
+    } catch {
+        Write-Host "ERROR: Could not rebuild bundle: $($_.Exception.Message)"
+        return 1
+    }
+
     if (Test-Path $appcmd) {
         try {
             & $appcmd list apppool /name:"$SiteName-Pool" 2>$null | Out-Null
@@ -6,6 +6,8 @@ $BackupRoot = "C:\Backups\AjyalIntegration"
 $LogsRoot = "C:\AjyalIntegration\logs"
 $appcmd = "$env:windir\system32\inetsrv\appcmd.exe"
 
+. (Join-Path $PSScriptRoot "bundle-delta.ps1")
+
 function Get-AppAlias([string]$name) {
     if ($name -eq "S3 Publish") {
         return "FileMgmtS3"
@@ -112,6 +114,14 @@ New-Item -ItemType Directory -Path $AppRoot -Force | Out-Null
 New-Item -ItemType Directory -Path $BackupRoot -Force | Out-Null
 New-Item -ItemType Directory -Path $LogsRoot -Force | Out-Null
 
+# Delta bundles only carry changed files; rebuild the complete app folder first
+try {
+    Restore-BundleDelta $BackupRoot
+} catch {
+    Write-Host "ERROR: Could not rebuild bundle: $($_.Exception.Message)"
+    return 1
+}
+
 $bundleAppPath = Get-BundleAppPath
 $services = Get-DeploymentServices $bundleAppPath $AppRoot
 $bundleNames = @()
@@ -30,6 +30,8 @@ locals {
     ssm_base_path          = var.enable_codedeploy_per_service ? "/${local.name_prefix}/secrets/api-services" : ""
     ssm_files              = []
     seed_ssm               = var.enable_codedeploy_per_service ? true : false
+    download_workers       = lookup(var.codedeploy_bundler_download_workers, "api", 4)
+    deploy_policy          = lookup(var.codedeploy_bundler_deploy_policies, "api", "")
   }
   bundler_integration_config = {
     template               = "integration-server"
@@ -45,6 +47,8 @@ locals {
     ssm_base_path          = var.enable_codedeploy_per_service ? "/${local.name_prefix}/secrets/integration-services" : ""
     ssm_files              = []
     seed_ssm               = var.enable_codedeploy_per_service ? true : false
+    download_workers       = lookup(var.codedeploy_bundler_download_workers, "integration", 4)
+    deploy_policy          = lookup(var.codedeploy_bundler_deploy_policies, "integration", "")
   }
   bundler_app_config = {
     template               = "app-server"
@@ -60,12 +64,19 @@ locals {
     ssm_base_path          = var.enable_codedeploy_per_service ? "/${local.name_prefix}/secrets/app-server" : ""
     ssm_files              = var.enable_codedeploy_per_service ? ["web.config", "SystemSettings.xml", "App_GlobalResources/Configuration.resx", "PublishedServices.json"] : []
     seed_ssm               = false
+    download_workers       = lookup(var.codedeploy_bundler_download_workers, "app", 4)
+    deploy_policy          = lookup(var.codedeploy_bundler_deploy_policies, "app", "")
   }
   bundler_prefix_config = var.enable_codedeploy_bundler ? tomap({
     "${var.codedeploy_bundler_api_prefix}"         = local.bundler_api_config
     "${var.codedeploy_bundler_integration_prefix}" = local.bundler_integration_config
     "${var.codedeploy_bundler_app_prefix}"         = local.bundler_app_config
   }) : tomap({})
+  # Deployment-completion events are only needed to release queue-latest bundles
+  bundler_queue_latest = contains([
+    for config in values(local.bundler_prefix_config) :
+    config.deploy_policy != "" ? config.deploy_policy : var.codedeploy_bundler_deploy_policy
+  ], "queue-latest")
   bundler_kms_statement = length(local.bundler_kms_key_arns) > 0 ? [
     for key_arn in local.bundler_kms_key_arns : {
       Effect = "Allow"
@@ -78,6 +89,22 @@ locals {
       Resource = key_arn
     }
   ] : []
+  # Removals keep the bundle_all source indexes current; they never trigger a build.
+  bundler_notification_events = var.codedeploy_bundler_source_index ? ["s3:ObjectCreated:*", "s3:ObjectRemoved:*"] : ["s3:ObjectCreated:*"]
+  bundler_pipeline_stages = var.enable_codedeploy_bundler && var.codedeploy_bundler_pipeline_enabled ? toset(["build", "register", "deploy"]) : toset([])
+  bundler_pipeline_statement = length(local.bundler_pipeline_stages) > 0 ? [
+    {
+      Effect = "Allow"
+      Action = [
+        "sqs:SendMessage",
+        "sqs:ReceiveMessage",
+        "sqs:DeleteMessage",
+        "sqs:ChangeMessageVisibility",
+        "sqs:GetQueueAttributes"
+      ]
+      Resource = [for queue in aws_sqs_queue.bundler_pipeline : queue.arn]
+    }
+  ] : []
   codedeploy_kms_statement = var.kms_key_arn != "" ? [
     {
       Effect = "Allow"
@@ -638,6 +665,7 @@ resource "aws_iam_role_policy" "codedeploy_bundler" {
             "s3:GetObject",
             "s3:GetObjectVersion",
             "s3:PutObject",
+            "s3:DeleteObject",
             "s3:ListBucket"
           ]
           Resource = [
@@ -657,13 +685,17 @@ resource "aws_iam_role_policy" "codedeploy_bundler" {
             "codedeploy:GetDeployment",
             "codedeploy:GetDeploymentConfig",
             "codedeploy:GetDeploymentGroup",
-            "codedeploy:UpdateDeploymentGroup"
+            "codedeploy:UpdateDeploymentGroup",
+            "codedeploy:ListDeployments",
+            "codedeploy:BatchGetDeployments",
+            "codedeploy:StopDeployment"
           ]
           Resource = "*"
         },
         {
           Effect = "Allow"
           Action = [
+            "ssm:GetParameters",
             "ssm:PutParameter"
           ]
           Resource = "arn:aws:ssm:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:parameter/${local.name_prefix}/secrets/*"
@@ -674,9 +706,18 @@ resource "aws_iam_role_policy" "codedeploy_bundler" {
             "iam:PassRole"
           ]
           Resource = try(aws_iam_role.codedeploy[0].arn, "*")
+        },
+        {
+          # Failed coalesced builds are retried in a new invocation.
+          Effect = "Allow"
+          Action = [
+            "lambda:InvokeFunction"
+          ]
+          Resource = "arn:aws:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${local.name_prefix}-codedeploy-bundler"
         }
       ],
-      local.bundler_kms_statement
+      local.bundler_kms_statement,
+      local.bundler_pipeline_statement
     )
   })
 }
@@ -712,6 +753,21 @@ resource "aws_lambda_function" "codedeploy_bundler" {
       DEFAULT_AUTO_ROLLBACK      = var.enable_auto_rollback ? "true" : "false"
       SSM_KMS_KEY_ID             = var.codedeploy_bundler_ssm_kms_key_id
       KMS_KEY_ARN                = var.kms_key_arn
+      DEFAULT_BUNDLE_MODE        = var.codedeploy_bundler_bundle_mode
+      DEFAULT_BUNDLE_CACHE       = var.codedeploy_bundler_bundle_cache ? "true" : "false"
+      DEFAULT_INCREMENTAL        = var.codedeploy_bundler_incremental ? "true" : "false"
+      DEFAULT_COALESCE_WINDOW_SECONDS = tostring(var.codedeploy_bundler_coalesce_window_seconds)
+      DEFAULT_DELTA_BUNDLES      = var.codedeploy_bundler_delta_bundles ? "true" : "false"
+      DELTA_MAX_RATIO            = tostring(var.codedeploy_bundler_delta_max_ratio)
+      S3_TRANSFER_CONFIG         = jsonencode(var.codedeploy_bundler_s3_transfer)
+      CLIENT_LIMITS              = jsonencode(var.codedeploy_bundler_client_limits)
+      METRICS_ENABLED            = var.codedeploy_bundler_metrics_enabled ? "true" : "false"
+      METRICS_NAMESPACE          = var.codedeploy_bundler_metrics_namespace
+      ARTIFACT_BUCKET            = var.artifact_bucket_name
+      DEFAULT_DEPLOY_POLICY      = var.codedeploy_bundler_deploy_policy
+      DEFAULT_SOURCE_INDEX       = var.codedeploy_bundler_source_index ? "true" : "false"
+      SOURCE_INDEX_RECONCILE_SECONDS = tostring(var.codedeploy_bundler_source_index_reconcile_seconds)
+      PIPELINE_QUEUE_URLS        = jsonencode({ for stage, queue in aws_sqs_queue.bundler_pipeline : stage => queue.url })
       LOG_LEVEL                  = "INFO"
     }
   }
@@ -734,21 +790,21 @@ resource "aws_s3_bucket_notification" "codedeploy_bundler" {
 
   lambda_function {
     lambda_function_arn = aws_lambda_function.codedeploy_bundler[0].arn
-    events              = ["s3:ObjectCreated:*"]
+    events              = local.bundler_notification_events
     filter_prefix       = var.codedeploy_bundler_api_prefix
     filter_suffix       = ".zip"
   }
 
   lambda_function {
     lambda_function_arn = aws_lambda_function.codedeploy_bundler[0].arn
-    events              = ["s3:ObjectCreated:*"]
+    events              = local.bundler_notification_events
     filter_prefix       = var.codedeploy_bundler_integration_prefix
     filter_suffix       = ".zip"
   }
 
   lambda_function {
     lambda_function_arn = aws_lambda_function.codedeploy_bundler[0].arn
-    events              = ["s3:ObjectCreated:*"]
+    events              = local.bundler_notification_events
     filter_prefix       = var.codedeploy_bundler_app_prefix
     filter_suffix       = ".zip"
   }
@@ -756,6 +812,90 @@ resource "aws_s3_bucket_notification" "codedeploy_bundler" {
   depends_on = [aws_lambda_permission.codedeploy_bundler_s3]
 }
 
+# Deployment completions release queue-latest bundles parked behind them
+resource "aws_cloudwatch_event_rule" "codedeploy_bundler_deployments" {
+  count       = local.bundler_queue_latest ? 1 : 0
+  name        = "${local.name_prefix}-bundler-deployment-state"
+  description = "CodeDeploy deployment completions for the bundler's queued revisions"
+
+  event_pattern = jsonencode({
+    source      = ["aws.codedeploy"]
+    detail-type = ["CodeDeploy Deployment State-change Notification"]
+    detail = {
+      state = ["SUCCESS", "FAILURE", "STOP"]
+    }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "codedeploy_bundler_deployments" {
+  count     = local.bundler_queue_latest ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.codedeploy_bundler_deployments[0].name
+  target_id = "CodeDeployBundler"
+  arn       = aws_lambda_function.codedeploy_bundler[0].arn
+}
+
+resource "aws_lambda_permission" "codedeploy_bundler_events" {
+  count         = local.bundler_queue_latest ? 1 : 0
+  statement_id  = "AllowEventBridgeInvokeCodeDeployBundler"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.codedeploy_bundler[0].arn
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.codedeploy_bundler_deployments[0].arn
+}
+
+#------------------------------------------------------------------------------
+# Bundler Pipeline (build -> register -> deploy over SQS FIFO queues)
+#------------------------------------------------------------------------------
+
+resource "aws_sqs_queue" "bundler_pipeline_dlq" {
+  for_each = local.bundler_pipeline_stages
+  name     = "${local.name_prefix}-bundler-${each.key}-dlq.fifo"
+
+  fifo_queue                = true
+  message_retention_seconds = 1209600
+  sqs_managed_sse_enabled   = true
+
+  tags = {
+    Name = "${local.name_prefix}-bundler-${each.key}-dlq"
+  }
+}
+
+resource "aws_sqs_queue" "bundler_pipeline" {
+  for_each = local.bundler_pipeline_stages
+  name     = "${local.name_prefix}-bundler-${each.key}.fifo"
+
+  fifo_queue                = true
+  message_retention_seconds = 345600
+  sqs_managed_sse_enabled   = true
+  # Six times the function timeout, as recommended for Lambda event sources
+  visibility_timeout_seconds = min(var.codedeploy_bundler_lambda_timeout * 6, 43200)
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.bundler_pipeline_dlq[each.key].arn
+    maxReceiveCount     = var.codedeploy_bundler_pipeline_max_receive_count
+  })
+
+  tags = {
+    Name = "${local.name_prefix}-bundler-${each.key}"
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "bundler_pipeline" {
+  for_each         = local.bundler_pipeline_stages
+  event_source_arn = aws_sqs_queue.bundler_pipeline[each.key].arn
+  function_name    = aws_lambda_function.codedeploy_bundler[0].arn
+
+  # One bundle per invocation, so each build gets the whole timeout
+  batch_size              = each.key == "build" ? 1 : 10
+  function_response_types = ["ReportBatchItemFailures"]
+
+  scaling_config {
+    maximum_concurrency = lookup(var.codedeploy_bundler_pipeline_concurrency, each.key, 2)
+  }
+
+  depends_on = [aws_iam_role_policy.codedeploy_bundler]
+}
+
 #------------------------------------------------------------------------------
 # Client Deployment User (for external uploads to S3)
 #------------------------------------------------------------------------------
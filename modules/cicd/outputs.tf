@@ -96,3 +96,13 @@ output "client_deploy_policy_arn" {
   description = "Client deployment IAM policy ARN"
   value       = var.enable_client_deploy_user ? aws_iam_policy.client_deploy[0].arn : null
 }
+
+output "codedeploy_bundler_pipeline_queue_urls" {
+  description = "Bundler pipeline queue URLs by stage (empty unless the pipeline is enabled)"
+  value       = { for stage, queue in aws_sqs_queue.bundler_pipeline : stage => queue.url }
+}
+
+output "codedeploy_bundler_pipeline_dlq_urls" {
+  description = "Bundler pipeline dead-letter queue URLs by stage"
+  value       = { for stage, queue in aws_sqs_queue.bundler_pipeline_dlq : stage => queue.url }
+}
@@ -0,0 +1,116 @@
+"""Stream mode must see the same app/ tree as extract mode.
+
+Service discovery and SSM seeding run against either the extracted files
+(extract mode) or the source archive members (stream mode); these tests build
+both from the same zips and compare them. Run with:
+
+  python -m unittest discover modules/cicd/tests
+
+Needs boto3 (and with it botocore), like the handler itself.
+"""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+BUNDLER_DIR = Path(__file__).resolve().parents[1] / "lambda" / "deploy-bundler"
+sys.path.insert(0, str(BUNDLER_DIR))
+
+import handler  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def make_zip(members):
+    """Zip of members: {name: bytes}, where names ending in "/" are directory entries."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+class StreamExtractParityTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="bundler-test-")
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+
+    def extract_tree(self, members):
+        """app/ as extract mode lays it out on disk."""
+        extracted_dir = os.path.join(self.workdir, "extracted")
+        app_dir = os.path.join(self.workdir, "bundle", handler.BUNDLE_APP_DIR)
+        with zipfile.ZipFile(make_zip(members)) as archive:
+            archive.extractall(extracted_dir)
+        handler._copy_contents(handler._normalize_source_root(extracted_dir), app_dir)
+        return app_dir, handler.LOCAL_TREE
+
+    def stream_tree(self, members):
+        """app/ as stream mode sees it, straight from the archive members."""
+        archive = zipfile.ZipFile(make_zip(members))
+        self.addCleanup(archive.close)
+        entries = {
+            f"{handler.BUNDLE_APP_DIR}/{path}": (archive, info)
+            for path, info in handler._archive_entries(archive).items()
+        }
+        return handler.BUNDLE_APP_DIR, handler._ArchiveTree(entries)
+
+    def walk(self, app_dir, tree):
+        """Every path under app_dir, relative to it, with whether it is a directory."""
+        found = set()
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            for name in tree.listdir(os.path.join(app_dir, relative) if relative else app_dir):
+                path = f"{relative}/{name}" if relative else name
+                is_dir = tree.isdir(os.path.join(app_dir, path))
+                self.assertEqual(tree.isfile(os.path.join(app_dir, path)), not is_dir, path)
+                found.add((path, is_dir))
+                if is_dir:
+                    pending.append(path)
+        return found
+
+    def services(self, app_dir, tree):
+        return sorted(
+            (service["name"], os.path.relpath(service["path"], app_dir))
+            for service in handler._discover_service_dirs(app_dir, tree)
+        )
+
+    def assert_parity(self, members):
+        extract = self.extract_tree(members)
+        stream = self.stream_tree(members)
+        self.assertEqual(self.walk(*stream), self.walk(*extract))
+        self.assertEqual(self.services(*stream), self.services(*extract))
+        return self.services(*stream)
+
+    def test_empty_directory_entry(self):
+        services = self.assert_parity({"pub/Svc/a.dll": b"a", "pub/Empty/": b""})
+        self.assertEqual([name for name, _path in services], ["Empty", "Svc"])
+
+    def test_directory_entries_with_files(self):
+        self.assert_parity(
+            {
+                "pub/": b"",
+                "pub/Svc/": b"",
+                "pub/Svc/a.dll": b"a",
+                "pub/Svc/appsettings.json": b"{}",
+                "pub/WebSocketFullFiles/Hub/": b"",
+                "pub/WebSocketFullFiles/Empty/": b"",
+                "pub/WebSocketFullFiles/Hub/hub.dll": b"h",
+                "pub/__MACOSX/Svc/": b"",
+            }
+        )
+
+    def test_empty_directories_are_not_zipped(self):
+        _app_dir, tree = self.stream_tree({"pub/Svc/a.dll": b"a", "pub/Empty/": b""})
+        output = io.BytesIO()
+        count, bundle_files = handler._write_streaming_bundle(tree, [], output)
+        self.assertEqual(count, 1)
+        self.assertEqual(list(bundle_files["files"]), [f"{handler.BUNDLE_APP_DIR}/Svc/a.dll"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -221,6 +221,152 @@ variable "codedeploy_bundler_lambda_storage" {
   default     = 2048
 }
 
+variable "codedeploy_bundler_bundle_mode" {
+  description = "Bundling mode: extract (extract sources to /tmp, copy, then zip) or stream (opt-in zip-to-zip copy with no extraction to /tmp)"
+  type        = string
+  default     = "extract"
+
+  validation {
+    condition     = contains(["stream", "extract"], var.codedeploy_bundler_bundle_mode)
+    error_message = "codedeploy_bundler_bundle_mode must be 'stream' or 'extract'"
+  }
+}
+
+variable "codedeploy_bundler_bundle_cache" {
+  description = "Reuse an existing bundle when source ETags, templates and prefix config are unchanged"
+  type        = bool
+  default     = true
+}
+
+variable "codedeploy_bundler_incremental" {
+  description = "For bundle_all prefixes in stream mode, only re-fetch sources whose ETag changed since the last bundle"
+  type        = bool
+  default     = true
+}
+
+variable "codedeploy_bundler_delta_bundles" {
+  description = "Deploy only the files changed since a deployment group's last bundle; instances without that bundle fetch the full one from S3"
+  type        = bool
+  default     = false
+}
+
+variable "codedeploy_bundler_delta_max_ratio" {
+  description = "Deploy the full bundle instead of a delta once changed files exceed this share of the bundle's app bytes"
+  type        = number
+  default     = 0.5
+
+  validation {
+    condition     = var.codedeploy_bundler_delta_max_ratio > 0 && var.codedeploy_bundler_delta_max_ratio <= 1
+    error_message = "codedeploy_bundler_delta_max_ratio must be greater than 0 and at most 1"
+  }
+}
+
+variable "codedeploy_bundler_source_index" {
+  description = "Opt-in: keep an index of each bundle_all prefix's source zips from S3 events instead of listing the prefix on every build (also subscribes the bundler to ObjectRemoved events)"
+  type        = bool
+  default     = false
+}
+
+variable "codedeploy_bundler_source_index_reconcile_seconds" {
+  description = "Re-list a bundle_all prefix once its source index is this old (0 re-lists on every build)"
+  type        = number
+  default     = 3600
+
+  validation {
+    condition     = var.codedeploy_bundler_source_index_reconcile_seconds >= 0
+    error_message = "codedeploy_bundler_source_index_reconcile_seconds must not be negative"
+  }
+}
+
+variable "codedeploy_bundler_coalesce_window_seconds" {
+  description = "Seconds to wait for further uploads before rebuilding a bundle_all prefix; every upload waits (billed) this long, so only enable it for bursty prefixes (0 disables cross-invocation coalescing)"
+  type        = number
+  default     = 0
+}
+
+variable "codedeploy_bundler_download_workers" {
+  description = "Concurrent source downloads per bundle_all prefix (keys: api, integration, app)"
+  type        = map(number)
+  default = {
+    api         = 4
+    integration = 8
+    app         = 2
+  }
+}
+
+variable "codedeploy_bundler_deploy_policy" {
+  description = "What to do when a new revision arrives while a deployment is in flight: skip-same-revision (create and let CodeDeploy reject overlaps), supersede (stop the in-flight deployment) or queue-latest (deploy only the newest revision once the current one finishes)"
+  type        = string
+  default     = "skip-same-revision"
+
+  validation {
+    condition     = contains(["skip-same-revision", "supersede", "queue-latest"], var.codedeploy_bundler_deploy_policy)
+    error_message = "codedeploy_bundler_deploy_policy must be 'skip-same-revision', 'supersede' or 'queue-latest'"
+  }
+}
+
+variable "codedeploy_bundler_deploy_policies" {
+  description = "Per-prefix overrides of codedeploy_bundler_deploy_policy (keys: api, integration, app)"
+  type        = map(string)
+  default     = {}
+
+  validation {
+    condition     = alltrue([for policy in values(var.codedeploy_bundler_deploy_policies) : contains(["skip-same-revision", "supersede", "queue-latest"], policy)])
+    error_message = "codedeploy_bundler_deploy_policies values must be 'skip-same-revision', 'supersede' or 'queue-latest'"
+  }
+}
+
+variable "codedeploy_bundler_s3_transfer" {
+  description = "Global S3 transfer profile for the bundler (multipart_threshold_mb, multipart_chunksize_mb, max_concurrency, spool_max_mb); prefixes can override via a transfer entry"
+  type        = map(number)
+  default     = {}
+}
+
+variable "codedeploy_bundler_client_limits" {
+  description = "Per-service cap on in-flight AWS calls (and connection pool size) for the bundler, e.g. { s3 = 64, codedeploy = 4, ssm = 8 }"
+  type        = map(number)
+  default     = {}
+}
+
+variable "codedeploy_bundler_metrics_enabled" {
+  description = "Emit per-stage bundler spans (duration, bytes, files, peak /tmp and RSS) as CloudWatch Embedded Metric Format logs"
+  type        = bool
+  default     = true
+}
+
+variable "codedeploy_bundler_metrics_namespace" {
+  description = "CloudWatch metrics namespace for the bundler's per-stage metrics"
+  type        = string
+  default     = "Ajyal/DeployBundler"
+}
+
+variable "codedeploy_bundler_pipeline_enabled" {
+  description = "Run the bundler as a build -> register -> deploy pipeline over SQS FIFO queues instead of inline in the S3 event"
+  type        = bool
+  default     = false
+}
+
+variable "codedeploy_bundler_pipeline_concurrency" {
+  description = "Maximum concurrent bundler invocations per pipeline stage (SQS event source scaling, 2-1000)"
+  type        = map(number)
+  default = {
+    build    = 5
+    register = 2
+    deploy   = 2
+  }
+
+  validation {
+    condition     = alltrue([for value in values(var.codedeploy_bundler_pipeline_concurrency) : value >= 2 && value <= 1000])
+    error_message = "codedeploy_bundler_pipeline_concurrency values must be between 2 and 1000"
+  }
+}
+
+variable "codedeploy_bundler_pipeline_max_receive_count" {
+  description = "Attempts per pipeline message before it moves to the stage's dead-letter queue"
+  type        = number
+  default     = 3
+}
+
 variable "codedeploy_bundler_log_retention_days" {
   description = "CloudWatch log retention for bundler Lambda"
   type        = number
@@ -3,10 +3,17 @@ Scheduled Stop/Start Lambda for Ajyal LMS Infrastructure
 Manages ASGs, EC2 instances (RabbitMQ), and RDS instances
 """
 
-import boto3
 import json
 import os
 import logging
+import resource as _resource
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 
 # Configure logging
 logger = logging.getLogger()
@@ -15,28 +22,241 @@ logger.setLevel(logging.INFO)
 # Environment variables
 ENVIRONMENT = os.environ.get('ENVIRONMENT', 'preprod')
 REGION = os.environ.get('AWS_REGION', 'eu-west-1')
+MAX_PARALLEL_ACTIONS = int(os.environ.get('MAX_PARALLEL_ACTIONS', '8'))
+# Per-tier stop mode overrides, e.g. {"app": "stopped", "api": "hibernated"}
+try:
+    ASG_STOP_MODES = json.loads(os.environ.get('ASG_STOP_MODES', '{}'))
+except json.JSONDecodeError:
+    logger.error("Invalid ASG_STOP_MODES JSON. Scaling every tier to 0 on stop.")
+    ASG_STOP_MODES = {}
+ASG_SNAPSHOT_PARAMETER = os.environ.get(
+    'ASG_SNAPSHOT_PARAMETER', f'/{ENVIRONMENT}-ajyal/scheduled-ops/asg-snapshot'
+)
 
-# Initialize clients
-autoscaling = boto3.client('autoscaling', region_name=REGION)
-ec2 = boto3.client('ec2', region_name=REGION)
-rds = boto3.client('rds', region_name=REGION)
+# Resource discovery: 'names' uses the naming conventions below, 'tags'
+# manages whatever carries the schedule tag (plus the Environment tag)
+DISCOVERY_MODE = os.environ.get('DISCOVERY_MODE', 'names')
+SCHEDULE_TAG_KEY = os.environ.get('SCHEDULE_TAG_KEY', 'ScheduleGroup')
+SCHEDULE_TAG_VALUE = os.environ.get('SCHEDULE_TAG_VALUE', f'{ENVIRONMENT}-ajyal')
+DISCOVERY_CACHE_TTL_SECONDS = int(os.environ.get('DISCOVERY_CACHE_TTL_SECONDS', '300'))
+
+# Start sequencing: wait for each stage to be ready before starting the next
+WAIT_FOR_READINESS = os.environ.get('WAIT_FOR_READINESS', 'true').lower() == 'true'
+POLL_INTERVAL_SECONDS = int(os.environ.get('POLL_INTERVAL_SECONDS', '15'))
+STAGE_TIMEOUTS = {
+    'backing_services': int(os.environ.get('BACKING_SERVICES_TIMEOUT_SECONDS', '1200')),
+    'app_tiers': int(os.environ.get('APP_TIERS_TIMEOUT_SECONDS', '900')),
+}
+START_DEADLINE_SECONDS = int(os.environ.get('START_DEADLINE_SECONDS', '3600'))
+# Hand over to a new invocation when less than this is left
+CONTINUATION_MARGIN_SECONDS = 30
+
+# AWS clients: adaptive retries, and a per-service cap on in-flight calls
+# that also sizes the connection pool (defaults to MAX_PARALLEL_ACTIONS)
+CLIENT_RETRY_MODE = os.environ.get('CLIENT_RETRY_MODE', 'adaptive')
+CLIENT_MAX_ATTEMPTS = int(os.environ.get('CLIENT_MAX_ATTEMPTS', '8'))
+try:
+    CLIENT_LIMITS = json.loads(os.environ.get('CLIENT_LIMITS', '{}'))
+except json.JSONDecodeError:
+    logger.error("Invalid CLIENT_LIMITS JSON. Using MAX_PARALLEL_ACTIONS for every service.")
+    CLIENT_LIMITS = {}
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException'}
+
+# Per-stage spans, emitted as CloudWatch Embedded Metric Format log lines
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Ajyal/ScheduledOperations')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'scheduled-operations')
+SPAN_METRICS = [
+    ('Duration', 'duration_ms', 'Milliseconds'),
+    ('Resources', 'resources', 'Count'),
+    ('PeakTmpBytes', 'peak_tmp_bytes', 'Bytes'),
+    ('PeakRssBytes', 'peak_rss_bytes', 'Bytes'),
+]
+
+# Per-service call/retry counters, logged at the end of each invocation
+client_stats = {}
+client_stats_lock = threading.Lock()
+
+# Per-stage spans of the current invocation
+spans = {}
+spans_lock = threading.Lock()
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux)"""
+    return _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def tmp_usage_bytes():
+    """Bytes used on the /tmp volume"""
+    try:
+        return shutil.disk_usage(tempfile.gettempdir()).used
+    except OSError:
+        return 0
+
+
+@contextmanager
+def span(stage, resources=0):
+    """Time a stage and add it to the invocation's spans (repeated stages are summed)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        tmp_bytes = tmp_usage_bytes()
+        rss_bytes = peak_rss_bytes()
+        with spans_lock:
+            stats = spans.setdefault(stage, {
+                'count': 0, 'duration_ms': 0.0, 'resources': 0, 'peak_tmp_bytes': 0, 'peak_rss_bytes': 0
+            })
+            stats['count'] += 1
+            stats['duration_ms'] += duration_ms
+            stats['resources'] += resources
+            stats['peak_tmp_bytes'] = max(stats['peak_tmp_bytes'], tmp_bytes)
+            stats['peak_rss_bytes'] = max(stats['peak_rss_bytes'], rss_bytes)
+
+
+def emit_span_metrics(stage_spans):
+    """Print one EMF document per stage; EMF lines must be bare JSON, so no logger prefix"""
+    if not METRICS_ENABLED:
+        return
+    timestamp = int(time.time() * 1000)
+    for stage, stats in stage_spans.items():
+        document = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName', 'Stage']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, _field, unit in SPAN_METRICS]
+                }]
+            },
+            'FunctionName': FUNCTION_NAME,
+            'Environment': ENVIRONMENT,
+            'Stage': stage,
+            'Count': stats['count']
+        }
+        for name, field, _unit in SPAN_METRICS:
+            document[name] = stats[field]
+        print(json.dumps(document, separators=(',', ':')), flush=True)
+
+
+def pop_metrics_summary(started):
+    """Drain the spans, emit them as EMF and return the invocation summary"""
+    with spans_lock:
+        stage_spans = dict(spans)
+        spans.clear()
+    for stats in stage_spans.values():
+        stats['duration_ms'] = round(stats['duration_ms'], 1)
+    emit_span_metrics(stage_spans)
+    return {
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        'peak_tmp_bytes': max([stats['peak_tmp_bytes'] for stats in stage_spans.values()], default=0),
+        'peak_rss_bytes': peak_rss_bytes(),
+        'stages': stage_spans
+    }
+
+
+def record_client_call(service, parsed):
+    """Count one API call and its retries for the retry metrics"""
+    metadata = (parsed or {}).get('ResponseMetadata', {})
+    code = (parsed or {}).get('Error', {}).get('Code')
+    with client_stats_lock:
+        stats = client_stats.setdefault(service, {'calls': 0, 'retries': 0, 'throttled': 0, 'errors': 0})
+        stats['calls'] += 1
+        stats['retries'] += metadata.get('RetryAttempts', 0)
+        if code in THROTTLING_ERROR_CODES:
+            stats['throttled'] += 1
+        elif parsed is None or code:
+            stats['errors'] += 1
+
+
+def make_client(service):
+    """Create a client with adaptive retries, a sized pool, a call cap and retry metrics"""
+    # boto3 is imported on first use to keep it out of the cold-start init
+    import boto3
+    from botocore.config import Config
+
+    limit = int(CLIENT_LIMITS.get(service, MAX_PARALLEL_ACTIONS))
+    client = boto3.client(
+        service,
+        region_name=REGION,
+        config=Config(
+            retries={'mode': CLIENT_RETRY_MODE, 'total_max_attempts': CLIENT_MAX_ATTEMPTS},
+            max_pool_connections=limit
+        )
+    )
+    slots = threading.BoundedSemaphore(limit)
+
+    def acquire(context, **kwargs):
+        slots.acquire()
+        context['client_slot'] = True
+
+    def release(context, parsed=None, **kwargs):
+        if context.pop('client_slot', False):
+            slots.release()
+        record_client_call(service, parsed)
+
+    client.meta.events.register_first('before-call.*.*', acquire)
+    client.meta.events.register('after-call.*.*', release)
+    client.meta.events.register('after-call-error.*.*', release)
+    return client
+
+
+# Clients are built on first use and reused by warm invocations
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(service):
+    """Memoized client for an AWS service"""
+    client = clients.get(service)
+    if client is None:
+        with clients_lock:
+            client = clients.get(service)
+            if client is None:
+                client = clients[service] = make_client(service)
+    return client
+
+
+# Tag-discovered resources, reused by warm invocations until they expire
+_discovery_cache = {'expires_at': 0, 'resources': None}
 
 
 # ASG configurations with their normal running capacities
+# (fallback when stop has not captured a group's live capacity; in tag
+# discovery mode, groups not listed here use the captured capacity only)
+# stop_mode: 'terminate' scales to 0; 'stopped'/'hibernated' parks the
+# instances in a warm pool in that state so start resumes them
 ASG_CONFIGS = {
-    f'{ENVIRONMENT}-ajyal-app-asg': {'min': 2, 'max': 20, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-api-asg': {'min': 2, 'max': 10, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-integration-asg': {'min': 2, 'max': 10, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-logging-asg': {'min': 2, 'max': 4, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-botpress-asg': {'min': 2, 'max': 3, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-ml-asg': {'min': 2, 'max': 4, 'desired': 2},
-    f'{ENVIRONMENT}-ajyal-content-asg': {'min': 2, 'max': 8, 'desired': 2},
+    f'{ENVIRONMENT}-ajyal-app-asg': {'min': 2, 'max': 20, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-api-asg': {'min': 2, 'max': 10, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-integration-asg': {'min': 2, 'max': 10, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-logging-asg': {'min': 2, 'max': 4, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-botpress-asg': {'min': 2, 'max': 3, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-ml-asg': {'min': 2, 'max': 4, 'desired': 2, 'stop_mode': 'terminate'},
+    f'{ENVIRONMENT}-ajyal-content-asg': {'min': 2, 'max': 8, 'desired': 2, 'stop_mode': 'terminate'},
 }
 
+# Start outcomes worth waiting on: resources left stopping, stopped or
+# already available never report ready within the stage (or need not)
+STARTING_ACTIONS = {'started', 'already_starting', 'already_pending'}
+
+# Warm pool states for the parking stop modes
+WARM_POOL_STATES = {'stopped': 'Stopped', 'hibernated': 'Hibernated'}
 
-def get_rabbitmq_instance_id():
-    """Get RabbitMQ EC2 instance ID by tag name"""
-    response = ec2.describe_instances(
+for tier, stop_mode in ASG_STOP_MODES.items():
+    if f'{ENVIRONMENT}-ajyal-{tier}-asg' not in ASG_CONFIGS:
+        logger.warning(f"Ignoring stop mode for unknown tier: {tier}")
+    elif stop_mode != 'terminate' and stop_mode not in WARM_POOL_STATES:
+        logger.warning(f"Ignoring unknown stop mode for {tier}: {stop_mode}")
+    else:
+        ASG_CONFIGS[f'{ENVIRONMENT}-ajyal-{tier}-asg']['stop_mode'] = stop_mode
+
+
+def get_rabbitmq_instance():
+    """Get the RabbitMQ EC2 instance ID and state by tag name"""
+    response = get_client('ec2').describe_instances(
         Filters=[
             {'Name': 'tag:Name', 'Values': [f'{ENVIRONMENT}-ajyal-rabbitmq']},
             {'Name': 'instance-state-name', 'Values': ['running', 'stopped']}
@@ -45,18 +265,46 @@ def get_rabbitmq_instance_id():
 
     for reservation in response.get('Reservations', []):
         for instance in reservation.get('Instances', []):
-            return instance['InstanceId']
+            return {'id': instance['InstanceId'], 'name': 'rabbitmq', 'state': instance['State']['Name']}
     return None
 
 
-def get_rds_instances():
-    """Get all RDS instances matching the environment pattern"""
+def get_ec2_instances(instance_ids):
+    """Get the ID, Name tag and state of the given EC2 instances"""
+    if not instance_ids:
+        return []
+
+    instances = []
+    paginator = get_client('ec2').get_paginator('describe_instances')
+    for page in paginator.paginate(
+        Filters=[
+            {'Name': 'instance-id', 'Values': instance_ids},
+            {'Name': 'instance-state-name', 'Values': ['running', 'stopped']}
+        ]
+    ):
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                instances.append({
+                    'id': instance['InstanceId'],
+                    'name': tags.get('Name', instance['InstanceId']),
+                    'state': instance['State']['Name']
+                })
+    return instances
+
+
+def get_rds_instances(instance_ids=None):
+    """Get the given RDS instances, or all matching the environment pattern"""
+    if instance_ids is not None and not instance_ids:
+        return []
+
     instances = []
-    paginator = rds.get_paginator('describe_db_instances')
+    paginator = get_client('rds').get_paginator('describe_db_instances')
+    kwargs = {'Filters': [{'Name': 'db-instance-id', 'Values': instance_ids}]} if instance_ids else {}
 
-    for page in paginator.paginate():
+    for page in paginator.paginate(**kwargs):
         for db in page['DBInstances']:
-            if f'{ENVIRONMENT}-ajyal' in db['DBInstanceIdentifier']:
+            if instance_ids or f'{ENVIRONMENT}-ajyal' in db['DBInstanceIdentifier']:
                 instances.append({
                     'id': db['DBInstanceIdentifier'],
                     'status': db['DBInstanceStatus'],
@@ -65,14 +313,18 @@ def get_rds_instances():
     return instances
 
 
-def get_rds_clusters():
-    """Get all RDS Aurora clusters matching the environment pattern"""
+def get_rds_clusters(cluster_ids=None):
+    """Get the given RDS Aurora clusters, or all matching the environment pattern"""
+    if cluster_ids is not None and not cluster_ids:
+        return []
+
     clusters = []
-    paginator = rds.get_paginator('describe_db_clusters')
+    paginator = get_client('rds').get_paginator('describe_db_clusters')
+    kwargs = {'Filters': [{'Name': 'db-cluster-id', 'Values': cluster_ids}]} if cluster_ids else {}
 
-    for page in paginator.paginate():
+    for page in paginator.paginate(**kwargs):
         for cluster in page['DBClusters']:
-            if f'{ENVIRONMENT}-ajyal' in cluster['DBClusterIdentifier']:
+            if cluster_ids or f'{ENVIRONMENT}-ajyal' in cluster['DBClusterIdentifier']:
                 clusters.append({
                     'id': cluster['DBClusterIdentifier'],
                     'status': cluster['Status']
@@ -80,9 +332,414 @@ def get_rds_clusters():
     return clusters
 
 
-def stop_services():
-    """Stop all services: ASGs, RabbitMQ EC2, and RDS instances"""
-    results = {
+def discover_tagged_asgs():
+    """Names of the ASGs carrying the schedule and Environment tags"""
+    # ASGs are not covered by the tagging API, but their describe call filters by tag
+    names = []
+    paginator = get_client('autoscaling').get_paginator('describe_auto_scaling_groups')
+    for page in paginator.paginate(
+        Filters=[
+            {'Name': f'tag:{SCHEDULE_TAG_KEY}', 'Values': [SCHEDULE_TAG_VALUE]},
+            {'Name': 'tag:Environment', 'Values': [ENVIRONMENT]}
+        ]
+    ):
+        names.extend(group['AutoScalingGroupName'] for group in page['AutoScalingGroups'])
+    return names
+
+
+def discover_tagged_resources():
+    """EC2 instances, RDS instances and clusters carrying the schedule and Environment tags"""
+    resources = {'ec2': [], 'rds_instances': [], 'rds_clusters': []}
+    paginator = get_client('resourcegroupstaggingapi').get_paginator('get_resources')
+    for page in paginator.paginate(
+        TagFilters=[
+            {'Key': SCHEDULE_TAG_KEY, 'Values': [SCHEDULE_TAG_VALUE]},
+            {'Key': 'Environment', 'Values': [ENVIRONMENT]}
+        ],
+        ResourceTypeFilters=['ec2:instance', 'rds:db', 'rds:cluster']
+    ):
+        for mapping in page['ResourceTagMappingList']:
+            # arn:aws:ec2:...:instance/i-..., arn:aws:rds:...:db:name, arn:aws:rds:...:cluster:name
+            resource = mapping['ResourceARN'].split(':', 5)[5]
+            if resource.startswith('instance/'):
+                resources['ec2'].append(resource.split('/', 1)[1])
+            elif resource.startswith('db:'):
+                resources['rds_instances'].append(resource.split(':', 1)[1])
+            elif resource.startswith('cluster:'):
+                resources['rds_clusters'].append(resource.split(':', 1)[1])
+    return resources
+
+
+def discover_resources():
+    """Tag-discovered ASGs, EC2 instances and RDS resources, cached for the warm container"""
+    if _discovery_cache['resources'] is not None and time.time() < _discovery_cache['expires_at']:
+        return _discovery_cache['resources']
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        asgs = pool.submit(discover_tagged_asgs)
+        resources = pool.submit(discover_tagged_resources)
+        discovered = dict(resources.result(), asgs=asgs.result())
+
+    logger.info(f"Discovered by tag {SCHEDULE_TAG_KEY}={SCHEDULE_TAG_VALUE}: {json.dumps(discovered)}")
+    _discovery_cache['resources'] = discovered
+    _discovery_cache['expires_at'] = time.time() + DISCOVERY_CACHE_TTL_SECONDS
+    return discovered
+
+
+def get_asg_names():
+    """Names of the ASGs to stop/start: tag-discovered or the configured ones"""
+    if DISCOVERY_MODE == 'tags':
+        return discover_resources()['asgs']
+    return list(ASG_CONFIGS)
+
+
+def describe_asgs(asg_names):
+    """Describe ASGs in bulk; returns {name: group}"""
+    names = list(asg_names)
+    groups = {}
+    paginator = get_client('autoscaling').get_paginator('describe_auto_scaling_groups')
+    # DescribeAutoScalingGroups accepts at most 50 names per call
+    for start in range(0, len(names), 50):
+        for page in paginator.paginate(AutoScalingGroupNames=names[start:start + 50]):
+            for group in page['AutoScalingGroups']:
+                groups[group['AutoScalingGroupName']] = group
+    return groups
+
+
+def get_warm_pool(asg_name):
+    """Get an ASG's warm pool settings, or None when it has no warm pool"""
+    response = get_client('autoscaling').describe_warm_pool(AutoScalingGroupName=asg_name)
+    config = response.get('WarmPoolConfiguration')
+    if not config:
+        return None
+    return {
+        key: config[key]
+        for key in ('MinSize', 'MaxGroupPreparedCapacity', 'PoolState', 'InstanceReusePolicy')
+        if key in config
+    }
+
+
+def is_parking_warm_pool(warm_pool, pool_state):
+    """Whether a warm pool has the shape stop_asg gives the pools it creates"""
+    return (
+        warm_pool.get('PoolState') == pool_state
+        and warm_pool.get('MinSize', 0) == 0
+        and warm_pool.get('InstanceReusePolicy', {}).get('ReuseOnScaleIn') is True
+    )
+
+
+def load_asg_snapshot():
+    """Load the ASG capacities captured by the last stop; {} when there is none"""
+    try:
+        response = get_client('ssm').get_parameter(Name=ASG_SNAPSHOT_PARAMETER)
+        return json.loads(response['Parameter']['Value'])
+    except ClientError as e:
+        if 'ParameterNotFound' not in str(e):
+            logger.error(f"Error loading ASG snapshot {ASG_SNAPSHOT_PARAMETER}: {e}")
+    except ValueError as e:
+        logger.error(f"Invalid ASG snapshot in {ASG_SNAPSHOT_PARAMETER}: {e}")
+    return {}
+
+
+def capture_asg_snapshot(asg_names):
+    """Save each running ASG's capacity, suspended processes and warm pool to SSM"""
+    snapshot = load_asg_snapshot()
+    groups = describe_asgs(asg_names)
+
+    # Groups that are already scaled to 0 keep the values captured before
+    running = [group for group in groups.values() if group['DesiredCapacity'] > 0]
+    warm_pools = run_phase([group['AutoScalingGroupName'] for group in running], get_warm_pool)
+    for group, warm_pool in zip(running, warm_pools):
+        asg_name = group['AutoScalingGroupName']
+        pool_state = WARM_POOL_STATES.get(ASG_CONFIGS.get(asg_name, {}).get('stop_mode'))
+        # A parking pool an earlier start failed to delete is the stop's, not the group's
+        if warm_pool and snapshot.get(asg_name, {}).get('parking_warm_pool') and is_parking_warm_pool(warm_pool, pool_state):
+            warm_pool = None
+        parking_warm_pool = warm_pool is None and pool_state is not None
+        snapshot[asg_name] = {
+            'min': group['MinSize'],
+            'max': group['MaxSize'],
+            'desired': group['DesiredCapacity'],
+            'suspended_processes': sorted(p['ProcessName'] for p in group.get('SuspendedProcesses', [])),
+            'warm_pool': warm_pool,
+            # Stop parks this group in a warm pool it did not have; start removes it
+            'parking_warm_pool': parking_warm_pool
+        }
+
+    get_client('ssm').put_parameter(
+        Name=ASG_SNAPSHOT_PARAMETER,
+        Value=json.dumps(snapshot, sort_keys=True),
+        Type='String',
+        # Tag discovery can outgrow the 4 KB Standard limit; Intelligent-Tiering
+        # only switches to Advanced when the value needs it
+        Tier='Intelligent-Tiering',
+        Overwrite=True
+    )
+    logger.info(f"Captured ASG snapshot for {len(running)} groups in {ASG_SNAPSHOT_PARAMETER}")
+    return snapshot
+
+
+def collect_inventory():
+    """Snapshot RDS clusters, RDS instances and EC2 instances (with states) in one concurrent pass"""
+    if DISCOVERY_MODE == 'tags':
+        # Discovery yields identifiers, so the describe calls filter server-side
+        discovered = discover_resources()
+        lookups = {
+            'rds_clusters': lambda: get_rds_clusters(discovered['rds_clusters']),
+            'rds_instances': lambda: get_rds_instances(discovered['rds_instances']),
+            'ec2': lambda: get_ec2_instances(discovered['ec2'])
+        }
+    else:
+        # DescribeDBInstances/DescribeDBClusters cannot filter by tag or name prefix,
+        # so each is scanned once here and every phase works from this snapshot
+        lookups = {
+            'rds_clusters': get_rds_clusters,
+            'rds_instances': get_rds_instances,
+            'ec2': lambda: list(filter(None, [get_rabbitmq_instance()]))
+        }
+
+    with span('inventory'), ThreadPoolExecutor(max_workers=len(lookups)) as pool:
+        futures = {key: pool.submit(lookup) for key, lookup in lookups.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def run_phase(items, action):
+    """Run action(item) for every item concurrently; outcomes come back in item order"""
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(MAX_PARALLEL_ACTIONS, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(action, items))
+
+
+def merge_outcomes(results, outcomes):
+    """Append (category, entry) outcomes to the results dict, skipping empty ones"""
+    for outcome in outcomes:
+        if outcome:
+            category, entry = outcome
+            results[category].append(entry)
+
+
+def is_not_found(error):
+    """Whether a ClientError reports a missing group or warm pool"""
+    code = error.response.get('Error', {}).get('Code', '')
+    message = error.response.get('Error', {}).get('Message', '').lower()
+    if code == 'AutoScalingGroupNotFound':
+        return True
+    # Auto Scaling reports missing resources as ValidationError
+    return code == 'ValidationError' and ('not found' in message or 'does not exist' in message)
+
+
+def scale_asg(asg_name, min_size, max_size, desired, action, not_found_action):
+    """Update one ASG's capacity and return its (category, entry) outcome"""
+    try:
+        get_client('autoscaling').update_auto_scaling_group(
+            AutoScalingGroupName=asg_name,
+            MinSize=min_size,
+            MaxSize=max_size,
+            DesiredCapacity=desired
+        )
+        logger.info(f"Scaled ASG {asg_name}: min={min_size}, max={max_size}, desired={desired}")
+        return 'asgs', {'name': asg_name, 'action': action, 'status': 'success'}
+    except ClientError as e:
+        if is_not_found(e):
+            logger.warning(f"ASG not found: {asg_name}")
+            return 'asgs', {'name': asg_name, 'action': not_found_action, 'status': 'not_found'}
+        logger.error(f"Error scaling ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error scaling ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+
+
+def stop_asg(target):
+    """Scale one ASG down to 0, parking its instances in a warm pool if configured"""
+    asg_name, capacity = target
+    config = ASG_CONFIGS.get(asg_name, {})
+    pool_state = WARM_POOL_STATES.get(config.get('stop_mode'))
+    if pool_state is None:
+        return scale_asg(asg_name, 0, 0, 0, 'scaled_to_0', 'scaled_to_0')
+
+    # Size the pool to the running capacity and reuse instances on scale-in,
+    # so scaling to 0 stops (or hibernates) them instead of terminating them.
+    # MaxSize is kept: the pool is sized relative to the group's maximum.
+    capacity = capacity or config
+    try:
+        get_client('autoscaling').put_warm_pool(
+            AutoScalingGroupName=asg_name,
+            MaxGroupPreparedCapacity=capacity['desired'],
+            MinSize=0,
+            PoolState=pool_state,
+            InstanceReusePolicy={'ReuseOnScaleIn': True}
+        )
+    except ClientError as e:
+        if is_not_found(e):
+            logger.warning(f"ASG not found: {asg_name}")
+            return 'asgs', {'name': asg_name, 'action': 'scaled_to_0', 'status': 'not_found'}
+        logger.error(f"Error creating warm pool for ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error creating warm pool for ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+
+    return scale_asg(
+        asg_name, 0, capacity['max'], 0,
+        f"parked_{capacity['desired']}_{config['stop_mode']}", 'scaled_to_0'
+    )
+
+
+def restore_asg_settings(asg_name, capacity, group):
+    """Reapply the captured suspended processes and warm pool to one ASG"""
+    autoscaling = get_client('autoscaling')
+    wanted = set(capacity['suspended_processes'])
+    current = {p['ProcessName'] for p in group.get('SuspendedProcesses', [])}
+    if current - wanted:
+        autoscaling.resume_processes(AutoScalingGroupName=asg_name, ScalingProcesses=sorted(current - wanted))
+    if wanted - current:
+        autoscaling.suspend_processes(AutoScalingGroupName=asg_name, ScalingProcesses=sorted(wanted - current))
+    if capacity.get('warm_pool'):
+        autoscaling.put_warm_pool(AutoScalingGroupName=asg_name, **capacity['warm_pool'])
+
+
+def start_asg(target):
+    """Scale one ASG back up to its captured (or default) capacity"""
+    asg_name, capacity, group = target
+    restore_error = None
+    # Settings go first so a restored warm pool is in place before scale-out
+    if group is not None and 'suspended_processes' in capacity:
+        try:
+            restore_asg_settings(asg_name, capacity, group)
+        except Exception as e:
+            logger.error(f"Error restoring settings for ASG {asg_name}: {e}")
+            restore_error = str(e)
+
+    outcome = scale_asg(
+        asg_name, capacity['min'], capacity['max'], capacity['desired'],
+        f"scaled_to_{capacity['desired']}", 'scale_up'
+    )
+    if restore_error and outcome[0] == 'asgs':
+        return 'errors', {'resource': asg_name, 'error': restore_error}
+    return outcome
+
+
+def delete_parking_warm_pool(asg_name):
+    """Remove the warm pool a stop added to an ASG that had none"""
+    try:
+        # The group is back in service, so only surplus stopped instances go
+        get_client('autoscaling').delete_warm_pool(AutoScalingGroupName=asg_name, ForceDelete=True)
+        logger.info(f"Deleted parking warm pool of ASG {asg_name}")
+        return 'asgs', {'name': asg_name, 'action': 'warm_pool_deleted', 'status': 'success'}
+    except ClientError as e:
+        if is_not_found(e):
+            logger.info(f"ASG {asg_name} has no parking warm pool left")
+            return None
+        logger.error(f"Error deleting warm pool for ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error deleting warm pool for ASG {asg_name}: {e}")
+        return 'errors', {'resource': asg_name, 'error': str(e)}
+
+
+def stop_ec2_instance(instance):
+    """Stop one EC2 instance (e.g. RabbitMQ) if it is running"""
+    instance_id, name = instance['id'], instance['name']
+    try:
+        if instance['state'] == 'running':
+            get_client('ec2').stop_instances(InstanceIds=[instance_id])
+            logger.info(f"Stopped {name} instance: {instance_id}")
+            return 'ec2', {'id': instance_id, 'name': name, 'action': 'stopped', 'status': 'success'}
+        logger.info(f"{name} instance already stopped: {instance_id}")
+        return 'ec2', {'id': instance_id, 'name': name, 'action': 'already_stopped', 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error stopping {name}: {e}")
+        return 'errors', {'resource': name, 'error': str(e)}
+
+
+def start_ec2_instance(instance):
+    """Start one EC2 instance (e.g. RabbitMQ) if it is stopped"""
+    instance_id, name, state = instance['id'], instance['name'], instance['state']
+    try:
+        if state == 'stopped':
+            get_client('ec2').start_instances(InstanceIds=[instance_id])
+            logger.info(f"Started {name} instance: {instance_id}")
+            return 'ec2', {'id': instance_id, 'name': name, 'action': 'started', 'status': 'success'}
+        logger.info(f"{name} instance already in state {state}: {instance_id}")
+        return 'ec2', {'id': instance_id, 'name': name, 'action': f'already_{state}', 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error starting {name}: {e}")
+        return 'errors', {'resource': name, 'error': str(e)}
+
+
+def stop_rds_cluster(cluster):
+    """Stop one Aurora cluster if it is available"""
+    try:
+        if cluster['status'] == 'available':
+            get_client('rds').stop_db_cluster(DBClusterIdentifier=cluster['id'])
+            logger.info(f"Stopped RDS cluster: {cluster['id']}")
+            return 'rds_clusters', {'id': cluster['id'], 'action': 'stopped', 'status': 'success'}
+        logger.info(f"RDS cluster already in state {cluster['status']}: {cluster['id']}")
+        return 'rds_clusters', {'id': cluster['id'], 'action': f"already_{cluster['status']}", 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error stopping RDS cluster {cluster['id']}: {e}")
+        return 'errors', {'resource': cluster['id'], 'error': str(e)}
+
+
+def start_rds_cluster(cluster):
+    """Start one Aurora cluster if it is stopped"""
+    try:
+        if cluster['status'] == 'stopped':
+            get_client('rds').start_db_cluster(DBClusterIdentifier=cluster['id'])
+            logger.info(f"Started RDS cluster: {cluster['id']}")
+            return 'rds_clusters', {'id': cluster['id'], 'action': 'started', 'status': 'success'}
+        logger.info(f"RDS cluster already in state {cluster['status']}: {cluster['id']}")
+        return 'rds_clusters', {'id': cluster['id'], 'action': f"already_{cluster['status']}", 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error starting RDS cluster {cluster['id']}: {e}")
+        return 'errors', {'resource': cluster['id'], 'error': str(e)}
+
+
+def stop_rds_instance(instance):
+    """Stop one standalone RDS instance if it is available"""
+    # Skip Aurora cluster members - they're stopped with the cluster
+    if instance['is_cluster_member']:
+        logger.info(f"Skipping Aurora cluster member: {instance['id']}")
+        return None
+
+    try:
+        if instance['status'] == 'available':
+            get_client('rds').stop_db_instance(DBInstanceIdentifier=instance['id'])
+            logger.info(f"Stopped RDS instance: {instance['id']}")
+            return 'rds_instances', {'id': instance['id'], 'action': 'stopped', 'status': 'success'}
+        logger.info(f"RDS instance already in state {instance['status']}: {instance['id']}")
+        return 'rds_instances', {'id': instance['id'], 'action': f"already_{instance['status']}", 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error stopping RDS instance {instance['id']}: {e}")
+        return 'errors', {'resource': instance['id'], 'error': str(e)}
+
+
+def start_rds_instance(instance):
+    """Start one standalone RDS instance if it is stopped"""
+    # Skip Aurora cluster members - they start with the cluster
+    if instance['is_cluster_member']:
+        logger.info(f"Skipping Aurora cluster member: {instance['id']}")
+        return None
+
+    try:
+        if instance['status'] == 'stopped':
+            get_client('rds').start_db_instance(DBInstanceIdentifier=instance['id'])
+            logger.info(f"Started RDS instance: {instance['id']}")
+            return 'rds_instances', {'id': instance['id'], 'action': 'started', 'status': 'success'}
+        logger.info(f"RDS instance already in state {instance['status']}: {instance['id']}")
+        return 'rds_instances', {'id': instance['id'], 'action': f"already_{instance['status']}", 'status': 'skipped'}
+    except Exception as e:
+        logger.error(f"Error starting RDS instance {instance['id']}: {e}")
+        return 'errors', {'resource': instance['id'], 'error': str(e)}
+
+
+def new_results():
+    """Empty results structure shared by stop and start"""
+    return {
         'asgs': [],
         'ec2': [],
         'rds_instances': [],
@@ -90,187 +747,261 @@ def stop_services():
         'errors': []
     }
 
-    # 1. Scale down ASGs to 0
-    logger.info("Scaling down ASGs...")
-    for asg_name in ASG_CONFIGS.keys():
+
+def stop_services():
+    """Stop all services: ASGs, RabbitMQ EC2, and RDS instances"""
+    results = new_results()
+    asg_names = get_asg_names()
+
+    # Take the RDS/RabbitMQ snapshot while the ASGs scale down
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending_inventory = pool.submit(collect_inventory)
+
+        # Remember live ASG capacities so start can restore them
+        logger.info("Capturing ASG capacities...")
+        snapshot = {}
         try:
-            autoscaling.update_auto_scaling_group(
-                AutoScalingGroupName=asg_name,
-                MinSize=0,
-                MaxSize=0,
-                DesiredCapacity=0
-            )
-            results['asgs'].append({'name': asg_name, 'action': 'scaled_to_0', 'status': 'success'})
-            logger.info(f"Scaled down ASG: {asg_name}")
-        except autoscaling.exceptions.ClientError as e:
-            if 'AutoScalingGroupNotFound' in str(e):
-                logger.warning(f"ASG not found: {asg_name}")
-                results['asgs'].append({'name': asg_name, 'action': 'scaled_to_0', 'status': 'not_found'})
-            else:
-                logger.error(f"Error scaling ASG {asg_name}: {e}")
-                results['errors'].append({'resource': asg_name, 'error': str(e)})
+            with span('asg_snapshot', len(asg_names)):
+                snapshot = capture_asg_snapshot(asg_names)
         except Exception as e:
-            logger.error(f"Error scaling ASG {asg_name}: {e}")
-            results['errors'].append({'resource': asg_name, 'error': str(e)})
+            logger.error(f"Error capturing ASG snapshot: {e}")
+            results['errors'].append({'resource': ASG_SNAPSHOT_PARAMETER, 'error': str(e)})
+
+        # 1. Scale down ASGs to 0 (or park them in their warm pools)
+        logger.info("Scaling down ASGs...")
+        targets = [(asg_name, snapshot.get(asg_name)) for asg_name in asg_names]
+        with span('asgs', len(targets)):
+            merge_outcomes(results, run_phase(targets, stop_asg))
+
+        inventory = pending_inventory.result()
 
-    # 2. Stop RabbitMQ EC2 instance
+    # 2. Stop RabbitMQ (and any other scheduled EC2 instances)
     logger.info("Stopping RabbitMQ EC2 instance...")
-    rabbitmq_id = get_rabbitmq_instance_id()
-    if rabbitmq_id:
-        try:
-            # Check current state
-            response = ec2.describe_instances(InstanceIds=[rabbitmq_id])
-            state = response['Reservations'][0]['Instances'][0]['State']['Name']
-
-            if state == 'running':
-                ec2.stop_instances(InstanceIds=[rabbitmq_id])
-                results['ec2'].append({'id': rabbitmq_id, 'name': 'rabbitmq', 'action': 'stopped', 'status': 'success'})
-                logger.info(f"Stopped RabbitMQ instance: {rabbitmq_id}")
-            else:
-                results['ec2'].append({'id': rabbitmq_id, 'name': 'rabbitmq', 'action': 'already_stopped', 'status': 'skipped'})
-                logger.info(f"RabbitMQ instance already stopped: {rabbitmq_id}")
-        except Exception as e:
-            logger.error(f"Error stopping RabbitMQ: {e}")
-            results['errors'].append({'resource': 'rabbitmq', 'error': str(e)})
-    else:
+    if inventory['ec2']:
+        with span('ec2', len(inventory['ec2'])):
+            merge_outcomes(results, run_phase(inventory['ec2'], stop_ec2_instance))
+    elif DISCOVERY_MODE != 'tags':
         logger.warning("RabbitMQ instance not found")
         results['ec2'].append({'name': 'rabbitmq', 'action': 'not_found', 'status': 'skipped'})
 
     # 3. Stop RDS Aurora clusters first (before stopping member instances)
     logger.info("Stopping RDS Aurora clusters...")
-    clusters = get_rds_clusters()
-    for cluster in clusters:
-        try:
-            if cluster['status'] == 'available':
-                rds.stop_db_cluster(DBClusterIdentifier=cluster['id'])
-                results['rds_clusters'].append({'id': cluster['id'], 'action': 'stopped', 'status': 'success'})
-                logger.info(f"Stopped RDS cluster: {cluster['id']}")
-            else:
-                results['rds_clusters'].append({'id': cluster['id'], 'action': f"already_{cluster['status']}", 'status': 'skipped'})
-                logger.info(f"RDS cluster already in state {cluster['status']}: {cluster['id']}")
-        except Exception as e:
-            logger.error(f"Error stopping RDS cluster {cluster['id']}: {e}")
-            results['errors'].append({'resource': cluster['id'], 'error': str(e)})
+    with span('rds_clusters', len(inventory['rds_clusters'])):
+        merge_outcomes(results, run_phase(inventory['rds_clusters'], stop_rds_cluster))
 
     # 4. Stop standalone RDS instances (not Aurora cluster members)
     logger.info("Stopping RDS instances...")
-    instances = get_rds_instances()
-    for instance in instances:
-        # Skip Aurora cluster members - they're stopped with the cluster
-        if instance['is_cluster_member']:
-            logger.info(f"Skipping Aurora cluster member: {instance['id']}")
-            continue
-
-        try:
-            if instance['status'] == 'available':
-                rds.stop_db_instance(DBInstanceIdentifier=instance['id'])
-                results['rds_instances'].append({'id': instance['id'], 'action': 'stopped', 'status': 'success'})
-                logger.info(f"Stopped RDS instance: {instance['id']}")
-            else:
-                results['rds_instances'].append({'id': instance['id'], 'action': f"already_{instance['status']}", 'status': 'skipped'})
-                logger.info(f"RDS instance already in state {instance['status']}: {instance['id']}")
-        except Exception as e:
-            logger.error(f"Error stopping RDS instance {instance['id']}: {e}")
-            results['errors'].append({'resource': instance['id'], 'error': str(e)})
+    with span('rds_instances', len(inventory['rds_instances'])):
+        merge_outcomes(results, run_phase(inventory['rds_instances'], stop_rds_instance))
 
     return results
 
 
-def start_services():
-    """Start all services: RDS instances, RabbitMQ EC2, and ASGs"""
-    results = {
-        'asgs': [],
-        'ec2': [],
-        'rds_instances': [],
-        'rds_clusters': [],
-        'errors': []
-    }
+def start_backing_services(results):
+    """Start RDS clusters, standalone RDS instances and RabbitMQ; return what to wait for"""
+    inventory = collect_inventory()
 
     # 1. Start RDS Aurora clusters first
     logger.info("Starting RDS Aurora clusters...")
-    clusters = get_rds_clusters()
-    for cluster in clusters:
-        try:
-            if cluster['status'] == 'stopped':
-                rds.start_db_cluster(DBClusterIdentifier=cluster['id'])
-                results['rds_clusters'].append({'id': cluster['id'], 'action': 'started', 'status': 'success'})
-                logger.info(f"Started RDS cluster: {cluster['id']}")
-            else:
-                results['rds_clusters'].append({'id': cluster['id'], 'action': f"already_{cluster['status']}", 'status': 'skipped'})
-                logger.info(f"RDS cluster already in state {cluster['status']}: {cluster['id']}")
-        except Exception as e:
-            logger.error(f"Error starting RDS cluster {cluster['id']}: {e}")
-            results['errors'].append({'resource': cluster['id'], 'error': str(e)})
+    with span('rds_clusters', len(inventory['rds_clusters'])):
+        cluster_outcomes = run_phase(inventory['rds_clusters'], start_rds_cluster)
+    merge_outcomes(results, cluster_outcomes)
 
     # 2. Start standalone RDS instances
     logger.info("Starting RDS instances...")
-    instances = get_rds_instances()
-    for instance in instances:
-        # Skip Aurora cluster members - they start with the cluster
-        if instance['is_cluster_member']:
-            logger.info(f"Skipping Aurora cluster member: {instance['id']}")
-            continue
-
-        try:
-            if instance['status'] == 'stopped':
-                rds.start_db_instance(DBInstanceIdentifier=instance['id'])
-                results['rds_instances'].append({'id': instance['id'], 'action': 'started', 'status': 'success'})
-                logger.info(f"Started RDS instance: {instance['id']}")
-            else:
-                results['rds_instances'].append({'id': instance['id'], 'action': f"already_{instance['status']}", 'status': 'skipped'})
-                logger.info(f"RDS instance already in state {instance['status']}: {instance['id']}")
-        except Exception as e:
-            logger.error(f"Error starting RDS instance {instance['id']}: {e}")
-            results['errors'].append({'resource': instance['id'], 'error': str(e)})
+    with span('rds_instances', len(inventory['rds_instances'])):
+        instance_outcomes = run_phase(inventory['rds_instances'], start_rds_instance)
+    merge_outcomes(results, instance_outcomes)
 
-    # 3. Start RabbitMQ EC2 instance
+    # 3. Start RabbitMQ (and any other scheduled EC2 instances)
     logger.info("Starting RabbitMQ EC2 instance...")
-    rabbitmq_id = get_rabbitmq_instance_id()
-    if rabbitmq_id:
-        try:
-            response = ec2.describe_instances(InstanceIds=[rabbitmq_id])
-            state = response['Reservations'][0]['Instances'][0]['State']['Name']
-
-            if state == 'stopped':
-                ec2.start_instances(InstanceIds=[rabbitmq_id])
-                results['ec2'].append({'id': rabbitmq_id, 'name': 'rabbitmq', 'action': 'started', 'status': 'success'})
-                logger.info(f"Started RabbitMQ instance: {rabbitmq_id}")
-            else:
-                results['ec2'].append({'id': rabbitmq_id, 'name': 'rabbitmq', 'action': f'already_{state}', 'status': 'skipped'})
-                logger.info(f"RabbitMQ instance already in state {state}: {rabbitmq_id}")
-        except Exception as e:
-            logger.error(f"Error starting RabbitMQ: {e}")
-            results['errors'].append({'resource': 'rabbitmq', 'error': str(e)})
-    else:
+    with span('ec2', len(inventory['ec2'])):
+        ec2_outcomes = run_phase(inventory['ec2'], start_ec2_instance)
+    merge_outcomes(results, ec2_outcomes)
+    if not inventory['ec2'] and DISCOVERY_MODE != 'tags':
         logger.warning("RabbitMQ instance not found")
         results['ec2'].append({'name': 'rabbitmq', 'action': 'not_found', 'status': 'skipped'})
 
-    # 4. Scale up ASGs to normal capacity
+    return {
+        'rds_clusters': starting_ids(cluster_outcomes, 'rds_clusters'),
+        'rds_instances': starting_ids(instance_outcomes, 'rds_instances'),
+        'ec2': starting_ids(ec2_outcomes, 'ec2'),
+    }
+
+
+def starting_ids(outcomes, category):
+    """Ids of the resources in outcomes that are on their way up, so worth waiting for"""
+    return [
+        entry['id'] for outcome_category, entry in filter(None, outcomes)
+        if outcome_category == category and entry['action'] in STARTING_ACTIONS
+    ]
+
+
+def start_app_tiers(results):
+    """Scale ASGs back up; return the groups and capacities to wait for"""
+    # 4. Scale up ASGs to the capacity captured at stop, or the defaults
     logger.info("Scaling up ASGs...")
-    for asg_name, config in ASG_CONFIGS.items():
-        try:
-            autoscaling.update_auto_scaling_group(
-                AutoScalingGroupName=asg_name,
-                MinSize=config['min'],
-                MaxSize=config['max'],
-                DesiredCapacity=config['desired']
-            )
-            results['asgs'].append({
-                'name': asg_name,
-                'action': f"scaled_to_{config['desired']}",
-                'status': 'success'
+    asg_names = get_asg_names()
+    with span('asg_snapshot', len(asg_names)):
+        snapshot = load_asg_snapshot()
+        groups = describe_asgs(asg_names) if snapshot else {}
+    capacities = {}
+    for asg_name in asg_names:
+        if asg_name in snapshot:
+            capacities[asg_name] = snapshot[asg_name]
+        elif asg_name in ASG_CONFIGS:
+            logger.info(f"No captured capacity for ASG {asg_name}, using defaults")
+            capacities[asg_name] = ASG_CONFIGS[asg_name]
+        else:
+            logger.warning(f"No captured or default capacity for ASG {asg_name}, leaving it as is")
+            results['asgs'].append({'name': asg_name, 'action': 'no_capacity', 'status': 'skipped'})
+
+    targets = [(asg_name, capacity, groups.get(asg_name)) for asg_name, capacity in capacities.items()]
+    with span('asgs', len(targets)):
+        outcomes = run_phase(targets, start_asg)
+    merge_outcomes(results, outcomes)
+
+    return {
+        'asgs': [
+            [entry['name'], capacities[entry['name']]['desired']]
+            for category, entry in filter(None, outcomes)
+            if category == 'asgs' and entry['status'] == 'success'
+        ]
+    }
+
+
+def release_parking_warm_pools(results):
+    """Delete parking warm pools of the ASGs that were scaled back up; nothing to wait for"""
+    snapshot = load_asg_snapshot()
+    asg_names = sorted({
+        entry['name'] for entry in results['asgs']
+        if entry['status'] == 'success' and snapshot.get(entry['name'], {}).get('parking_warm_pool')
+    })
+    with span('warm_pools', len(asg_names)):
+        merge_outcomes(results, run_phase(asg_names, delete_parking_warm_pool))
+    return {}
+
+
+# Start stages in dependency order: data and messaging before app tiers, and
+# parking warm pools only once the app tiers have drawn their instances out
+START_STAGES = [
+    ('backing_services', start_backing_services),
+    ('app_tiers', start_app_tiers),
+    ('warm_pools', release_parking_warm_pools),
+]
+
+
+def is_ready(check):
+    """Readiness probe for one (category, resource) pair"""
+    category, resource = check
+    try:
+        if category == 'rds_clusters':
+            cluster = get_client('rds').describe_db_clusters(DBClusterIdentifier=resource)['DBClusters'][0]
+            return cluster['Status'] == 'available'
+        if category == 'rds_instances':
+            db = get_client('rds').describe_db_instances(DBInstanceIdentifier=resource)['DBInstances'][0]
+            return db['DBInstanceStatus'] == 'available'
+        if category == 'ec2':
+            response = get_client('ec2').describe_instances(InstanceIds=[resource])
+            return response['Reservations'][0]['Instances'][0]['State']['Name'] == 'running'
+        if category == 'asgs':
+            asg_name, desired = resource
+            response = get_client('autoscaling').describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
+            instances = response['AutoScalingGroups'][0].get('Instances', [])
+            in_service = [
+                instance for instance in instances
+                if instance['LifecycleState'] == 'InService' and instance.get('HealthStatus') == 'Healthy'
+            ]
+            return len(in_service) >= desired
+    except Exception as e:
+        logger.warning(f"Readiness check failed for {resource}: {e}")
+    return False
+
+
+def pending_resources(waiting):
+    """Poll every waited-on resource concurrently; return the ones not ready yet"""
+    checks = [(category, resource) for category, resources in waiting.items() for resource in resources]
+    pending = {}
+    for (category, resource), ready in zip(checks, run_phase(checks, is_ready)):
+        if not ready:
+            pending.setdefault(category, []).append(resource)
+    return pending
+
+
+def wait_for_stage(state, stage_deadline, context):
+    """Poll until the stage is ready; returns 'ready', 'timeout' or 'continue'"""
+    while True:
+        state['waiting'] = pending_resources(state['waiting'])
+        if not state['waiting']:
+            return 'ready'
+
+        now = time.time()
+        if now >= stage_deadline:
+            return 'timeout'
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            remaining = context.get_remaining_time_in_millis() / 1000
+            if remaining < POLL_INTERVAL_SECONDS + CONTINUATION_MARGIN_SECONDS:
+                return 'continue'
+
+        logger.info(f"Waiting for: {json.dumps(state['waiting'])}")
+        time.sleep(min(POLL_INTERVAL_SECONDS, max(0, stage_deadline - now)))
+
+
+def continue_in_new_invocation(state, context):
+    """Re-invoke this function asynchronously to carry on waiting"""
+    logger.info(f"Continuing start sequence in a new invocation at stage {state['stage']}")
+    get_client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'action': 'start', 'continuation': state}, default=str)
+    )
+
+
+def start_services(context=None, continuation=None):
+    """Start all services: RDS instances and RabbitMQ, then ASGs once they are ready"""
+    if not WAIT_FOR_READINESS:
+        results = new_results()
+        for _name, start_stage in START_STAGES:
+            start_stage(results)
+        return results
+
+    state = continuation or {
+        'stage': 0,
+        'started_at': time.time(),
+        'stage_started_at': None,
+        'waiting': {},
+        'results': dict(new_results(), stages=[])
+    }
+    results = state['results']
+    deadline = state['started_at'] + START_DEADLINE_SECONDS
+
+    while state['stage'] < len(START_STAGES):
+        name, start_stage = START_STAGES[state['stage']]
+        if state['stage_started_at'] is None:
+            logger.info(f"Starting stage: {name}")
+            state['stage_started_at'] = time.time()
+            state['waiting'] = start_stage(results)
+
+        stage_deadline = min(state['stage_started_at'] + STAGE_TIMEOUTS.get(name, 0), deadline)
+        with span(f'wait_{name}', sum(len(resources) for resources in state['waiting'].values())):
+            status = wait_for_stage(state, stage_deadline, context)
+        if status == 'continue':
+            continue_in_new_invocation(state, context)
+            results['in_progress'] = True
+            return results
+
+        duration = round(time.time() - state['stage_started_at'], 1)
+        results['stages'].append({'stage': name, 'status': status, 'duration_seconds': duration})
+        logger.info(f"Stage {name} finished with status {status} after {duration}s")
+        if status != 'ready':
+            results['errors'].append({
+                'resource': f'stage:{name}',
+                'error': f"Not ready after {duration}s: {json.dumps(state['waiting'])}"
             })
-            logger.info(f"Scaled up ASG {asg_name}: min={config['min']}, max={config['max']}, desired={config['desired']}")
-        except autoscaling.exceptions.ClientError as e:
-            if 'AutoScalingGroupNotFound' in str(e):
-                logger.warning(f"ASG not found: {asg_name}")
-                results['asgs'].append({'name': asg_name, 'action': 'scale_up', 'status': 'not_found'})
-            else:
-                logger.error(f"Error scaling ASG {asg_name}: {e}")
-                results['errors'].append({'resource': asg_name, 'error': str(e)})
-        except Exception as e:
-            logger.error(f"Error scaling ASG {asg_name}: {e}")
-            results['errors'].append({'resource': asg_name, 'error': str(e)})
+
+        state['stage'] += 1
+        state['stage_started_at'] = None
+        state['waiting'] = {}
 
     return results
 
@@ -281,6 +1012,9 @@ def lambda_handler(event, context):
     Event should contain: {"action": "stop"} or {"action": "start"}
     """
     logger.info(f"Received event: {json.dumps(event)}")
+    started = time.perf_counter()
+    with spans_lock:
+        spans.clear()
 
     # Determine action from event
     action = event.get('action', '').lower()
@@ -305,8 +1039,12 @@ def lambda_handler(event, context):
         results = stop_services()
         message = "Services stopped successfully"
     elif action == 'start':
-        logger.info("Executing START operation...")
-        results = start_services()
+        continuation = event.get('continuation')
+        if continuation:
+            logger.info(f"Resuming START operation at stage {continuation.get('stage')}...")
+        else:
+            logger.info("Executing START operation...")
+        results = start_services(context, continuation)
         message = "Services started successfully"
     else:
         error_msg = f"Invalid action: {action}. Must be 'stop' or 'start'"
@@ -317,19 +1055,28 @@ def lambda_handler(event, context):
         }
 
     # Check for errors
-    if results.get('errors'):
+    if results.get('in_progress'):
+        message = "Start sequence still in progress; continued in a new invocation"
+        status_code = 202
+    elif results.get('errors'):
         message = f"{message} with {len(results['errors'])} error(s)"
         status_code = 207  # Multi-Status
     else:
         status_code = 200
 
+    with client_stats_lock:
+        logger.info(f"AWS client calls: {json.dumps(client_stats, sort_keys=True)}")
+        client_stats.clear()
+    metrics = pop_metrics_summary(started)
+
     response = {
         'statusCode': status_code,
         'body': json.dumps({
             'message': message,
             'action': action,
             'environment': ENVIRONMENT,
-            'results': results
+            'results': results,
+            'metrics': metrics
         }, default=str)
     }
 
@@ -9,6 +9,36 @@ data "aws_region" "current" {}
 locals {
   function_name = "${var.environment}-ajyal-scheduled-operations"
   lambda_zip    = "${path.module}/lambda.zip"
+
+  # Live ASG capacities captured at stop and restored at start
+  asg_snapshot_parameter = "/${var.environment}-ajyal/scheduled-ops/asg-snapshot"
+
+  schedule_tag_value = var.schedule_tag_value != "" ? var.schedule_tag_value : "${var.environment}-ajyal"
+
+  # Tag discovery manages databases whatever their name, so start/stop is
+  # gated on the schedule and Environment tags instead of the name pattern
+  rds_tag_statement = var.discovery_mode == "tags" ? [
+    {
+      Sid    = "RDSTagged"
+      Effect = "Allow"
+      Action = [
+        "rds:StartDBInstance",
+        "rds:StopDBInstance",
+        "rds:StartDBCluster",
+        "rds:StopDBCluster"
+      ]
+      Resource = [
+        "arn:aws:rds:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:db:*",
+        "arn:aws:rds:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:cluster:*"
+      ]
+      Condition = {
+        StringEquals = {
+          "aws:ResourceTag/${var.schedule_tag_key}" = local.schedule_tag_value
+          "aws:ResourceTag/Environment"             = var.environment
+        }
+      }
+    }
+  ] : []
 }
 
 #######################################
@@ -40,7 +70,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Sid    = "CloudWatchLogs"
         Effect = "Allow"
@@ -56,7 +86,11 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Effect = "Allow"
         Action = [
           "autoscaling:UpdateAutoScalingGroup",
-          "autoscaling:DescribeAutoScalingGroups"
+          "autoscaling:DescribeAutoScalingGroups",
+          "autoscaling:SuspendProcesses",
+          "autoscaling:ResumeProcesses",
+          "autoscaling:PutWarmPool",
+          "autoscaling:DeleteWarmPool"
         ]
         Resource = "*"
         Condition = {
@@ -69,7 +103,8 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Sid    = "AutoScalingDescribe"
         Effect = "Allow"
         Action = [
-          "autoscaling:DescribeAutoScalingGroups"
+          "autoscaling:DescribeAutoScalingGroups",
+          "autoscaling:DescribeWarmPool"
         ]
         Resource = "*"
       },
@@ -120,8 +155,33 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "rds:DescribeDBClusters"
         ]
         Resource = "*"
+      },
+      {
+        Sid    = "TagDiscovery"
+        Effect = "Allow"
+        Action = [
+          "tag:GetResources"
+        ]
+        Resource = "*"
+      },
+      {
+        Sid    = "ASGSnapshot"
+        Effect = "Allow"
+        Action = [
+          "ssm:GetParameter",
+          "ssm:PutParameter"
+        ]
+        Resource = "arn:aws:ssm:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:parameter${local.asg_snapshot_parameter}"
+      },
+      {
+        Sid    = "SelfInvoke"
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${local.function_name}"
       }
-    ]
+    ], local.rds_tag_statement)
   })
 }
 
@@ -147,7 +207,21 @@ resource "aws_lambda_function" "scheduled_ops" {
 
   environment {
     variables = {
-      ENVIRONMENT = var.environment
+      ENVIRONMENT                      = var.environment
+      MAX_PARALLEL_ACTIONS             = tostring(var.max_parallel_actions)
+      CLIENT_LIMITS                    = jsonencode(var.client_limits)
+      METRICS_ENABLED                  = tostring(var.metrics_enabled)
+      METRICS_NAMESPACE                = var.metrics_namespace
+      WAIT_FOR_READINESS               = tostring(var.wait_for_readiness)
+      POLL_INTERVAL_SECONDS            = tostring(var.readiness_poll_interval_seconds)
+      BACKING_SERVICES_TIMEOUT_SECONDS = tostring(var.backing_services_timeout_seconds)
+      APP_TIERS_TIMEOUT_SECONDS        = tostring(var.app_tiers_timeout_seconds)
+      START_DEADLINE_SECONDS           = tostring(var.start_deadline_seconds)
+      ASG_SNAPSHOT_PARAMETER           = local.asg_snapshot_parameter
+      ASG_STOP_MODES                   = jsonencode(var.asg_stop_modes)
+      DISCOVERY_MODE                   = var.discovery_mode
+      SCHEDULE_TAG_KEY                 = var.schedule_tag_key
+      SCHEDULE_TAG_VALUE               = local.schedule_tag_value
     }
   }
 
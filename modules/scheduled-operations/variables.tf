@@ -21,6 +21,94 @@ variable "start_cron_expression" {
   default     = "cron(0 4 * * ? *)"  # Daily at 04:00 UTC (7 AM Jordan)
 }
 
+variable "max_parallel_actions" {
+  description = "Maximum number of independent resource actions (per phase) run concurrently by the Lambda"
+  type        = number
+  default     = 8
+}
+
+variable "discovery_mode" {
+  description = "How the Lambda finds the resources to stop/start: 'names' (naming conventions) or 'tags' (schedule tag + Environment tag)"
+  type        = string
+  default     = "names"
+
+  validation {
+    condition     = contains(["names", "tags"], var.discovery_mode)
+    error_message = "discovery_mode must be 'names' or 'tags'."
+  }
+}
+
+variable "schedule_tag_key" {
+  description = "Tag key marking ASGs, EC2 instances and RDS resources for the schedule when discovery_mode = \"tags\""
+  type        = string
+  default     = "ScheduleGroup"
+}
+
+variable "schedule_tag_value" {
+  description = "Tag value marking resources for the schedule. Empty means \"<environment>-ajyal\""
+  type        = string
+  default     = ""
+}
+
+variable "asg_stop_modes" {
+  description = "Per-tier stop mode (e.g. { app = \"stopped\" }): 'terminate' scales to 0, 'stopped' or 'hibernated' parks the instances in a warm pool so start resumes them. Hibernated requires hibernation-enabled launch templates"
+  type        = map(string)
+  default     = {}
+
+  validation {
+    condition     = alltrue([for mode in values(var.asg_stop_modes) : contains(["terminate", "stopped", "hibernated"], mode)])
+    error_message = "Stop modes must be 'terminate', 'stopped' or 'hibernated'."
+  }
+}
+
+variable "client_limits" {
+  description = "Per-service cap on in-flight AWS calls (and connection pool size), e.g. { autoscaling = 4 }. Unlisted services use max_parallel_actions"
+  type        = map(number)
+  default     = {}
+}
+
+variable "metrics_enabled" {
+  description = "Emit per-stage spans (duration, resource count, peak /tmp and RSS) as CloudWatch Embedded Metric Format logs"
+  type        = bool
+  default     = true
+}
+
+variable "metrics_namespace" {
+  description = "CloudWatch metrics namespace for the per-stage metrics"
+  type        = string
+  default     = "Ajyal/ScheduledOperations"
+}
+
+variable "wait_for_readiness" {
+  description = "Start in stages: wait for RDS and RabbitMQ to be available before scaling up the ASGs, then wait for InService instances"
+  type        = bool
+  default     = true
+}
+
+variable "readiness_poll_interval_seconds" {
+  description = "Seconds between readiness polls during the staged start"
+  type        = number
+  default     = 15
+}
+
+variable "backing_services_timeout_seconds" {
+  description = "Maximum seconds to wait for RDS and RabbitMQ to become available before moving on to the ASGs"
+  type        = number
+  default     = 1200
+}
+
+variable "app_tiers_timeout_seconds" {
+  description = "Maximum seconds to wait for ASG instances to reach InService"
+  type        = number
+  default     = 900
+}
+
+variable "start_deadline_seconds" {
+  description = "Overall deadline for the staged start, across self-invoked continuations"
+  type        = number
+  default     = 3600
+}
+
 variable "tags" {
   description = "Tags to apply to all resources"
   type        = map(string)
@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the deploy-bundler Lambda.
+
+Generates synthetic .NET publish zips (plain service folders, the
+WebSocketFullFiles layout and the "S3 Publish" layout), then runs
+handler.handler against local S3, CodeDeploy and SSM stand-ins injected
+through the handler's client cache. Reports throughput, peak /tmp, peak RSS
+and per-stage times. Each run is a fresh subprocess, so peak RSS is per run.
+
+Usage:
+  scripts/benchmark-deploy-bundler.py                          # small + websocket, both modes
+  scripts/benchmark-deploy-bundler.py --profiles large --modes stream
+  scripts/benchmark-deploy-bundler.py --output bench.json      # save results
+  scripts/benchmark-deploy-bundler.py --baseline bench.json    # fail (exit 1) on regressions
+
+Fixtures are cached under --work-dir and reused by later runs. Needs boto3
+(and with it botocore): the handler imports botocore.exceptions, and
+boto3.s3.transfer for its TransferConfig.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+BUNDLER_DIR = REPO_ROOT / "modules" / "cicd" / "lambda" / "deploy-bundler"
+GENERATOR_VERSION = 1
+MB = 1024 * 1024
+BUCKET = "bench-artifacts"
+SOURCE_PREFIX = "windows/bench/"
+OUTPUT_PREFIX = "codedeploy/windows/bench/"
+
+# size_mb is the uncompressed payload of all sources together.
+PROFILES = {
+    "small": {"layout": "service", "sources": 1, "size_mb": 8, "files": 400},
+    "websocket": {"layout": "websocket", "sources": 1, "size_mb": 96, "files": 3000, "services": 6},
+    "s3publish": {"layout": "s3publish", "sources": 1, "size_mb": 48, "files": 1500},
+    "bundle-all": {"layout": "service", "sources": 8, "size_mb": 320, "files": 6000},
+    "large": {"layout": "websocket", "sources": 1, "size_mb": 2048, "files": 12000, "services": 10},
+    "xlarge": {"layout": "websocket", "sources": 4, "size_mb": 6144, "files": 24000, "services": 12},
+}
+DEFAULT_PROFILES = "small,websocket"
+MODES = ("extract", "stream")
+
+BINARY_SUFFIXES = (".dll", ".pdb", ".exe", ".so", ".png", ".woff2")
+TEXT_SUFFIXES = (".json", ".xml", ".js", ".css", ".config", ".cshtml", ".deps.json")
+CONFIG_FILES = ("appsettings.json", "web.config", "ocelot.json", "SystemSettingsSqlDbAccess.xml")
+
+
+# --------------------------------------------------------------------------
+# Synthetic publish trees
+# --------------------------------------------------------------------------
+
+
+class _ContentPool:
+    """Deterministic filler: random bytes for binaries, repetitive text for the rest.
+
+    Members are slices of two pools at random offsets, so generating GBs is
+    I/O bound while the compression ratios stay close to real publish output.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.binary = rng.randbytes(8 * MB)
+        words = [
+            b"public", b"static", b"async", b"Task", b"return", b"namespace", b"using",
+            b"System", b"Microsoft", b"Extensions", b"function", b"const", b"var",
+            b"<add key=", b"value=", b"\"version\":", b"\"dependencies\":", b"{", b"}",
+        ]
+        text = bytearray()
+        while len(text) < 4 * MB:
+            text += rng.choice(words) + (b"\n" if rng.random() < 0.1 else b" ")
+        self.text = bytes(text)
+
+    def chunks(self, size, binary):
+        pool = self.binary if binary else self.text
+        offset = self.rng.randrange(len(pool))
+        while size > 0:
+            take = min(size, len(pool) - offset, MB)
+            yield pool[offset : offset + take]
+            size -= take
+            offset = (offset + take) % len(pool)
+
+
+def _service_files(rng, service, count, root):
+    """Relative paths of a .NET publish folder with count files."""
+    files = [(f"{root}/{service}.dll", True), (f"{root}/{service}.deps.json", False)]
+    files += [(f"{root}/{name}", False) for name in CONFIG_FILES]
+    while len(files) < count:
+        roll = rng.random()
+        stem = f"{rng.choice(('System', 'Microsoft', 'Ajyal', 'Newtonsoft'))}.Part{len(files)}"
+        if roll < 0.45:
+            files.append((f"{root}/{stem}{rng.choice(BINARY_SUFFIXES[:3])}", True))
+        elif roll < 0.6:
+            files.append((f"{root}/runtimes/win-x64/native/{stem}.dll", True))
+        elif roll < 0.7:
+            files.append((f"{root}/{rng.choice(('de', 'fr', 'ar'))}/{stem}.resources.dll", True))
+        elif roll < 0.9:
+            folder = rng.choice(("js", "css", "lib", "images"))
+            binary = folder == "images"
+            suffix = rng.choice(BINARY_SUFFIXES[4:] if binary else TEXT_SUFFIXES[2:4])
+            files.append((f"{root}/wwwroot/{folder}/{stem}{suffix}", binary))
+        else:
+            files.append((f"{root}/{stem}{rng.choice(TEXT_SUFFIXES)}", False))
+    return files[:count]
+
+
+def _layout_files(rng, spec, source_idx, count):
+    layout = spec["layout"]
+    if layout == "websocket":
+        services = spec.get("services", 4)
+        per_service = max(1, count // services)
+        files = []
+        for idx in range(services):
+            root = f"publish/WebSocketFullFiles/Ajyal.Socket{source_idx}_{idx}"
+            files += _service_files(rng, f"Ajyal.Socket{idx}", per_service, root)
+        return files
+    if layout == "s3publish":
+        # Only the first (sorted) folder under "S3 Publish" is deployed.
+        files = _service_files(rng, "FileMgmtS3", count - 10, "publish/S3 Publish/net8.0")
+        files += _service_files(rng, "FileMgmtS3", 10, "publish/S3 Publish/zz-stale")
+        return files
+    service = f"Ajyal.Service{source_idx}"
+    return _service_files(rng, service, count, f"publish/{service}")
+
+
+def _file_sizes(rng, count, total_bytes):
+    # Log-normal sizes (lots of small files, a few large ones) scaled to the total.
+    weights = [rng.lognormvariate(0, 1.6) for _ in range(count)]
+    scale = total_bytes / sum(weights)
+    return [max(1, int(weight * scale)) for weight in weights]
+
+
+def _generate_source(path, spec, source_idx, compresslevel):
+    rng = random.Random(f"{json.dumps(spec, sort_keys=True)}:{source_idx}")
+    pool = _ContentPool(rng)
+    count = max(len(CONFIG_FILES) + 2, spec["files"] // spec["sources"])
+    total_bytes = int(spec["size_mb"] * MB / spec["sources"])
+    files = _layout_files(rng, spec, source_idx, count)
+    sizes = _file_sizes(rng, len(files), total_bytes)
+
+    partial = path.with_suffix(".partial")
+    with zipfile.ZipFile(
+        partial, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+    ) as archive:
+        for (arcname, binary), size in zip(files, sizes):
+            if arcname.rsplit("/", 1)[-1] in CONFIG_FILES:
+                archive.writestr(arcname, json.dumps({"ConnectionStrings": {"Default": arcname}}))
+                continue
+            info = zipfile.ZipInfo(arcname, date_time=(2024, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, "w", force_zip64=size > 2000 * MB) as dest:
+                for chunk in pool.chunks(size, binary):
+                    dest.write(chunk)
+    partial.rename(path)
+
+
+def _fixture(work_dir, profile, spec, compresslevel):
+    """Generate (or reuse) the source zips for a profile; returns {key: path}."""
+    digest = hashlib.sha256(
+        json.dumps([GENERATOR_VERSION, spec, compresslevel], sort_keys=True).encode("utf-8")
+    ).hexdigest()[:12]
+    fixture_dir = work_dir / "fixtures" / f"{profile}-{digest}"
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    sources = {}
+    for idx in range(spec["sources"]):
+        name = f"Ajyal.Service{idx}.zip"
+        path = fixture_dir / name
+        if not path.exists():
+            print(f"Generating {profile} source {idx + 1}/{spec['sources']}: {path}", flush=True)
+            _generate_source(path, spec, idx, compresslevel)
+        sources[f"{SOURCE_PREFIX}{name}"] = str(path)
+    return sources
+
+
+# --------------------------------------------------------------------------
+# Local AWS stand-ins
+# --------------------------------------------------------------------------
+
+
+def _client_error(code, operation, status=400):
+    from botocore.exceptions import ClientError  # pylint: disable=import-outside-toplevel
+
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation,
+    )
+
+
+class LocalS3:
+    """Disk-backed S3 covering the calls the bundler makes.
+
+    latency_ms is added to every request and mbps caps transfer speed, to
+    approximate in-region S3 instead of local disk.
+    """
+
+    def __init__(self, root, latency_ms=0.0, mbps=0.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.latency = latency_ms / 1000.0
+        self.bytes_per_second = mbps * MB
+        self.objects = {}
+        self.lock = threading.Lock()
+        # Serialises conditional writes, so check-then-store is atomic
+        self.write_lock = threading.Lock()
+        self.requests = 0
+
+    def _wait(self, size=0):
+        with self.lock:
+            self.requests += 1
+        delay = self.latency
+        if self.bytes_per_second:
+            delay += size / self.bytes_per_second
+        if delay:
+            time.sleep(delay)
+
+    def _get(self, bucket, key, operation):
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            code = "404" if operation == "HeadObject" else "NoSuchKey"
+            raise _client_error(code, operation, 404)
+        return obj
+
+    def _check_etag(self, obj, operation, if_match=None, if_none_match=None):
+        # Same outcomes as S3 conditional requests: 404 when IfMatch names a
+        # missing object, 412 when the ETag condition does not hold
+        if if_none_match == "*" and obj is not None:
+            raise _client_error("PreconditionFailed", operation, 412)
+        if if_match is not None:
+            if obj is None:
+                raise _client_error("NoSuchKey", operation, 404)
+            if if_match.strip('"') != obj["etag"].strip('"'):
+                raise _client_error("PreconditionFailed", operation, 412)
+
+    def _store(self, bucket, key, source, metadata=None):
+        path = self.root / hashlib.sha1(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+        hasher = hashlib.md5()
+        size = 0
+        with open(path, "wb") as dest:
+            while True:
+                chunk = source.read(MB)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                dest.write(chunk)
+                size += len(chunk)
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                "path": path,
+                "size": size,
+                "etag": f'"{hasher.hexdigest()}"',
+                "metadata": dict(metadata or {}),
+                "last_modified": time.time(),
+            }
+        return self.objects[(bucket, key)]
+
+    def seed(self, bucket, key, file_path):
+        with open(file_path, "rb") as source:
+            self._store(bucket, key, source)
+
+    # Data plane
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, "wb") as dest:
+            self.download_fileobj(Bucket, Key, dest, ExtraArgs, Callback, Config)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None):
+        obj = self._get(Bucket, Key, "GetObject")
+        self._wait(obj["size"])
+        with open(obj["path"], "rb") as source:
+            while True:
+                chunk = source.read(MB)
+                if not chunk:
+                    break
+                Fileobj.write(chunk)
+                if Callback:
+                    Callback(len(chunk))
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        obj = self._store(Bucket, Key, Fileobj, (ExtraArgs or {}).get("Metadata"))
+        self._wait(obj["size"])
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None, Callback=None, SourceClient=None, Config=None):
+        source = self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        self._check_etag(source, "CopyObject", if_match=(ExtraArgs or {}).get("CopySourceIfMatch"))
+        self._wait()
+        with open(source["path"], "rb") as handle:
+            self._store(Bucket, Key, handle, (ExtraArgs or {}).get("Metadata", source["metadata"]))
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, IfMatch=None, IfNoneMatch=None, **_kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        with self.write_lock:
+            self._check_etag(self.objects.get((Bucket, Key)), "PutObject", IfMatch, IfNoneMatch)
+            obj = self._store(Bucket, Key, Body if hasattr(Body, "read") else io.BytesIO(Body), Metadata)
+        self._wait(obj["size"])
+        return {"ETag": obj["etag"]}
+
+    def get_object(self, Bucket, Key, **_kwargs):
+        obj = self._get(Bucket, Key, "GetObject")
+        self._wait(obj["size"])
+        with open(obj["path"], "rb") as handle:
+            body = handle.read()
+        return {
+            "Body": io.BytesIO(body),
+            "ETag": obj["etag"],
+            "ContentLength": obj["size"],
+            "Metadata": obj["metadata"],
+        }
+
+    def head_object(self, Bucket, Key, **_kwargs):
+        obj = self._get(Bucket, Key, "HeadObject")
+        self._wait()
+        return {"ETag": obj["etag"], "ContentLength": obj["size"], "Metadata": obj["metadata"]}
+
+    def delete_object(self, Bucket, Key, **_kwargs):
+        self._wait()
+        with self.lock:
+            obj = self.objects.pop((Bucket, Key), None)
+        if obj:
+            obj["path"].unlink(missing_ok=True)
+        return {}
+
+    def get_paginator(self, operation):
+        if operation != "list_objects_v2":
+            raise NotImplementedError(operation)
+        return _ListObjectsPaginator(self)
+
+
+class _ListObjectsPaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix="", **_kwargs):
+        keys = sorted(key for bucket, key in list(self.s3.objects) if bucket == Bucket and key.startswith(Prefix))
+        for start in range(0, max(1, len(keys)), 1000):
+            self.s3._wait()  # pylint: disable=protected-access
+            page = []
+            for key in keys[start : start + 1000]:
+                obj = self.s3.objects[(Bucket, key)]
+                page.append({"Key": key, "ETag": obj["etag"], "Size": obj["size"]})
+            yield {"Contents": page, "KeyCount": len(page)}
+
+
+class LocalCodeDeploy:
+    def __init__(self):
+        self.applications = set()
+        self.groups = {}
+        self.deployments = []
+
+    def get_application(self, applicationName):
+        if applicationName not in self.applications:
+            raise _client_error("ApplicationDoesNotExistException", "GetApplication")
+        return {"application": {"applicationName": applicationName}}
+
+    def create_application(self, applicationName, **_kwargs):
+        self.applications.add(applicationName)
+        return {"applicationId": applicationName}
+
+    def get_deployment_group(self, applicationName, deploymentGroupName):
+        group = self.groups.get((applicationName, deploymentGroupName))
+        if group is None:
+            raise _client_error("DeploymentGroupDoesNotExistException", "GetDeploymentGroup")
+        return {"deploymentGroupInfo": group}
+
+    def create_deployment_group(self, applicationName, deploymentGroupName, **kwargs):
+        group = dict(kwargs, applicationName=applicationName, deploymentGroupName=deploymentGroupName)
+        group["autoScalingGroups"] = [{"name": name} for name in kwargs.get("autoScalingGroups", [])]
+        self.groups[(applicationName, deploymentGroupName)] = group
+        return {"deploymentGroupId": deploymentGroupName}
+
+    def update_deployment_group(self, applicationName, currentDeploymentGroupName, **kwargs):
+        return self.create_deployment_group(applicationName, currentDeploymentGroupName, **kwargs)
+
+    def register_application_revision(self, applicationName, revision, **_kwargs):
+        return {}
+
+    def create_deployment(self, **kwargs):
+        # Deployments complete instantly, so there is never an active one.
+        deployment_id = f"d-BENCH{len(self.deployments):05d}"
+        self.deployments.append(dict(kwargs, deploymentId=deployment_id, status="Succeeded"))
+        group = self.groups.get((kwargs["applicationName"], kwargs["deploymentGroupName"]))
+        if group is not None:
+            group["targetRevision"] = kwargs["revision"]
+            group["lastAttemptedDeployment"] = {"deploymentId": deployment_id, "status": "Succeeded"}
+        return {"deploymentId": deployment_id}
+
+    def get_paginator(self, operation):
+        if operation != "list_deployments":
+            raise NotImplementedError(operation)
+        return _ListDeploymentsPaginator(self)
+
+    def batch_get_deployments(self, deploymentIds):
+        return {
+            "deploymentsInfo": [
+                deployment for deployment in self.deployments if deployment["deploymentId"] in deploymentIds
+            ]
+        }
+
+    def stop_deployment(self, deploymentId, **_kwargs):
+        return {"status": "Succeeded"}
+
+
+class _ListDeploymentsPaginator:
+    def __init__(self, codedeploy):
+        self.codedeploy = codedeploy
+
+    def paginate(self, applicationName, deploymentGroupName, includeOnlyStatuses=(), **_kwargs):
+        yield {
+            "deployments": [
+                deployment["deploymentId"]
+                for deployment in self.codedeploy.deployments
+                if deployment["applicationName"] == applicationName
+                and deployment["deploymentGroupName"] == deploymentGroupName
+                and deployment["status"] in includeOnlyStatuses
+            ]
+        }
+
+
+class LocalSSM:
+    def __init__(self):
+        self.parameters = {}
+
+    def get_parameters(self, Names, **_kwargs):
+        return {
+            "Parameters": [{"Name": name} for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+    def put_parameter(self, Name, Value, Overwrite=False, **_kwargs):
+        if Name in self.parameters and not Overwrite:
+            raise _client_error("ParameterAlreadyExists", "PutParameter")
+        self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+# --------------------------------------------------------------------------
+# Single run (child process)
+# --------------------------------------------------------------------------
+
+
+class _DiskSampler(threading.Thread):
+    """Polls the bytes allocated under a directory; keeps the peak."""
+
+    def __init__(self, path, interval):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def usage(self):
+        total = 0
+        stack = [self.path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                total += entry.stat(follow_symlinks=False).st_blocks * 512
+                        except FileNotFoundError:
+                            continue
+            except FileNotFoundError:
+                continue
+        return total
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.usage())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, self.usage())
+        return self.peak
+
+
+def _config(spec, mode):
+    return {
+        SOURCE_PREFIX: {
+            "template": "api-server",
+            "output_prefix": OUTPUT_PREFIX,
+            "bundle_all": spec["sources"] > 1,
+            "bundle_mode": mode,
+            "bundle_cache": False,
+            "incremental": False,
+            "app_name_prefix": "bench-api",
+            "asg_name": "bench-api-asg",
+            "ssm_base_path": "/bench/secrets/api-services",
+            "seed_ssm": True,
+        }
+    }
+
+
+def run_one(args):
+    """Run the handler once against the stand-ins and write the measurements."""
+    job = json.loads(args.run_one)
+    spec = job["spec"]
+    run_dir = Path(job["run_dir"])
+    os.environ.update(
+        {
+            "PREFIX_CONFIG": json.dumps(_config(spec, job["mode"])),
+            "CODEDEPLOY_SERVICE_ROLE_ARN": "arn:aws:iam::000000000000:role/bench-codedeploy",
+            "METRICS_ENABLED": "false",
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    os.environ.update(job.get("env", {}))
+    sys.path.insert(0, str(BUNDLER_DIR))
+    import handler  # pylint: disable=import-outside-toplevel,import-error
+
+    s3 = LocalS3(run_dir / "s3", job["s3_latency_ms"], job["s3_mbps"])
+    for key, path in job["sources"].items():
+        s3.seed(BUCKET, key, path)
+    codedeploy = LocalCodeDeploy()
+    handler._CLIENTS.update(  # pylint: disable=protected-access
+        {"s3": s3, "codedeploy": codedeploy, "ssm": LocalSSM()}
+    )
+
+    trigger = sorted(job["sources"])[-1]
+    event = {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": trigger}}}]}
+    sampler = _DiskSampler(tempfile.gettempdir(), job["sample_interval"])
+    sampler.start()
+    started = time.perf_counter()
+    response = handler.handler(event, None)
+    duration = time.perf_counter() - started
+    peak_tmp = sampler.stop()
+
+    result = response["results"][0]
+    if result["status"] != "ok":
+        raise SystemExit(f"Bundler failed: {result['detail']}")
+    source_bytes = sum(os.path.getsize(path) for path in job["sources"].values())
+    output = s3.objects[(BUCKET, result["detail"])]
+    stages = response["metrics"]["stages"]
+    measurement = {
+        "profile": job["profile"],
+        "mode": job["mode"],
+        "sources": len(job["sources"]),
+        "source_bytes": source_bytes,
+        "bundle_bytes": output["size"],
+        "bundle_files": stages.get("zip", {}).get("files", 0),
+        "duration_s": round(duration, 3),
+        "throughput_mb_s": round(source_bytes / MB / duration, 1),
+        "peak_tmp_bytes": peak_tmp,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "s3_requests": s3.requests,
+        "deployments": len(codedeploy.deployments),
+        "stages": {stage: stats["duration_ms"] for stage, stats in stages.items()},
+    }
+    Path(job["result"]).write_text(json.dumps(measurement), encoding="utf-8")
+
+
+# --------------------------------------------------------------------------
+# Driver
+# --------------------------------------------------------------------------
+
+
+def _run_job(args, work_dir, profile, spec, mode, sources):
+    runs = []
+    for attempt in range(args.repeat):
+        run_dir = Path(tempfile.mkdtemp(prefix=f"{profile}-{mode}-", dir=work_dir / "runs"))
+        tmp_dir = run_dir / "tmp"
+        tmp_dir.mkdir()
+        job = {
+            "profile": profile,
+            "spec": spec,
+            "mode": mode,
+            "sources": sources,
+            "run_dir": str(run_dir),
+            "result": str(run_dir / "result.json"),
+            "s3_latency_ms": args.s3_latency_ms,
+            "s3_mbps": args.s3_mbps,
+            "sample_interval": args.sample_interval,
+            "env": dict(item.split("=", 1) for item in args.env),
+        }
+        try:
+            subprocess.run(
+                [sys.executable, __file__, "--run-one", json.dumps(job)],
+                check=True,
+                env=dict(os.environ, TMPDIR=str(tmp_dir)),
+            )
+            runs.append(json.loads(Path(job["result"]).read_text(encoding="utf-8")))
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        print(f"  {profile}/{mode} run {attempt + 1}: {runs[-1]['duration_s']}s", flush=True)
+
+    # Report the median run; peaks are the worst seen across runs.
+    runs.sort(key=lambda run: run["duration_s"])
+    median = dict(runs[len(runs) // 2])
+    median["runs"] = [run["duration_s"] for run in runs]
+    median["duration_s"] = round(statistics.median(median["runs"]), 3)
+    median["peak_tmp_bytes"] = max(run["peak_tmp_bytes"] for run in runs)
+    median["peak_rss_bytes"] = max(run["peak_rss_bytes"] for run in runs)
+    return median
+
+
+def _print_report(measurements):
+    header = f"{'profile':<12} {'mode':<8} {'source MB':>10} {'time s':>8} {'MB/s':>7} {'peak tmp MB':>12} {'peak RSS MB':>12}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for item in measurements:
+        print(
+            f"{item['profile']:<12} {item['mode']:<8} {item['source_bytes'] / MB:>10.1f} "
+            f"{item['duration_s']:>8.2f} {item['throughput_mb_s']:>7.1f} "
+            f"{item['peak_tmp_bytes'] / MB:>12.1f} {item['peak_rss_bytes'] / MB:>12.1f}"
+        )
+    print()
+    for item in measurements:
+        stages = ", ".join(f"{stage} {ms / 1000:.2f}s" for stage, ms in item["stages"].items())
+        print(f"{item['profile']}/{item['mode']}: {stages}")
+
+
+def _regressions(measurements, baseline_path, tolerance):
+    baseline = {
+        (item["profile"], item["mode"]): item
+        for item in json.loads(Path(baseline_path).read_text(encoding="utf-8"))["measurements"]
+    }
+    failures = []
+    for item in measurements:
+        previous = baseline.get((item["profile"], item["mode"]))
+        if not previous:
+            continue
+        for field in ("duration_s", "peak_tmp_bytes", "peak_rss_bytes"):
+            limit = previous[field] * (1 + tolerance)
+            if previous[field] and item[field] > limit:
+                failures.append(
+                    f"{item['profile']}/{item['mode']} {field}: {item[field]} > {previous[field]} "
+                    f"(+{(item[field] / previous[field] - 1) * 100:.0f}%)"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES, help=f"comma-separated, from: {', '.join(PROFILES)}")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated bundle modes")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per profile/mode; the median is reported")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "deploy-bundler-bench"))
+    parser.add_argument("--compresslevel", type=int, default=6, help="deflate level of the synthetic sources")
+    parser.add_argument("--s3-latency-ms", type=float, default=0.0, help="added to every S3 request")
+    parser.add_argument("--s3-mbps", type=float, default=0.0, help="S3 transfer cap in MB/s (0 = disk speed)")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="seconds between /tmp samples")
+    parser.add_argument("--env", action="append", default=[], help="extra handler env var, NAME=VALUE")
+    parser.add_argument("--output", help="write the measurements as JSON")
+    parser.add_argument("--baseline", help="JSON from a previous --output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed slowdown/growth vs baseline")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args)
+        return 0
+
+    work_dir = Path(args.work_dir)
+    (work_dir / "runs").mkdir(parents=True, exist_ok=True)
+    measurements = []
+    for profile in filter(None, args.profiles.split(",")):
+        if profile not in PROFILES:
+            parser.error(f"unknown profile: {profile}")
+        spec = PROFILES[profile]
+        sources = _fixture(work_dir, profile, spec, args.compresslevel)
+        for mode in filter(None, args.modes.split(",")):
+            if mode not in MODES:
+                parser.error(f"unknown mode: {mode}")
+            measurements.append(_run_job(args, work_dir, profile, spec, mode, sources))
+
+    _print_report(measurements)
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps({"generated_at": time.time(), "measurements": measurements}, indent=2),
+            encoding="utf-8",
+        )
+    if args.baseline:
+        failures = _regressions(measurements, args.baseline, args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())